@@ -0,0 +1,1427 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Benchmarks for the network storage and processing
+#
+# usage: python3 -m kismon.benchmark <name> [count]
+
+import gc
+import json
+import locale
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.parsers.expat
+
+import kismon.logger
+from kismon.crypt import encode_cryptset
+
+logger = kismon.logger.get_logger('warning')
+
+network_types = ('infrastructure', 'client', 'ad-hoc', 'unknown')
+cryptsets = (0, 2, 226, 706, 738, 1024, 1474)
+crypt_strings = ('none', 'WEP', 'WEP,TKIP,WPA,PSK', 'WEP,WPA,PSK,AES_CCM', 'WEP,TKIP,WPA,PSK,AES_CCM',
+                 'AES_OCB', 'WEP,WPA,PSK,AES_CCM,ISAKMP')
+manufs = ('Unknown', 'AVM GmbH', 'TP-LINK TECHNOLOGIES CO.,LTD.', 'Apple, Inc.', 'Cisco Systems, Inc')
+servers = ('http://127.0.0.1:2501', 'http://drone1:2501', 'http://drone2:2501')
+
+
+def synthetic_mac(num):
+    return ':'.join('%02X' % ((num >> shift) & 0xff) for shift in (40, 32, 24, 16, 8, 0))
+
+
+def synthetic_networks(count, seed=1):
+    """Generate (mac, network dict) pairs in the networks.json layout
+    """
+    rnd = random.Random(seed)
+    start = 1500000000
+    for num in range(count):
+        crypt = rnd.randrange(len(cryptsets))
+        firsttime = start + rnd.randrange(86400 * 365)
+        signal = rnd.randrange(-95, -30)
+        if rnd.random() < 0.9:
+            lat = 52.0 + rnd.random()
+            lon = 13.0 + rnd.random()
+        else:
+            lat = 0.0
+            lon = 0.0
+        yield synthetic_mac(num + 1), {
+            "type": network_types[rnd.randrange(len(network_types))],
+            "channel": rnd.choice((1, 6, 11, 36, 44)),
+            "firsttime": firsttime,
+            "lasttime": firsttime + rnd.randrange(86400),
+            "lat": lat,
+            "lon": lon,
+            "manuf": manufs[rnd.randrange(len(manufs))],
+            "ssid": "network-%s" % rnd.randrange(count),
+            "cryptset": cryptsets[crypt],
+            "crypt": crypt_strings[crypt],
+            "signal_dbm": {"min": signal - 10, "max": signal + 5, "last": signal},
+            "comment": "",
+            "servers": [servers[rnd.randrange(len(servers))]],
+            "codename": "",
+        }
+
+
+def loaded_dicts(count):
+    """Synthetic networks as json.load would create them,
+    without any shared strings between the networks.
+    """
+    networks = {}
+    chunk = {}
+    for mac, network in synthetic_networks(count):
+        chunk[mac] = network
+        if len(chunk) == 10000:
+            networks.update(json.loads(json.dumps(chunk)))
+            chunk = {}
+    networks.update(json.loads(json.dumps(chunk)))
+    return networks
+
+
+def measure_memory(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def benchmark_memory(count=500000):
+    """Memory usage of the dict based layout compared to the NetworkStore
+    """
+    from kismon.store import NetworkStore
+
+    def build_store():
+        store = NetworkStore()
+        for mac, network in loaded_dicts(count).items():
+            store[mac] = network
+        return store
+
+    networks, dict_size = measure_memory(lambda: loaded_dicts(count))
+    del networks
+    store, store_size = measure_memory(build_store)
+    del store
+
+    print("%s networks" % count)
+    print("dict layout:   %8.1f MB, %5.0f bytes per network" % (dict_size / 1024 / 1024, dict_size / count))
+    print("network store: %8.1f MB, %5.0f bytes per network" % (store_size / 1024 / 1024, store_size / count))
+    print("saved:         %8.1f%%" % (100 - 100.0 * store_size / dict_size))
+
+
+def peak_rss():
+    """Peak RSS in kB, ru_maxrss survives the exec of a subprocess on Linux
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def storage_run(backend, filename):
+    """Load and filter the networks in a fresh process, prints the results as json
+    """
+    from kismon.store import NetworkStore, NetworkQuery, network_object_hook, upgrade_network
+    from kismon.sqlstore import SQLiteNetworkStore
+
+    query = NetworkQuery(excluded_types=('client',), excluded_crypts=('none', 'wep'), has_position=True)
+    start = time.time()
+    if backend == "json":
+        networks = NetworkStore()
+        with open(filename) as f:
+            networks.update(json.load(f, object_hook=network_object_hook))
+        for network in networks.values():
+            upgrade_network(network)
+    else:
+        networks = SQLiteNetworkStore(filename)
+    load_time = time.time() - start
+
+    start = time.time()
+    if backend == "json":
+        macs = [mac for mac, network in networks.items() if query.matches(mac, network)]
+    else:
+        macs = networks.select_macs(query)
+    filter_time = time.time() - start
+
+    print(json.dumps({
+        "load": load_time,
+        "filter": filter_time,
+        "matches": len(macs),
+        "rss": peak_rss(),
+    }))
+
+
+def benchmark_storage(count=200000):
+    """Load time, filter time and peak RSS of networks.json compared to the SQLite store
+    """
+    from kismon.sqlstore import migrate_json
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_file = os.path.join(tmpdir, "networks.json")
+        db_file = os.path.join(tmpdir, "networks.db")
+        with open(json_file, "w") as f:
+            json.dump(dict(synthetic_networks(count)), f)
+        start = time.time()
+        migrate_json(json_file, db_file, logger)
+        print("%s networks, migration %.1fsec" % (count, time.time() - start))
+
+        print("backend   load       filter     matches   peak RSS")
+        for backend, filename in (("json", json_file), ("sqlite", db_file)):
+            output = subprocess.check_output([
+                sys.executable, "-c",
+                "from kismon.benchmark import storage_run; storage_run(%r, %r)" % (backend, filename)])
+            result = json.loads(output)
+            print("%-8s %7.3fsec %7.3fsec %9s %7.1f MB" % (
+                backend, result["load"], result["filter"], result["matches"], result["rss"] / 1024))
+
+
+def benchmark_history(count=2000, seconds=600, sources=2):
+    """Signal history of count networks seen by sources datasources every second,
+    memory of the ring buffers compared to a dict per timestamp
+    """
+    from kismon.history import SignalHistory
+
+    macs = [synthetic_mac(num + 1) for num in range(count)]
+    history = SignalHistory(seconds=seconds, max_sources=8, max_bytes=1 << 40)
+    start = time.time()
+    for timestamp in range(seconds * 2):
+        for mac in macs:
+            for source in range(sources):
+                history.add(mac, (0, source), timestamp, -60, timestamp)
+    duration = time.time() - start
+    values = count * seconds * 2 * sources
+    print("%s values added in %.2fsec, %.0f values/sec" % (values, duration, values / duration))
+
+    start = time.time()
+    for mac in macs[:1000]:
+        history.get(mac)
+    print("history of one network: %.3fms" % ((time.time() - start) / 1000 * 1000))
+
+    rings = [ring for sources in history.networks.values() for ring in sources.values()]
+    ring_size = sum(sys.getsizeof(ring) + sys.getsizeof(ring.times) + sys.getsizeof(ring.signals) +
+                    sys.getsizeof(ring.packets) for ring in rings)
+    window = {}
+    for timestamp in range(seconds):
+        window[timestamp] = {"%s-%s" % (0, source): (-60, 1) for source in range(sources)}
+    window_size = sys.getsizeof(window) + sum(
+        sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values.values())
+        for values in window.values())
+    print("ring buffers %.1fMB, %.0f bytes per network, SignalWindow.history for %ss: %.0f bytes per network" % (
+        ring_size / 1024 / 1024, ring_size / count, seconds, window_size))
+
+
+def benchmark_load(count=250000):
+    """Load time of a version 1 networks.json, which needs the per-record
+    upgrade pass, compared to a file with the current schema header
+    """
+    from kismon.store import SCHEMA_VERSION, load_networks_json
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        legacy_file = os.path.join(tmpdir, "legacy.json")
+        current_file = os.path.join(tmpdir, "networks.json")
+        networks = dict(synthetic_networks(count))
+        with open(current_file, "w") as f:
+            json.dump({"schema": SCHEMA_VERSION, "networks": networks}, f)
+        # the same networks without the header
+        with open(legacy_file, "w") as f:
+            json.dump(networks, f)
+        # files of old kismon versions without crypt strings
+        no_crypt_file = os.path.join(tmpdir, "no-crypt.json")
+        for network in networks.values():
+            del network["crypt"]
+        with open(no_crypt_file, "w") as f:
+            json.dump(networks, f)
+        del networks
+
+        print("%s networks, best of 3" % count)
+        for name, filename in (("schema 1 (no crypt)", no_crypt_file), ("schema 1 (upgrade)", legacy_file),
+                               ("schema %s" % SCHEMA_VERSION, current_file)):
+            durations = []
+            for num in range(3):
+                gc.collect()
+                start = time.time()
+                with open(filename) as f:
+                    networks, schema = load_networks_json(f)
+                durations.append(time.time() - start)
+                del networks
+            print("%-20s %6.2fsec" % (name, min(durations)))
+
+
+def benchmark_crypt(count=1 << 20):
+    """Cryptset decoding over the whole cryptset space, first computed and
+    then from the tables
+    """
+    import kismon.crypt as crypt
+
+    def run(cryptsets):
+        start = time.time()
+        for cryptset in cryptsets:
+            crypt.decode_cryptset(cryptset)
+            crypt.crypt_string(cryptset)
+            crypt.crypt_category(cryptset)
+            crypt.crypt_color(cryptset)
+        return time.time() - start
+
+    cryptsets = range(count)
+    print("%s cryptsets, decode + string + category + color" % count)
+    duration = run(cryptsets)
+    print("computed:     %6.2fsec, %6.0fns per cryptset" % (duration, duration / count * 10 ** 9))
+    duration = run(cryptsets)
+    print("tables:       %6.2fsec, %6.0fns per cryptset" % (duration, duration / count * 10 ** 9))
+    typical = list(cryptsets_sample(count))
+    duration = run(typical)
+    print("typical mix:  %6.2fsec, %6.0fns per network" % (duration, duration / count * 10 ** 9))
+
+    start = time.time()
+    for cryptset in cryptsets:
+        crypt.encode_cryptset(crypt.decode_cryptset(cryptset))
+    duration = time.time() - start
+    print("encode:       %6.2fsec, %6.0fns per cryptset" % (duration, duration / count * 10 ** 9))
+
+
+def cryptsets_sample(count):
+    rnd = random.Random(1)
+    for num in range(count):
+        yield cryptsets[rnd.randrange(len(cryptsets))]
+
+
+def netxml_baseline(filename, store, networks):
+    """The netxml export before the streaming exporter, a write call per line
+    """
+    from kismon.crypt import netxml_encryption
+    locale.setlocale(locale.LC_TIME, 'C')
+    f = open(filename, "w")
+    f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n')
+    f.write('<!DOCTYPE detection-run SYSTEM "http://kismetwireless.net/kismet-3.1.0.dtd">\n')
+    f.write('<detection-run kismet-version="2009.06.R1" start-time="Sat Oct 24 09:05:35 2009">\n\n')
+    num = 0
+    for mac in networks:
+        network = store[mac]
+        firsttime = time.strftime("%a %b %d %H:%M:%S %Y", time.gmtime(network.firsttime))
+        lasttime = time.strftime("%a %b %d %H:%M:%S %Y", time.gmtime(network.lasttime))
+        ssid = network.ssid.replace("<", "&lt;").replace(">", "&gt;").replace("&", "&amp;")
+        manuf = "Unknown" if network.manuf == "" else network.manuf.replace("&", "&amp;")
+        f.write('<wireless-network number="%s" type="%s" first-time="%s" last-time="%s">\n' %
+                (num, network.type, firsttime, lasttime))
+        f.write(' <SSID first-time="%s" last-time="%s">\n' % (firsttime, lasttime))
+        f.write(netxml_encryption(network.cryptset))
+        f.write('  <essid cloaked="%s">%s</essid>\n' % (True if ssid == "" else False, ssid))
+        f.write(' </SSID>\n')
+        f.write(' <BSSID>%s</BSSID>\n' % mac)
+        f.write(' <manuf>%s</manuf>\n' % manuf)
+        f.write(' <channel>%s</channel>\n' % network.channel)
+        if network.has_signal():
+            f.write(' <snr-info>\n')
+            f.write('  <last_signal_dbm>%s</last_signal_dbm>\n' % network.signal_last)
+            f.write('  <min_signal_dbm>%s</min_signal_dbm>\n' % network.signal_min)
+            f.write('  <max_signal_dbm>%s</max_signal_dbm>\n' % network.signal_max)
+            f.write(' </snr-info>\n')
+        if network.lat != 0 and network.lon != 0:
+            f.write(' <gps-info>\n')
+            for key in ('min', 'max', 'peak', 'avg'):
+                f.write('  <%s-lat>%s</%s-lat>\n' % (key, network.lat, key))
+                f.write('  <%s-lon>%s</%s-lon>\n' % (key, network.lon, key))
+            f.write(' </gps-info>\n')
+        f.write('</wireless-network>\n')
+        num += 1
+    f.write('</detection-run>')
+    f.close()
+    locale.setlocale(locale.LC_TIME, '')
+
+
+def benchmark_netxml(count=500000):
+    """netxml export of count networks, the streaming exporter compared to
+    the old exporter with a write call per line
+    """
+    from kismon.export import write_netxml
+    from kismon.store import NetworkRecord, NetworkStore, StoreSnapshot
+
+    store = NetworkStore()
+    for mac, network in synthetic_networks(count):
+        store[mac] = NetworkRecord.from_dict(network)
+    filename = os.path.join(tempfile.gettempdir(), "kismon-benchmark.netxml")
+
+    start = time.time()
+    netxml_baseline(filename, store, store)
+    baseline_time = time.time() - start
+    baseline_size = os.path.getsize(filename)
+
+    start = time.time()
+    write_netxml(filename, StoreSnapshot(store))
+    stream_time = time.time() - start
+    size = os.path.getsize(filename)
+
+    # traced separately, tracemalloc slows down the export
+    tracemalloc.start()
+    write_netxml(filename, StoreSnapshot(store))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    os.remove(filename)
+
+    print("%s networks, %.1fMB: old exporter %.2fsec, streaming %.2fsec (%.1fMB), %.1fx" % (
+        count, baseline_size / 1024 / 1024, baseline_time, stream_time, size / 1024 / 1024,
+        baseline_time / stream_time))
+    print("streaming exporter peak memory %.1fMB (mac list of the snapshot and one batch)" % (peak / 1024 / 1024))
+
+
+def kmz_baseline(filename, store):
+    """The KMZ export before the streaming exporter, the placemarks and the
+    whole KML in memory
+    """
+    import zipfile
+    from kismon.crypt import crypt_label, crypt_string
+    from kismon.export import KML_FOLDER, KML_FOLDERS, KML_FOOTER, KML_HEADER, KML_PLACEMARK, KML_COLORS
+    import kismon.utils as utils
+
+    folders = {crypt: [] for crypt, icon in KML_FOLDERS}
+    for mac, network in store.items():
+        if network.lat == 0 and network.lon == 0:
+            continue
+        ssid = network.ssid.replace("<", "&lt;").replace(">", "&gt;").replace("&", "&amp;")
+        crypt = crypt_label(network.cryptset)
+        folders[crypt].append(KML_PLACEMARK % (
+            crypt, ssid, network.lon, network.lat, ssid, mac,
+            network.manuf, network.type, network.channel,
+            KML_COLORS[crypt], crypt_string(network.cryptset).upper(), utils.format_timestamp(network.lasttime),
+            network.lon, network.lat,
+        ))
+    data = [KML_HEADER]
+    for crypt, icon in KML_FOLDERS:
+        data.append(KML_FOLDER % (crypt, len(folders[crypt]), crypt, icon))
+        data.append("".join(folders[crypt]))
+        data.append("\n</Folder>")
+    data.append(KML_FOOTER)
+    zip_output = zipfile.ZipFile(filename, "w")
+    zinfo = zipfile.ZipInfo("kismon.kml")
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zip_output.writestr(zinfo, "".join(data))
+    zip_output.close()
+
+
+def kmz_run(exporter, count, filename):
+    """Export count networks as KMZ in a fresh process, prints the results as json
+    """
+    from kismon.export import write_kmz
+    from kismon.store import NetworkRecord, NetworkStore, StoreSnapshot
+
+    store = NetworkStore()
+    for mac, network in synthetic_networks(count):
+        store[mac] = NetworkRecord.from_dict(network)
+    gc.collect()
+    base = peak_rss()
+
+    start = time.time()
+    if exporter == "old":
+        kmz_baseline(filename, store)
+    else:
+        write_kmz(filename, StoreSnapshot(store))
+    print(json.dumps({
+        "time": time.time() - start,
+        "base": base,
+        "rss": peak_rss(),
+        "size": os.path.getsize(filename),
+    }))
+
+
+def benchmark_import(files=200, count=2000):
+    """Import of files synthetic netxml files with count networks each,
+    parsed one file per main loop call as before compared to the import
+    pipeline with 1, 2, 4 and 8 worker processes. Every file overlaps
+    with the previous one by half of its networks.
+    """
+    from kismon.export import write_netxml
+    from kismon.importer import ImportPipeline, iter_file, row_record
+    from kismon.store import NetworkRecord, NetworkStore, StoreSnapshot
+
+    store = NetworkStore()
+    for mac, network in synthetic_networks(count * (files + 1) // 2):
+        store[mac] = NetworkRecord.from_dict(network)
+    macs = list(store.keys())
+    tmpdir = tempfile.mkdtemp()
+    filenames = []
+    for num in range(files):
+        filename = os.path.join(tmpdir, "kismet-%s.netxml" % num)
+        write_netxml(filename, StoreSnapshot(store, macs[num * count // 2:num * count // 2 + count]))
+        filenames.append(filename)
+    size = sum(os.path.getsize(filename) for filename in filenames)
+    print("%s files, %.1fMB, %s networks" % (files, size / 1024 / 1024, len(store)))
+
+    def merge(mac, network):
+        # the merge of Networks.add_network_data() without the notifications
+        new = mac not in networks
+        if new or network.lasttime > networks[mac].lasttime:
+            networks[mac] = network
+        return new
+
+    networks = NetworkStore()
+    longest = 0
+    start = time.time()
+    for filename in filenames:
+        step_start = time.process_time()
+        for batch in iter_file("netxml", filename):
+            for row in batch:
+                merge(*row_record(row))
+        longest = max(longest, time.process_time() - step_start)
+    baseline = time.time() - start
+    # the CPU time of the main process during a main loop call, including the
+    # result thread of the pool; the wall time would also contain the workers
+    # if they share the CPU
+    print("workers   time      speedup  longest main loop block")
+    print("%-8s %6.2fsec %7s %8.0fms" % ("main", baseline, "", longest * 1000))
+
+    for workers in (1, 2, 4, 8):
+        networks = NetworkStore()
+        pipeline = ImportPipeline([(filename, "netxml") for filename in filenames], merge, workers=workers)
+        longest = 0
+        start = time.time()
+        pipeline.start()
+        while True:
+            step_start = time.process_time()
+            running = pipeline.step()
+            longest = max(longest, time.process_time() - step_start)
+            if not running:
+                break
+            if pipeline.idle:
+                time.sleep(0.005)
+        duration = time.time() - start
+        print("%-8s %6.2fsec %6.2fx %8.0fms" % (workers, duration, baseline / duration, longest * 1000))
+
+    for filename in filenames:
+        os.remove(filename)
+    os.rmdir(tmpdir)
+    print("%s CPUs" % os.cpu_count())
+
+
+def baseline_timestamp(timestring):
+    return int(time.mktime(time.strptime(timestring)))
+
+
+class NetxmlBaseline:
+    """The netxml parser before the incremental reader, all networks are
+    kept and every time is parsed with strptime in the C locale
+    """
+
+    def __init__(self, logger):
+        self.networks = {}
+        self.logger = logger
+
+    def parse(self, filename):
+        self.parser = {
+            "laststart": "",
+            "parents": [],
+            "network": None,
+            "encryption": {}
+        }
+        locale.setlocale(locale.LC_TIME, 'C')
+
+        p = xml.parsers.expat.ParserCreate()
+        p.buffer_text = True  # avoid chunked data
+        p.StartElementHandler = self.parse_start_element
+        p.EndElementHandler = self.parse_end_element
+        p.CharacterDataHandler = self.parse_char_data
+        if os.path.isfile(filename):
+            f = open(filename, 'rb')
+            p.ParseFile(f)
+            f.close()
+        else:
+            self.logger.error("Parser: filename is not a file (%s)" % filename)
+
+        locale.setlocale(locale.LC_TIME, '')
+
+    def parse_start_element(self, name, attrs):
+        """<name attr="">
+        """
+        if name == "wireless-network":
+            self.parser["network"] = {
+                "type": attrs["type"],
+                "firsttime": baseline_timestamp(attrs["first-time"]),
+                "lasttime": baseline_timestamp(attrs["last-time"]),
+                "ssid": "",
+                "cryptset": 0,
+                "crypt": "",
+                "lat": 0.0,
+                "lon": 0.0,
+                "signal_dbm": {}
+            }
+        elif name == "SSID":
+            self.parser["encryption"] = {}
+
+        self.parser["parents"].insert(0, self.parser["laststart"])
+        self.parser["laststart"] = name
+
+    def parse_end_element(self, name):
+        """</name>
+        """
+        if name == "wireless-network":
+            mac = self.parser["network"]["mac"]
+            del self.parser["network"]["mac"]
+            self.networks[mac] = self.parser["network"]
+        elif name == "SSID":
+            if len(self.parser["encryption"]) > 0:
+                if self.parser["parents"][0] == "wireless-network":
+                    crypts = []
+                    for crypt in self.parser["encryption"]:
+                        if crypt.startswith("WPA"):
+                            if "wpa" not in crypts:
+                                crypts.append("wpa")
+                            if crypt.startswith("WPA+"):
+                                crypts.append(crypt.split("+")[1].lower().replace("-", "_"))
+                        else:
+                            crypts.append(crypt.lower().replace("-", "_"))
+                    cryptset = encode_cryptset(crypts)
+                    self.parser["network"]["crypt"] = ",".join(crypts)
+                    self.parser["network"]["cryptset"] = cryptset
+            del self.parser["encryption"]
+
+        self.parser["laststart"] = self.parser["parents"].pop(0)
+
+    def parse_char_data(self, data):
+        """<self.parser["laststart"]>data</self.parser["laststart"]>
+        """
+        if data.strip() == "":
+            return
+
+        if self.parser["parents"][0] == "SSID":
+            if self.parser["laststart"] == "encryption":
+                self.parser["encryption"][data] = True
+            elif self.parser["laststart"] == "essid":
+                self.parser["network"]["ssid"] = data
+        elif self.parser["parents"][1] == "wireless-network":
+            if self.parser["parents"][0] == "gps-info":
+                if self.parser["laststart"] == "peak-lat":
+                    self.parser["network"]["lat"] = float(data)
+                elif self.parser["laststart"] == "peak-lon":
+                    self.parser["network"]["lon"] = float(data)
+            elif self.parser["parents"][0] == "snr-info":
+                if self.parser["laststart"] == "min_signal_dbm":
+                    self.parser["network"]["signal_dbm"]["min"] = int(data)
+                elif self.parser["laststart"] == "max_signal_dbm":
+                    self.parser["network"]["signal_dbm"]["max"] = int(data)
+                elif self.parser["laststart"] == "last_signal_dbm":
+                    self.parser["network"]["signal_dbm"]["last"] = int(data)
+        elif self.parser["parents"][0] == "wireless-network":
+            if self.parser["laststart"] == "BSSID":
+                self.parser["network"]["mac"] = data
+            elif self.parser["laststart"] == "channel":
+                self.parser["network"]["channel"] = int(data)
+            elif self.parser["laststart"] == "manuf":
+                self.parser["network"]["manuf"] = data
+
+
+KISMET_NETWORK = """<wireless-network number="%(number)s" type="infrastructure" first-time="%(first)s" last-time="%(last)s">
+ <SSID first-time="%(first)s" last-time="%(last)s">
+  <type>Beacon</type>
+  <max-rate>54.000000</max-rate>
+  <packets>%(packets)s</packets>
+  <beaconrate>10</beaconrate>
+  <encryption>WPA+PSK</encryption>
+  <encryption>WPA+AES-CCM</encryption>
+  <essid cloaked="false">%(ssid)s</essid>
+ </SSID>
+ <BSSID>%(mac)s</BSSID>
+ <manuf>Unknown</manuf>
+ <channel>%(channel)s</channel>
+ <freqmhz>2437 %(packets)s</freqmhz>
+ <maxseenrate>1000</maxseenrate>
+ <carrier>IEEE 802.11b+</carrier>
+ <encoding>CCK</encoding>
+ <packets>
+  <LLC>%(packets)s</LLC>
+  <data>0</data>
+  <crypt>0</crypt>
+  <total>%(packets)s</total>
+  <fragments>0</fragments>
+  <retries>0</retries>
+ </packets>
+ <datasize>0</datasize>
+ <snr-info>
+  <last_signal_dbm>%(signal)s</last_signal_dbm>
+  <last_noise_dbm>0</last_noise_dbm>
+  <last_signal_rssi>0</last_signal_rssi>
+  <last_noise_rssi>0</last_noise_rssi>
+  <min_signal_dbm>%(signal)s</min_signal_dbm>
+  <min_noise_dbm>0</min_noise_dbm>
+  <min_signal_rssi>1024</min_signal_rssi>
+  <min_noise_rssi>1024</min_noise_rssi>
+  <max_signal_dbm>%(signal)s</max_signal_dbm>
+  <max_noise_dbm>-256</max_noise_dbm>
+  <max_signal_rssi>0</max_signal_rssi>
+  <max_noise_rssi>0</max_noise_rssi>
+ </snr-info>
+ <gps-info>
+  <min-lat>%(lat)s</min-lat>
+  <min-lon>%(lon)s</min-lon>
+  <min-alt>120.000000</min-alt>
+  <min-spd>0.000000</min-spd>
+  <max-lat>%(lat)s</max-lat>
+  <max-lon>%(lon)s</max-lon>
+  <max-alt>120.000000</max-alt>
+  <max-spd>0.000000</max-spd>
+  <peak-lat>%(lat)s</peak-lat>
+  <peak-lon>%(lon)s</peak-lon>
+  <peak-alt>120.000000</peak-alt>
+  <avg-lat>%(lat)s</avg-lat>
+  <avg-lon>%(lon)s</avg-lon>
+  <avg-alt>120.000000</avg-alt>
+ </gps-info>
+ <bsstimestamp>0</bsstimestamp>
+ <cdp-device></cdp-device>
+ <cdp-portid></cdp-portid>
+ <seen-card>
+  <seen-uuid>6eb0bbfe-c29c-11e0-8006-0e1155a2c201</seen-uuid>
+  <seen-time>%(last)s</seen-time>
+  <seen-packets>%(packets)s</seen-packets>
+ </seen-card>
+ <wireless-client number="1" type="fromds" first-time="%(first)s" last-time="%(last)s">
+  <client-mac>%(mac)s</client-mac>
+  <client-manuf>Unknown</client-manuf>
+  <channel>%(channel)s</channel>
+  <maxseenrate>1000</maxseenrate>
+  <packets>
+   <total>1</total>
+  </packets>
+  <snr-info>
+   <last_signal_dbm>%(signal)s</last_signal_dbm>
+  </snr-info>
+ </wireless-client>
+</wireless-network>
+"""
+
+
+def synthetic_kismet_netxml(filename, megabytes, seed=1):
+    """Write a netxml file like a kismet log of a few hours with about megabytes MB
+    """
+    from kismon.export import NETXML_HEADER, timestring
+    rnd = random.Random(seed)
+    start = 1256375135
+    size = 0
+    number = 0
+    with open(filename, "w") as f:
+        f.write(NETXML_HEADER)
+        while size < megabytes * 1024 * 1024:
+            first = start + rnd.randrange(4 * 3600)
+            size += f.write(KISMET_NETWORK % {
+                "number": number, "first": time.ctime(first), "last": time.ctime(first + rnd.randrange(600)),
+                "packets": rnd.randrange(1, 1000), "ssid": "network %s" % rnd.randrange(100000),
+                "mac": synthetic_mac(number + 1), "channel": rnd.choice((1, 6, 11)),
+                "signal": rnd.randrange(-95, -30), "lat": 52 + rnd.random(), "lon": 13 + rnd.random()})
+            number += 1
+        f.write("</detection-run>")
+    return number
+
+
+def netxml_parser_run(parser, filename):
+    """Parse a netxml file in a fresh process, prints the results as json
+    """
+    import logging
+    from kismon.importer import iter_netxml
+
+    start = time.time()
+    if parser == "old":
+        netxml = NetxmlBaseline(logging.getLogger())
+        netxml.parse(filename)
+        count = len(netxml.networks)
+    else:
+        count = 0
+        for batch in iter_netxml(filename, logging.getLogger()):
+            count += len(batch)
+    print(json.dumps({"time": time.time() - start, "networks": count, "rss": peak_rss()}))
+
+
+def benchmark_parser(megabytes=500):
+    """MB/s of the incremental netxml reader compared to the old parser, on
+    a kismet-like netxml file, every parser in a fresh process
+    """
+    filename = os.path.join(tempfile.gettempdir(), "kismon-benchmark-kismet.netxml")
+    count = synthetic_kismet_netxml(filename, megabytes)
+    size = os.path.getsize(filename) / 1024 / 1024
+    print("%.0fMB, %s networks" % (size, count))
+    print("parser    time       MB/s     networks  peak RSS")
+    for parser in ("old", "incremental"):
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "from kismon.benchmark import netxml_parser_run; netxml_parser_run(%r, %r)" % (parser, filename)])
+        result = json.loads(output)
+        print("%-11s %6.1fsec %6.1f %10s %7.1f MB" % (
+            parser, result["time"], size / result["time"], result["networks"], result["rss"] / 1024))
+    os.remove(filename)
+
+
+def synthetic_kismet_log(filename, count):
+    """Write a .kismet log with count 802.11 devices and count / 10 Bluetooth
+    devices in the devices table, the device json has the signal in its own dict
+    """
+    import sqlite3
+    connection = sqlite3.connect(filename)
+    connection.execute("CREATE TABLE devices (first_time INT, last_time INT, devkey TEXT, phyname TEXT, devmac TEXT, "
+                       "strongest_signal INT, min_lat REAL, min_lon REAL, max_lat REAL, max_lon REAL, avg_lat REAL, "
+                       "avg_lon REAL, bytes_data INT, type TEXT, device BLOB, "
+                       "UNIQUE(phyname, devmac) ON CONFLICT REPLACE)")
+    rows = []
+    for num, device in enumerate(synthetic_devices(count)):
+        device['kismet.device.base.signal'] = {}
+        for key in list(device):
+            if key.startswith('kismet.common.signal.'):
+                device['kismet.device.base.signal'][key] = device.pop(key)
+        mac = device['kismet.device.base.macaddr']
+        rows.append((device['kismet.device.base.first_time'], device['kismet.device.base.last_time'],
+                     device['kismet.device.base.key'], 'IEEE802.11', mac, 'Wi-Fi AP', json.dumps(device).encode()))
+        if num % 10 == 0:
+            rows.append((0, 0, '', 'Bluetooth', mac, 'BTLE', b'{"kismet.device.base.macaddr": "%s"}' % mac.encode()))
+        if len(rows) >= 10000:
+            connection.executemany("INSERT INTO devices (first_time, last_time, devkey, phyname, devmac, type, device) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            rows = []
+    connection.executemany("INSERT INTO devices (first_time, last_time, devkey, phyname, devmac, type, device) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+
+def import_format_run(filetype, filename):
+    """Read a file with iter_file() in a fresh process, prints the results as json
+    """
+    from kismon.importer import iter_file
+
+    start = time.time()
+    count = 0
+    for batch in iter_file(filetype, filename):
+        count += len(batch)
+    print(json.dumps({"time": time.time() - start, "networks": count, "rss": peak_rss()}))
+
+
+def benchmark_formats(megabytes=100):
+    """Throughput of the importers per format: a kismet-like netxml file of
+    about megabytes MB plain and compressed with gzip, bzip2 and xz, and a
+    .kismet log with as many devices plain and compressed with gzip, every
+    file read in a fresh process. MB/s of the uncompressed data.
+    """
+    import bz2
+    import gzip
+    import lzma
+    import shutil
+
+    tmpdir = tempfile.mkdtemp()
+    netxml = os.path.join(tmpdir, "kismet.netxml")
+    count = synthetic_kismet_netxml(netxml, megabytes)
+    kismet = os.path.join(tmpdir, "kismet.kismet")
+    synthetic_kismet_log(kismet, count)
+    files = [("netxml", netxml, netxml), ("netxml.gz", netxml, netxml + ".gz"),
+             ("netxml.bz2", netxml, netxml + ".bz2"), ("netxml.xz", netxml, netxml + ".xz"),
+             ("kismet", kismet, kismet), ("kismet.gz", kismet, kismet + ".gz")]
+    for name, source, filename in files:
+        for extension, opener in ((".gz", gzip.open), (".bz2", bz2.open), (".xz", lzma.open)):
+            if filename.endswith(extension):
+                with open(source, "rb") as f, opener(filename, "wb") as compressed:
+                    shutil.copyfileobj(f, compressed, 1 << 20)
+    print("%s networks" % count)
+    print("format      file size  time       MB/s   networks/s  peak RSS")
+    for name, source, filename in files:
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "from kismon.benchmark import import_format_run; import_format_run(%r, %r)" % (
+                name.split(".")[0], filename)])
+        result = json.loads(output)
+        size = os.path.getsize(source) / 1024 / 1024
+        print("%-10s %7.1f MB %6.1fsec %6.1f %11.0f %7.1f MB" % (
+            name, os.path.getsize(filename) / 1024 / 1024, result["time"], size / result["time"],
+            result["networks"] / result["time"], result["rss"] / 1024))
+    for name, source, filename in files:
+        os.remove(filename)
+    os.rmdir(tmpdir)
+
+
+def benchmark_kmz(count=300000):
+    """KMZ export of count networks, peak RSS of the streaming exporter
+    compared to building the KML in memory, every exporter in a fresh process
+    """
+    filename = os.path.join(tempfile.gettempdir(), "kismon-benchmark.kmz")
+    print("exporter  time       peak RSS   export     file")
+    for exporter in ("old", "streaming"):
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "from kismon.benchmark import kmz_run; kmz_run(%r, %s, %r)" % (exporter, count, filename)])
+        result = json.loads(output)
+        print("%-9s %6.2fsec %7.1f MB %7.1f MB %7.1f MB" % (
+            exporter, result["time"], result["rss"] / 1024, (result["rss"] - result["base"]) / 1024,
+            result["size"] / 1024 / 1024))
+    os.remove(filename)
+
+
+def benchmark_exports(count=200000):
+    """netxml, KMZ and CSV export jobs of count networks running concurrently
+    in worker threads, compared to running them one after another in the main
+    thread. The main thread ticks every 10ms, the longest gap between two
+    ticks is the longest freeze of the UI.
+    """
+    import threading
+    from kismon.export import ExportJob, iter_csv, iter_kmz, iter_netxml
+    from kismon.store import NetworkRecord, NetworkStore, StoreSnapshot
+
+    store = NetworkStore()
+    for mac, network in synthetic_networks(count):
+        store[mac] = NetworkRecord.from_dict(network)
+    tmpdir = tempfile.mkdtemp()
+
+    def create_jobs():
+        jobs = []
+        for name, writer, extension in (("netxml", iter_netxml, "netxml"), ("kmz", iter_kmz, "kmz"),
+                                        ("csv", iter_csv, "csv")):
+            filename = os.path.join(tmpdir, "kismon-benchmark.%s" % extension)
+            snapshot = StoreSnapshot(store)
+            jobs.append(ExportJob(name, filename, snapshot, writer(filename, snapshot)))
+        return jobs
+
+    start = time.time()
+    for job in create_jobs():
+        job.run()
+    sequential = time.time() - start
+
+    jobs = create_jobs()
+    threads = [threading.Thread(target=job.run) for job in jobs]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    longest = 0
+    last = time.time()
+    while any(thread.is_alive() for thread in threads):
+        time.sleep(0.01)
+        now = time.time()
+        longest = max(longest, now - last)
+        last = now
+    concurrent = time.time() - start
+
+    print("%s networks, main thread: %.2fsec blocked" % (count, sequential))
+    print("jobs in worker threads: %.2fsec, longest main thread gap %.0fms" % (concurrent, longest * 1000))
+    for job in jobs:
+        print("  %-7s %s %7s networks %6.1fMB %.2fsec" % (job.name, job.state, job.done, job.written / 1024 / 1024,
+                                                     job.duration))
+
+    jobs = create_jobs()
+    threads = [threading.Thread(target=job.run) for job in jobs]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    start = time.time()
+    for job in jobs:
+        job.cancel()
+    for thread in threads:
+        thread.join()
+    print("cancelled after 0.2sec: stopped within %.0fms, files removed: %s" % (
+        (time.time() - start) * 1000, not any(os.path.exists(job.filename) for job in jobs)))
+    for job in jobs:
+        if os.path.exists(job.filename):
+            os.remove(job.filename)
+    os.rmdir(tmpdir)
+
+
+def benchmark_filter(count=500000):
+    """Full re-filter of all networks with the compiled filter, compared to
+    evaluating the config for every network
+    """
+    import re
+    from kismon.config import Config
+    from kismon.crypt import crypt_category
+    from kismon.store import NetworkStore, NetworkQuery
+
+    def config_filter(config, mac, network):
+        # the filter as it was evaluated before it was compiled
+        if not config["filter_type"][network.type]:
+            return False
+        if not config["filter_crypt"][crypt_category(network.cryptset)]:
+            return False
+        if config["filter_regexpr"]["ssid"] != "":
+            if re.search(r"%s" % config["filter_regexpr"]["ssid"], network.ssid) is None:
+                return False
+        if config["filter_regexpr"]["bssid"] != "":
+            if re.search(r"%s" % config["filter_regexpr"]["bssid"], mac, re.IGNORECASE) is None:
+                return False
+        return True
+
+    networks = NetworkStore()
+    networks.update(synthetic_networks(count))
+    config = Config(None, logger=logger).default_config
+    config["filter_crypt"]["wep"] = False
+
+    print("%s networks" % count)
+    for ssid, bssid in (("", ""), ("network-1", "^00:00:00:0")):
+        config["filter_regexpr"]["ssid"] = ssid
+        config["filter_regexpr"]["bssid"] = bssid
+
+        start = time.time()
+        matches = sum(1 for mac, network in networks.items() if config_filter(config, mac, network))
+        config_time = time.time() - start
+
+        start = time.time()
+        network_filter = NetworkQuery.from_config(config)
+        matches_compiled = sum(1 for mac, network in networks.items() if network_filter.matches(mac, network))
+        compiled_time = time.time() - start
+        assert matches == matches_compiled
+
+        print("regexpr ssid=%r bssid=%r, %s matches" % (ssid, bssid, matches))
+        print("  config lookups: %6.3fsec" % config_time)
+        print("  compiled:       %6.3fsec" % compiled_time)
+
+
+def synthetic_devices(count):
+    """Kismet devices based on the test data, with unique macs
+    """
+    import kismon.test_data
+    templates = kismon.test_data.data['dot11']
+    for num in range(count):
+        device = dict(templates[num % len(templates)])
+        device['kismet.device.base.macaddr'] = synthetic_mac(num + 1)
+        yield device
+
+
+def test_networks():
+    """Networks with the default config and dummy targets, needs gi
+    """
+    from kismon.config import Config
+    from kismon.networks import Networks
+    from kismon.store import CHANGE_ALL, CHANGE_POSITION
+
+    config = Config(None, logger=logger).default_config
+    config['servers'] = [{'uri': 'http://127.0.0.1:2501'}]
+    networks = Networks(config, logger=logger)
+    for target in ("network_list", "map"):
+        networks.notify_add_list[target] = lambda mac, changes: None
+        networks.notify_remove_list[target] = lambda mac: None
+    networks.notify_add_fields["network_list"] = CHANGE_ALL
+    networks.notify_add_fields["map"] = CHANGE_POSITION
+    return networks
+
+
+def benchmark_session(count=100000):
+    """New devices through add_device_data, the time per block has to stay
+    constant while the current session grows
+    """
+    networks = test_networks()
+    block = max(1, count // 10)
+    devices = list(synthetic_devices(count))
+    print("%s new devices" % count)
+    start = time.time()
+    block_start = start
+    for num, device in enumerate(devices, 1):
+        networks.add_device_data(device, 0)
+        if num % block == 0:
+            now = time.time()
+            print("%7s devices: %6.0f devices/sec" % (num, block / (now - block_start)))
+            block_start = now
+    duration = time.time() - start
+    print("total %.2fsec, %.0f devices/sec, %s networks in the session" % (
+        duration, count / duration, len(networks.session)))
+
+
+def benchmark_devices(count=100000, poll_size=1000):
+    """Polls of kismet devices through add_device_data and add_devices: new
+    networks, active networks with a newer lasttime and idle networks
+    """
+    devices = list(synthetic_devices(count))
+    active = []
+    for device in devices:
+        device = dict(device)
+        device['kismet.device.base.last_time'] += 60
+        active.append(device)
+    phases = (("new", devices), ("active", active), ("idle", active))
+    print("%s devices in polls of %s" % (count, poll_size))
+
+    def per_device(networks, poll):
+        for device in poll:
+            networks.add_device_data(device, 0)
+
+    def batch(networks, poll):
+        networks.add_devices(poll, 0)
+
+    for name, run in (("add_device_data", per_device), ("add_devices", batch)):
+        networks = test_networks()
+        for phase, phase_devices in phases:
+            start = time.time()
+            for poll_start in range(0, count, poll_size):
+                run(networks, phase_devices[poll_start:poll_start + poll_size])
+            duration = time.time() - start
+            print("%-15s %-6s %6.0f devices/sec, notifications %s" % (
+                name, phase, count / duration, networks.notify_counters))
+            networks.notify_counters = {"queued": 0, "suppressed": 0, "unchanged": 0}
+
+
+def list_line(mac, network):
+    """Roughly the work of NetworkList.set_network_line without GTK
+    """
+    return [mac, network.type, network.ssid, network.channel, network.crypt, network.firsttime,
+            network.lasttime, str(network.lat), str(network.lon), network.signal_last, network.comment,
+            ",".join(network.servers), network.codename]
+
+
+def fill_queue(networks, count, targets):
+    """Add count networks which are visible for the targets and queue them
+    """
+    from kismon.store import NetworkRecord
+    for target in targets:
+        networks.config["filter_networks"][target] = "all"
+    for network_type in networks.config["filter_type"]:
+        networks.config["filter_type"][network_type] = True
+    for mac, network in synthetic_networks(count):
+        networks.networks[mac] = NetworkRecord.from_dict(network)
+    networks.apply_filters_on_networks()
+
+
+def benchmark_multilateration(count=100000, max_sensors=8, noise=4):
+    """Positions of count networks seen by 3 to max_sensors sensors within 200m,
+    the signals follow the path loss model with noise dB of gaussian noise
+    """
+    import numpy
+    from kismon.multilateration import multilaterate, signal_distance
+    from kismon.spatial import distance, METERS_PER_DEGREE
+
+    rnd = numpy.random.default_rng(1)
+    shape = (count, max_sensors)
+    true_lat = 52.3 + rnd.random(count) * 0.4
+    true_lon = 13.1 + rnd.random(count) * 0.6
+    scale_lon = METERS_PER_DEGREE * numpy.cos(numpy.radians(true_lat))
+    offset_x = rnd.uniform(-200, 200, shape)
+    offset_y = rnd.uniform(-200, 200, shape)
+    lat = true_lat[:, None] + offset_y / METERS_PER_DEGREE
+    lon = true_lon[:, None] + offset_x / scale_lon[:, None]
+    meters = numpy.maximum(numpy.sqrt(offset_x ** 2 + offset_y ** 2), 1)
+    signal = -40 - 27 * numpy.log10(meters) + rnd.normal(0, noise, shape)
+    sensors = rnd.integers(3, max_sensors + 1, count)
+    mask = numpy.arange(max_sensors) < sensors[:, None]
+
+    start = time.time()
+    distances = signal_distance(signal)
+    est_lat, est_lon, rms = multilaterate(lat, lon, distances, mask)
+    duration = time.time() - start
+
+    weights = numpy.where(mask, 10 ** (signal / 10), 0)
+    centroid_lat = (lat * weights).sum(axis=1) / weights.sum(axis=1)
+    centroid_lon = (lon * weights).sum(axis=1) / weights.sum(axis=1)
+
+    errors = {"multilateration": [], "weighted centroid": []}
+    for num in range(0, count, max(1, count // 10000)):
+        errors["multilateration"].append(distance(true_lat[num], true_lon[num], est_lat[num], est_lon[num]))
+        errors["weighted centroid"].append(distance(true_lat[num], true_lon[num],
+                                                    centroid_lat[num], centroid_lon[num]))
+    print("%s networks, 3-%s sensors, %sdB noise: %.3fsec, %.0f networks/sec" % (
+        count, max_sensors, noise, duration, count / duration))
+    for name, values in errors.items():
+        values.sort()
+        print("%-17s error median %5.1fm, 90%% %5.1fm" % (
+            name, values[len(values) // 2], values[len(values) * 9 // 10]))
+
+
+def benchmark_observations(count=100000, observations=16):
+    """Location estimates of count networks with a full observation reservoir,
+    vectorised compared to a python loop per network
+    """
+    from kismon.observations import ObservationStore
+
+    rnd = random.Random(1)
+    store = ObservationStore(capacity=observations, seed=1)
+    start = time.time()
+    for num in range(count):
+        mac = synthetic_mac(num + 1)
+        lat = 52.3 + rnd.random() * 0.4
+        lon = 13.1 + rnd.random() * 0.6
+        for observation in range(observations * 2):
+            store.add(mac, lat + rnd.gauss(0, 0.001), lon + rnd.gauss(0, 0.001), rnd.randint(-95, -30), observation)
+    print("%s observations of %s networks added in %.2fsec, %.0f bytes per network" % (
+        count * observations * 2, count, time.time() - start, store.nbytes() / count))
+
+    reservoirs = [store.observations(mac) for mac in store.macs]
+    start = time.time()
+    for reservoir in reservoirs:
+        total = lat = lon = 0.0
+        for point_lat, point_lon, signal, timestamp in reservoir:
+            weight = 10 ** (signal / 10)
+            total += weight
+            lat += point_lat * weight
+            lon += point_lon * weight
+        lat / total, lon / total
+    loop_time = time.time() - start
+
+    start = time.time()
+    estimates = store.estimate()
+    vector_time = time.time() - start
+    print("%s estimates: numpy %.3fsec, python loop %.3fsec, %.1fx" % (
+        len(estimates), vector_time, loop_time, loop_time / vector_time))
+
+    macs = store.macs[:1000]
+    for mac in macs:
+        store.add(mac, 52.5, 13.4, -30, observations * 2)
+    start = time.time()
+    store.estimate(macs)
+    print("1000 changed networks: %.2fms" % ((time.time() - start) * 1000))
+
+
+def benchmark_queue(count=200000, budget=12):
+    """Drain a queue of count networks like GLib would, every step of the
+    queue generator is one main loop iteration
+    """
+    networks = test_networks()
+    networks.notify_scheduler.set_budget(budget)
+    lines = {}
+
+    def add_network(mac, changes):
+        lines[mac] = list_line(mac, networks.get_network(mac))
+
+    networks.notify_add_list["network_list"] = add_network
+    fill_queue(networks, count, ("network_list",))
+    print("%s networks queued, budget %sms" % (len(networks.notify_add_queue), budget))
+
+    task = networks.notify_add_queue_process()
+    steps = []
+    start = time.time()
+    while True:
+        step_start = time.monotonic()
+        running = next(task)
+        # the last step counts too, a small queue is drained within it
+        steps.append(time.monotonic() - step_start)
+        if not running:
+            break
+    duration = time.time() - start
+    steps.sort()
+    latency = networks.notify_scheduler.latency_percentiles()
+    print("%s main loop iterations, step p50 %.1fms, p99 %.1fms, max %.1fms" % (
+        len(steps), steps[len(steps) // 2] * 1000, steps[len(steps) * 99 // 100] * 1000, steps[-1] * 1000))
+    print("drained in %.2fsec, %.0f networks/sec, %.1fus per network" % (
+        duration, count / duration, networks.notify_scheduler.item_cost * 1000000))
+    if len(latency) > 0:
+        print("queue latency of the last networks p50 %.2fsec, p90 %.2fsec, p99 %.2fsec" % (
+            latency[50], latency[90], latency[99]))
+
+
+def benchmark_subscribers(count=100000):
+    """Drain a queue of count networks for the list, the map and the export,
+    with the per network callbacks and with the batch callbacks
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in ("json", "sqlite"):
+            for batch in (False, True):
+                subscribers_run(count, backend, batch, os.path.join(tmp_dir, "networks-%s.db" % batch))
+
+
+def subscribers_run(count, backend, batch, db_file):
+    networks = test_networks()
+    if backend == "sqlite":
+        networks.open_database(db_file)
+    lines = {}
+    markers = {}
+    export = {}
+    calls = [0]
+
+    def add_network(mac, changes):
+        calls[0] += 1
+        lines[mac] = list_line(mac, networks.get_network(mac))
+
+    def add_marker(mac, changes):
+        calls[0] += 1
+        network = networks.get_network(mac)
+        markers[mac] = (network.cryptset, network.lat, network.lon)
+
+    def export_add_network(mac, changes):
+        calls[0] += 1
+        export[mac] = True
+
+    def add_networks(macs, items, changes):
+        calls[0] += 1
+        for mac, network in zip(macs, items):
+            lines[mac] = list_line(mac, network)
+
+    def add_markers(macs, items, changes):
+        calls[0] += 1
+        for mac, network in zip(macs, items):
+            markers[mac] = (network.cryptset, network.lat, network.lon)
+
+    def export_add_networks(macs, items, changes):
+        calls[0] += 1
+        for mac in macs:
+            export[mac] = True
+
+    networks.notify_add_list.update({"network_list": add_network, "map": add_marker, "export": export_add_network})
+    networks.notify_remove_list["export"] = lambda mac: None
+    networks.notify_add_fields["export"] = 0
+    if batch:
+        networks.notify_add_batch_list.update({"network_list": add_networks, "map": add_markers,
+                                               "export": export_add_networks})
+    fill_queue(networks, count, ("network_list", "map", "export"))
+    queued = len(networks.notify_add_queue)
+    # a full collection over the records would hit one of the runs at random
+    gc.collect()
+    gc.freeze()
+
+    start = time.time()
+    task = networks.notify_add_queue_process()
+    steps = 0
+    while next(task):
+        steps += 1
+    duration = time.time() - start
+    gc.unfreeze()
+    print("%-6s %-8s callbacks: %s networks in %.2fsec, %.0f networks/sec, %s calls in %s steps" % (
+        backend, "batch" if batch else "per item", queued, duration, queued / duration, calls[0], steps + 1))
+
+
+def benchmark_spatial(count=1000000, queries=100):
+    """bbox, radius and nearest queries on count positions around Berlin,
+    the bbox queries are compared with a linear scan
+    """
+    from kismon.spatial import SpatialIndex, distance
+
+    rnd = random.Random(1)
+    points = [(synthetic_mac(num + 1), 52.3 + rnd.random() * 0.4, 13.1 + rnd.random() * 0.6) for num in range(count)]
+    start = time.time()
+    index = SpatialIndex()
+    for mac, lat, lon in points:
+        index.add(mac, lat, lon)
+    print("%s positions indexed in %.2fsec, %s cells" % (count, time.time() - start, len(index.cells)))
+
+    for size in (0.005, 0.02, 0.1):
+        boxes = []
+        for num in range(queries):
+            lat = 52.3 + rnd.random() * (0.4 - size)
+            lon = 13.1 + rnd.random() * (0.6 - size)
+            boxes.append((lat, lon, lat + size, lon + size))
+
+        start = time.time()
+        found = 0
+        for box in boxes:
+            found += len(index.bbox(*box))
+        index_time = (time.time() - start) / queries
+
+        scan_boxes = boxes[:max(1, queries // 20)]
+        start = time.time()
+        scan_found = 0
+        for min_lat, min_lon, max_lat, max_lon in scan_boxes:
+            scan_found += len([mac for mac, lat, lon in points
+                               if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon])
+        scan_time = (time.time() - start) / len(scan_boxes)
+        print("bbox %.3f degrees: %5.0f results, index %7.3fms, linear scan %7.1fms, %5.0fx" % (
+            size, found / queries, index_time * 1000, scan_time * 1000, scan_time / index_time))
+
+    for meters in (100, 1000):
+        start = time.time()
+        found = 0
+        for num in range(queries):
+            found += len(index.radius(52.3 + rnd.random() * 0.4, 13.1 + rnd.random() * 0.6, meters))
+        print("radius %sm: %5.0f results, %.3fms per query" % (
+            meters, found / queries, (time.time() - start) / queries * 1000))
+
+    for neighbours in (1, 10, 100):
+        start = time.time()
+        for num in range(queries):
+            index.nearest(52.3 + rnd.random() * 0.4, 13.1 + rnd.random() * 0.6, neighbours)
+        print("nearest %s: %.3fms per query" % (neighbours, (time.time() - start) / queries * 1000))
+
+
+def benchmark_time(count=1000000, queries=100):
+    """lasttime range queries on count networks seen over one day,
+    compared with a linear scan
+    """
+    from kismon.store import TimeIndex
+
+    rnd = random.Random(1)
+    now = 1600000000
+    times = [(synthetic_mac(num + 1), now - rnd.randint(0, 86400)) for num in range(count)]
+    start = time.time()
+    index = TimeIndex()
+    for mac, timestamp in times:
+        index.add(mac, timestamp)
+    print("%s timestamps indexed in %.2fsec, %s buckets" % (count, time.time() - start, len(index.buckets)))
+
+    for minutes in (1, 10, 60):
+        start = time.time()
+        found = 0
+        for num in range(queries):
+            found += len(index.range(now - minutes * 60))
+        index_time = (time.time() - start) / queries
+
+        scan_queries = max(1, queries // 20)
+        start = time.time()
+        for num in range(scan_queries):
+            minimum = now - minutes * 60
+            [mac for mac, timestamp in times if timestamp >= minimum]
+        scan_time = (time.time() - start) / scan_queries
+        print("last %2s minutes: %6.0f results, index %7.3fms, linear scan %7.1fms, %5.0fx" % (
+            minutes, found / queries, index_time * 1000, scan_time * 1000, scan_time / index_time))
+
+    start = time.time()
+    for num in range(queries):
+        middle = now - rnd.randint(3600, 80000)
+        index.range(middle - 30, middle + 30)
+    print("1 minute window: %.3fms per query" % ((time.time() - start) / queries * 1000))
+
+
+benchmarks = {
+    'crypt': benchmark_crypt,
+    'devices': benchmark_devices,
+    'exports': benchmark_exports,
+    'filter': benchmark_filter,
+    'formats': benchmark_formats,
+    'history': benchmark_history,
+    'import': benchmark_import,
+    'kmz': benchmark_kmz,
+    'load': benchmark_load,
+    'memory': benchmark_memory,
+    'multilateration': benchmark_multilateration,
+    'netxml': benchmark_netxml,
+    'observations': benchmark_observations,
+    'parser': benchmark_parser,
+    'queue': benchmark_queue,
+    'session': benchmark_session,
+    'spatial': benchmark_spatial,
+    'storage': benchmark_storage,
+    'subscribers': benchmark_subscribers,
+    'time': benchmark_time,
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print("usage: %s <%s> [count]" % (sys.argv[0], "|".join(sorted(benchmarks))))
+        sys.exit(1)
+
+    args = [int(arg) for arg in sys.argv[2:]]
+    start = time.time()
+    benchmarks[sys.argv[1]](*args)
+    print("total time %.1fsec" % (time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
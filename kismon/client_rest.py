@@ -39,6 +39,8 @@ except ModuleNotFoundError:
     # up to Kismet 2019-04-R1
     import KismetRest
 
+from kismon.crypt import encode_cryptset, decode_cryptset
+
 class RestClient:
     def __init__(self, logger):
         self.logger = logger
@@ -257,84 +259,6 @@ class RestClientThread(threading.Thread):
         self.stop()
 
 
-def get_crypt_list():
-    """see packet_ieee80211.h from kismet-newcore
-    """
-    cryptsets = ["none", "unknown", "wep", "layer3 ", "wep40", "wep104",
-                 "tkip", "wpa", "psk", "aes_ocb", "aes_ccm", "leap", "ttls",
-                 "peap", "pptp", "fortress", "keyguard", "unknown_nonwep",
-                 "wpa_migmode", "version_wpa", "version_wpa2"]
-
-    return cryptsets
-
-
-def encode_cryptset(crypts):
-    cryptsets = get_crypt_list()
-    bin_cryptset = []
-    for crypt in cryptsets:
-        if crypt in crypts:
-            bit = "1"
-        else:
-            bit = "0"
-        bin_cryptset.insert(0, bit)
-    cryptset = int("".join(bin_cryptset[:-1]), 2)
-    return cryptset
-
-
-def decode_cryptset(cryptset, return_str=False):
-    cryptsets = get_crypt_list()
-    if cryptset == 0:
-        if return_str is True:
-            return cryptsets[cryptset]
-        else:
-            return [cryptsets[cryptset]]
-
-    crypts = []
-    pos = 1
-    bin_cryptset = bin(cryptset)[2:][::-1]
-    for bit in bin_cryptset:
-        if bit == "1":
-            try:
-                crypts.append(cryptsets[pos])
-            except IndexError:
-                pass
-        pos += 1
-
-    if return_str is True:
-        return ",".join(crypts).upper()
-    else:
-        return crypts
-
-
-def decode_network_typeset(num):
-    """see phy_80211.h from kismet
-    """
-    bits = "{0:b}".format(int(num + 1))
-    type_bits = ['unknown', 'beakon_ap', 'adhoc', 'client', 'wds', 'turbocell', 'inferred_wireless', 'inferred_wired',
-                 'probe_ap']
-
-    flags = []
-    position = len(bits) - 1
-    for bit in bits:
-        if bit == "1":
-            flags.append(type_bits[position])
-        position -= 1
-
-    if 'beakon_ap' in flags or 'probe_ap' in flags:
-        return 'infrastructure'
-    elif 'client' in flags:
-        return 'client'
-    elif 'adhoc' in flags:
-        return 'ad-hoc'
-    elif 'unknown' in flags and len(flags) == 1:
-        return 'unknown'
-    else:
-        print("fixme: unknown type")
-        print(num, "vs.", bits)
-        print(flags)
-        return 'unknown'
-
-
 if __name__ == "__main__":
     client = RestClient()
     client.debug = True
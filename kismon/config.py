@@ -66,10 +66,32 @@ class Config:
             "networks": {
                 "autosave": 5,
                 "num_backups": 5,
+                "journal": True,
+                "journal_compact": 50000,
+                "backend": "json",
+                "notify_budget": 12,  # milliseconds per main loop iteration for the list and the map
+                "observations": 16,  # positions kept per network for the location estimate, needs numpy
             },
             "tracks": {
                 "store": False,
             },
+            "export": {
+                "compression_level": 6,  # KMZ, 0-9
+            },
+            "import": {
+                "workers": 0,  # parser processes, 0 = one per CPU
+            },
+            "signal_history": {
+                "seconds": 600,  # 0 = only record while a signal graph is open
+                "max_sources": 8,  # per network
+                "max_megabytes": 32,
+            },
+            "positioning": {
+                "multilateration": True,  # needs numpy
+                "tx_power": -40,  # dBm at 1 meter
+                "path_loss_exponent": 2.7,
+                "max_rms": 50,  # meters, worse fits are dropped
+            },
             "filter_networks": {
                 "network_list": "current",
                 "map": "current",
@@ -88,6 +110,9 @@ class Config:
                 "wpa2": True,
                 "other": True,
             },
+            "filter_recent": {
+                "minutes": 10,
+            },
             "filter_regexpr": {
                 "ssid": "",
                 "bssid": "",
@@ -37,9 +37,13 @@ from gi.repository import Gtk
 from gi.repository import GLib
 
 from kismon.client_rest import *
+from kismon.crypt import crypt_color
 from kismon.gui import MainWindow
 from kismon.config import Config
 from kismon.networks import Networks
+from kismon.multilateration import Multilateration, is_available as multilateration_available
+from kismon.sqlstore import migrate_json
+from kismon.store import CHANGE_ALL, CHANGE_POSITION
 from kismon.tracks import Tracks
 import kismon.utils as utils
 import kismon.logger
@@ -68,8 +72,15 @@ class Core:
         self.config = self.config_handler.config
 
         self.sources = {}
-        self.crypt_cache = {}
+        self.server_positions = {}  # server_id -> (lat, lon) of the last fix
         self.networks = Networks(config=self.config, logger=logger)
+        self.multilateration = None
+        positioning = self.config["positioning"]
+        if positioning["multilateration"] and multilateration_available():
+            self.multilateration = Multilateration(tx_power=positioning["tx_power"],
+                                                   exponent=positioning["path_loss_exponent"],
+                                                   max_rms=positioning["max_rms"], logger=logger)
+            self.multilateration.start()
         self.client_threads = {}
         self.init_client_threads()
         self.tracks = Tracks("%stracks.json" % user_dir)
@@ -101,42 +112,71 @@ class Core:
             self.main_window.log_list.add("Kismon", self.map_error)
 
         self.networks_file = "%snetworks.json" % user_dir
-        if os.path.isfile(self.networks_file):
+        self.networks_db = "%snetworks.db" % user_dir
+        if self.config["networks"]["backend"] == "sqlite":
             try:
-                self.networks.load(self.networks_file)
+                if not os.path.isfile(self.networks_db) and os.path.isfile(self.networks_file):
+                    migrate_json(self.networks_file, self.networks_db, logger)
+                self.networks.open_database(self.networks_db)
             except:
                 error = sys.exc_info()[1]
                 logger.error(error)
-                dialog_message = "Could not read the networks file '%s':\n%s\n\nDo you want to continue?" % (
-                self.networks_file, error)
-                dialog = Gtk.MessageDialog(self.main_window.gtkwin, Gtk.DialogFlags.DESTROY_WITH_PARENT,
-                                           Gtk.MessageType.ERROR, Gtk.ButtonsType.YES_NO, dialog_message)
-
-                def dialog_response(dialog, response_id):
-                    self.dialog_response = response_id
-
-                dialog.connect("response", dialog_response)
-                dialog.run()
-                dialog.destroy()
-                if self.dialog_response == -9:
+                self.main_window.log_list.add("Kismon", "Could not open the networks database '%s': %s" % (
+                    self.networks_db, error))
+                dialog_message = "Could not open the networks database '%s':\n%s\n\nDo you want to continue?" % (
+                    self.networks_db, error)
+                if not self.continue_dialog(dialog_message):
                     logger.error("exit")
                     self.clients_stop()
                     self.main_window.gtkwin = None
                     return
-        self.networks.set_autosave(self.config["networks"]["autosave"], self.networks_file,
-                                   self.main_window.log_list.add)
+                # nothing is loaded, saving would overwrite the stored networks
+                self.networks_file = None
+        elif os.path.isfile(self.networks_file):
+            # the main window is usable while the networks are loading
+            self.networks.load_progressive(self.networks_file, done=self.on_networks_loaded)
+        if self.networks_file is not None:
+            self.networks.set_autosave(self.config["networks"]["autosave"], self.networks_file,
+                                       self.main_window.log_list.add)
 
         if self.map is not None:
             self.networks.notify_add_list["map"] = self.add_network_to_map
+            self.networks.notify_add_fields["map"] = CHANGE_POSITION
+            self.networks.notify_add_batch_list["map"] = self.add_networks_to_map
             self.networks.notify_remove_list["map"] = self.map.remove_marker
             GLib.timeout_add(100, self.map.set_last_from_config)
 
-        self.main_window.network_list.crypt_cache = self.crypt_cache
-
         GLib.timeout_add(500, self.queues_handler)
         GLib.timeout_add(300, self.queues_handler_networks)
+        GLib.timeout_add(10000, self.networks.expire_recent)
         GLib.idle_add(self.networks.apply_filters)
 
+    def on_networks_loaded(self, error):
+        if error is None:
+            self.main_window.log_list.add("Kismon", "%s networks loaded" % len(self.networks.networks))
+            return
+
+        logger.error(error)
+        dialog_message = "Could not read the networks file '%s':\n%s\n\nDo you want to continue?" % (
+            self.networks_file, error)
+        if not self.continue_dialog(dialog_message):
+            logger.error("exit")
+            # keep the networks file as it is
+            self.networks_file = None
+            self.main_window.gtkwin.destroy()
+
+    def continue_dialog(self, dialog_message):
+        dialog = Gtk.MessageDialog(self.main_window.gtkwin, Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                                   Gtk.MessageType.ERROR, Gtk.ButtonsType.YES_NO, dialog_message)
+
+        def dialog_response(dialog, response_id):
+            self.dialog_response = response_id
+
+        dialog.connect("response", dialog_response)
+        dialog.run()
+        dialog.destroy()
+        return self.dialog_response != -9
+
     def init_map(self):
         if self.map_error is not None:
             self.map = None
@@ -168,6 +208,7 @@ class Core:
 
     def client_stop(self, server_id):
         self.client_threads[server_id].stop()
+        self.server_positions.pop(server_id, None)
 
     def clients_stop(self):
         for server_id in self.client_threads:
@@ -210,6 +251,7 @@ class Core:
                    'fix': data['kismet.common.location.fix'],
                    }
             if data['kismet.common.location.fix'] > 1:
+                self.server_positions[server_id] = (gps['lat'], gps['lon'])
                 if self.config['tracks']['store']:
                     self.tracks.add_point_to_track(server['uri'], gps['lat'], gps['lon'], gps['alt'])
                 if self.map:
@@ -291,32 +333,49 @@ class Core:
         thread = self.client_threads[server_id]
 
         queue = thread.get_queue("dot11")
-        for x in range(0, len(queue)):
-            device = queue.pop(0)
-            if 'dot11.device' not in device or device['dot11.device'] == 0: # skip non-802.11 devices
+        count = len(queue)
+        devices = queue[:count]
+        del queue[:count]
+        self.networks.add_devices(devices, server_id)
+
+        # every datasource of a server with a fix is a sensor for the multilateration
+        sensor_position = None
+        if self.multilateration is not None:
+            sensor_position = self.server_positions.get(server_id)
+        signal_graphs = self.main_window.signal_graphs
+        signal_history = self.networks.signal_history
+        for device in devices:
+            if 'dot11.device' not in device or device['dot11.device'] == 0:  # skipped by add_devices()
                 continue
-            self.networks.add_device_data(device, server_id)
             mac = device['kismet.device.base.macaddr']
+            signal_graph = signal_graphs.get(mac)
+            if signal_graph is None and sensor_position is None and signal_history is None:
+                continue
 
             for source in device['kismet.device.base.seenby']:
                 source_uuid = source['kismet.common.seenby.uuid']
                 if source_uuid not in self.sources[server_id]:
                     continue
-                if mac not in self.main_window.signal_graphs:
-                    continue
 
                 if source['kismet.common.seenby.signal']['kismet.common.signal.type'] != 'dbm':
                     continue
-                self.main_window.signal_graphs[mac].add_value(source_data=self.sources[server_id][source_uuid],
-                                                              packets=source['kismet.common.seenby.num_packets'],
-                                                              signal=source['kismet.common.seenby.signal'][
-                                                                  'kismet.common.signal.last_signal'],
-                                                              timestamp=source['kismet.common.seenby.last_time'],
-                                                              server_id=server_id)
+                signal = source['kismet.common.seenby.signal']['kismet.common.signal.last_signal']
+                if signal_history is not None:
+                    signal_history.add(mac, (server_id, source_uuid), source['kismet.common.seenby.last_time'],
+                                       signal, source['kismet.common.seenby.num_packets'])
+                if signal_graph is not None:
+                    signal_graph.add_value(source_data=self.sources[server_id][source_uuid],
+                                           packets=source['kismet.common.seenby.num_packets'],
+                                           signal=signal,
+                                           timestamp=source['kismet.common.seenby.last_time'],
+                                           server_id=server_id)
+                if sensor_position is not None and signal != 0:
+                    self.multilateration.add(mac, (server_id, source_uuid), sensor_position[0], sensor_position[1],
+                                             signal, source['kismet.common.seenby.last_time'])
 
         if len(self.networks.notify_add_queue) > 0:
             self.networks.start_queue()
-            if len(self.networks.notify_add_queue) > 500:
+            if self.networks.queue_is_large():
                 self.networks.disable_refresh()
                 self.main_window.networks_queue_progress()
 
@@ -325,10 +384,16 @@ class Core:
     def queues_handler_networks(self):
         for server_id in self.client_threads:
             self.queue_handler_networks(server_id)
+        if self.multilateration is not None:
+            self.networks.set_estimated_positions(self.multilateration.get_results())
+            self.multilateration.submit()
         return True
 
     def quit(self):
         self.clients_stop()
+        if self.multilateration is not None:
+            self.multilateration.stop()
+        self.networks.cancel_exports()
 
         if self.map is not None:
             lat = self.map.osm.get_property("latitude")
@@ -338,29 +403,19 @@ class Core:
         while None in self.config['servers']:
             self.config['servers'].remove(None)
         self.config_handler.write()
-        self.networks.save(self.networks_file, force=True)
+        if self.networks_file is not None:
+            self.networks.save(self.networks_file, force=True)
         if self.config['tracks']['store']:
             self.tracks.save()
 
-    def add_network_to_map(self, mac):
+    def add_network_to_map(self, mac, changes=CHANGE_ALL):
         network = self.networks.get_network(mac)
 
-        try:
-            crypt = self.crypt_cache[network["cryptset"]]
-        except KeyError:
-            crypt = decode_cryptset(network["cryptset"], True)
-            self.crypt_cache[network["cryptset"]] = crypt
-
-        if "AES_CCM" in crypt or "AES_OCB" in crypt:
-            color = "red"
-        elif "WPA" in crypt:
-            color = "orange"
-        elif "WEP" in crypt:
-            color = "yellow"
-        else:
-            color = "green"
+        self.map.add_marker(mac, crypt_color(network.cryptset), network.lat, network.lon)
 
-        self.map.add_marker(mac, color, network["lat"], network["lon"])
+    def add_networks_to_map(self, macs, networks, changes):
+        self.map.add_markers([(mac, crypt_color(network.cryptset), network.lat, network.lon)
+                              for mac, network in zip(macs, networks)])
 
 
 def main():
@@ -0,0 +1,165 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Encoding and decoding of kismet cryptsets
+#
+# A cryptset is a bit field, bit n is set if the network uses crypt_list[n + 1].
+# The decoded forms of each cryptset are computed once and kept in tables,
+# there are only a few different cryptsets in practice.
+
+# see packet_ieee80211.h from kismet-newcore
+crypt_list = ("none", "unknown", "wep", "layer3", "wep40", "wep104",
+              "tkip", "wpa", "psk", "aes_ocb", "aes_ccm", "leap", "ttls",
+              "peap", "pptp", "fortress", "keyguard", "unknown_nonwep",
+              "wpa_migmode", "version_wpa", "version_wpa2")
+
+crypt_bits = {crypt: 1 << (pos - 1) for pos, crypt in enumerate(crypt_list) if pos > 0}
+
+# only the known bits are decoded, kismet may set more
+known_bits = (1 << (len(crypt_list) - 1)) - 1
+
+categories = ("none", "wep", "wpa", "wpa2", "other")
+
+category_labels = {"none": "None", "wep": "WEP", "wpa": "WPA", "wpa2": "WPA2", "other": "Other"}
+
+category_colors = {"none": "green", "wep": "yellow", "wpa": "orange", "wpa2": "red", "other": "green"}
+
+netxml_encryptions = (
+    ("layer3", "Layer3"),
+    ("wpa_migmode", "WPA Migration Mode"),
+    ("wep40", "WEP40"),
+    ("wep104", "WEP104"),
+    ("tkip", "WPA+TKIP"),
+    ("psk", "WPA+PSK"),
+    ("aes_ocb", "WPA+AES-OCB"),
+    ("aes_ccm", "WPA+AES-CCM"),
+    ("leap", "WPA+LEAP"),
+    ("ttls", "WPA+TTLS"),
+    ("peap", "WPA+PEAP"),
+    ("pptp", "PPTP"),
+    ("fortress", "Keyguard"),
+)
+
+_lists = {}
+_strings = {}
+_categories = {}
+_netxml = {}
+
+
+def encode_cryptset(crypts):
+    cryptset = 0
+    for crypt in crypts:
+        cryptset |= crypt_bits.get(crypt, 0)
+    return cryptset
+
+
+def decode_cryptset(cryptset, return_str=False):
+    """Tuple of the crypts in a cryptset, or the upper case string if return_str is True
+    """
+    if return_str is True:
+        return crypt_string(cryptset)
+    try:
+        return _lists[cryptset]
+    except KeyError:
+        pass
+    if cryptset == 0:
+        crypts = ("none",)
+    else:
+        bits = cryptset & known_bits
+        crypts = tuple(crypt_list[pos] for pos in range(1, len(crypt_list)) if bits >> (pos - 1) & 1)
+    _lists[cryptset] = crypts
+    return crypts
+
+
+def crypt_string(cryptset):
+    """e.g. "WEP,TKIP,WPA,PSK"
+    """
+    try:
+        return _strings[cryptset]
+    except KeyError:
+        pass
+    crypts = decode_cryptset(cryptset)
+    crypt = ",".join(crypts).upper() if cryptset != 0 else "none"
+    _strings[cryptset] = crypt
+    return crypt
+
+
+def crypt_category(cryptset):
+    """none, wep, wpa, wpa2 or other, as used by the encryption filter
+    """
+    try:
+        return _categories[cryptset]
+    except KeyError:
+        pass
+    crypts = decode_cryptset(cryptset)
+    if cryptset == 0:
+        category = "none"
+    elif "aes_ccm" in crypts or "aes_ocb" in crypts:
+        category = "wpa2"
+    elif "wpa" in crypts:
+        category = "wpa"
+    elif "wep" in crypts:
+        category = "wep"
+    else:
+        category = "other"
+    _categories[cryptset] = category
+    return category
+
+
+def crypt_label(cryptset):
+    """None, WEP, WPA, WPA2 or Other, as used by the exports
+    """
+    return category_labels[crypt_category(cryptset)]
+
+
+def crypt_color(cryptset):
+    """Marker color on the map
+    """
+    return category_colors[crypt_category(cryptset)]
+
+
+def netxml_encryption(cryptset):
+    """<encryption> elements of a network in a kismet netxml file
+    """
+    try:
+        return _netxml[cryptset]
+    except KeyError:
+        pass
+    crypts = decode_cryptset(cryptset)
+    lines = []
+    if cryptset == 0:
+        lines.append("None")
+    if crypts == ["wep"]:
+        lines.append("WEP")
+    for crypt, encryption in netxml_encryptions:
+        if crypt in crypts:
+            lines.append(encryption)
+    xml = "".join("  <encryption>%s</encryption>\n" % encryption for encryption in lines)
+    _netxml[cryptset] = xml
+    return xml
@@ -0,0 +1,392 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Streaming exporters
+#
+# The networks are rendered in batches into one string per batch, a batch is
+# written with a single write call and the memory does not grow with the
+# number of networks. The records are read through a StoreSnapshot, so the
+# export can run in another thread while the networks are changed, an
+# ExportJob runs one of the writers and can be cancelled.
+
+import os
+import threading
+import time
+import zipfile
+
+import simplejson as json
+
+from kismon.crypt import crypt_label, crypt_string, netxml_encryption
+from kismon.store import SCHEMA_VERSION
+import kismon.utils as utils
+
+DAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTH_NAMES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+_dates = {}  # day since the epoch -> (date prefix, year suffix)
+_minutes = ["%02d:%02d:" % (minute // 60, minute % 60) for minute in range(1440)]
+_seconds = ["%02d" % second for second in range(60)]
+
+
+def timestring(timestamp):
+    """time.strftime("%a %b %d %H:%M:%S %Y", time.gmtime(timestamp)) without the locale
+    """
+    day, seconds = divmod(int(timestamp), 86400)
+    try:
+        prefix, suffix = _dates[day]
+    except KeyError:
+        date = time.gmtime(day * 86400)
+        prefix, suffix = _dates[day] = ("%s %s %02d " % (DAY_NAMES[date.tm_wday], MONTH_NAMES[date.tm_mon - 1],
+                                                         date.tm_mday), " %d" % date.tm_year)
+    return prefix + _minutes[seconds // 60] + _seconds[seconds % 60] + suffix
+
+
+def xml_escape(text):
+    if "&" in text or "<" in text or ">" in text:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return text
+
+
+NETXML_HEADER = '<?xml version="1.0" encoding="ISO-8859-1"?>\n' \
+                '<!DOCTYPE detection-run SYSTEM "http://kismetwireless.net/kismet-3.1.0.dtd">\n' \
+                '<detection-run kismet-version="2009.06.R1" start-time="Sat Oct 24 09:05:35 2009">\n\n'
+
+NETXML_NETWORK = '<wireless-network number="%s" type="%s" first-time="%s" last-time="%s">\n' \
+                 ' <SSID first-time="%s" last-time="%s">\n' \
+                 '%s' \
+                 '  <essid cloaked="%s">%s</essid>\n' \
+                 ' </SSID>\n' \
+                 ' <BSSID>%s</BSSID>\n' \
+                 ' <manuf>%s</manuf>\n' \
+                 ' <channel>%s</channel>\n' \
+                 '%s%s' \
+                 '</wireless-network>\n'
+
+NETXML_SIGNAL = ' <snr-info>\n' \
+                '  <last_signal_dbm>%s</last_signal_dbm>\n' \
+                '  <min_signal_dbm>%s</min_signal_dbm>\n' \
+                '  <max_signal_dbm>%s</max_signal_dbm>\n' \
+                ' </snr-info>\n'
+
+NETXML_GPS = ' <gps-info>\n' \
+             '  <min-lat>%(lat)s</min-lat>\n' \
+             '  <min-lon>%(lon)s</min-lon>\n' \
+             '  <max-lat>%(lat)s</max-lat>\n' \
+             '  <max-lon>%(lon)s</max-lon>\n' \
+             '  <peak-lat>%(lat)s</peak-lat>\n' \
+             '  <peak-lon>%(lon)s</peak-lon>\n' \
+             '  <avg-lat>%(lat)s</avg-lat>\n' \
+             '  <avg-lon>%(lon)s</avg-lon>\n' \
+             ' </gps-info>\n'
+
+
+def netxml_networks(batch, number):
+    """<wireless-network> elements of a batch of (mac, record), numbered from number
+    """
+    lines = []
+    for mac, network in batch:
+        firsttime = timestring(network.firsttime)
+        lasttime = timestring(network.lasttime)
+        ssid = xml_escape(network.ssid)
+        manuf = "Unknown" if network.manuf == "" else xml_escape(network.manuf)
+        if network.has_signal():
+            signal = NETXML_SIGNAL % (network.signal_last, network.signal_min, network.signal_max)
+        else:
+            signal = ""
+        lat = network.lat
+        lon = network.lon
+        if lat != 0 and lon != 0:
+            # every float is only formatted once
+            gps = NETXML_GPS % {"lat": repr(lat), "lon": repr(lon)}
+        else:
+            gps = ""
+        lines.append(NETXML_NETWORK % (number, network.type, firsttime, lasttime, firsttime, lasttime,
+                                       netxml_encryption(network.cryptset), ssid == "", ssid,
+                                       mac, manuf, network.channel, signal, gps))
+        number += 1
+    return "".join(lines)
+
+
+def iter_netxml(filename, snapshot, batch_size=1000):
+    """Write the networks of the snapshot as kismet netxml, yields
+    (networks done, total, characters written) after every batch
+    """
+    total = len(snapshot)
+    done = 0
+    written = 0
+
+    def render(batch):
+        return netxml_networks(batch, done)
+
+    # the file is declared as ISO-8859-1, other characters are written as references
+    with open(filename, "w", encoding="ISO-8859-1", errors="xmlcharrefreplace") as f:
+        written += f.write(NETXML_HEADER)
+        for size, data in snapshot.render_batches(render, batch_size):
+            written += f.write(data)
+            done += size
+            yield done, total, written
+        f.write('</detection-run>')
+
+
+def write_netxml(filename, snapshot, progress=None, batch_size=1000):
+    """Write the networks of the snapshot as kismet netxml
+
+    progress(done, total) is called after every batch, in the thread of the caller.
+    """
+    for done, total, written in iter_netxml(filename, snapshot, batch_size):
+        if progress is not None:
+            progress(done, total)
+
+
+KML_HEADER = "<?xml version='1.0' encoding='UTF-8'?>\r\n" \
+             "<kml xmlns='http://earth.google.com/kml/2.1'>\r\n" \
+             "<Document>\r\n" \
+             "<name>Kismon</name>\r\n" \
+             "<open>1</open>"
+
+KML_FOOTER = "\r\n</Document>\r\n</kml>"
+
+KML_FOLDER = """
+<Folder>
+<name>%s: %s APs</name>
+<Style id="%s"><IconStyle><scale>0.5</scale>
+<Icon>
+<href>http://files.salecker.org/kismon/images/%s.gif</href>
+</Icon></IconStyle></Style>
+"""
+
+KML_PLACEMARK = """<Placemark><styleUrl>#%s</styleUrl><name>%s</name>
+<Point><coordinates>%s,%s</coordinates></Point>
+<description><![CDATA[
+SSID: %s<br />
+MAC: %s<br />
+Manuf: %s<br />
+Type: %s<br />
+Channel: %s<br />
+Encryption: <FONT color=%s>%s</FONT><br />
+Last time: %s<br />
+GPS: %s,%s]]></description></Placemark>"""
+
+# crypt label -> icon, in the order of the folders
+KML_FOLDERS = (("WPA2", "WPA"), ("WPA", "WPA"), ("WEP", "WEP"), ("None", "Open"), ("Other", "Open"))
+KML_COLORS = {"WPA2": "red", "WPA": "orange", "WEP": "yellow", "None": "green", "Other": "grey"}
+
+
+def kml_placemarks(batch, crypt):
+    """<Placemark> elements of a batch of (mac, record) of one crypt folder
+    """
+    color = KML_COLORS[crypt]
+    lines = []
+    for mac, network in batch:
+        ssid = xml_escape(network.ssid)
+        lat = repr(network.lat)
+        lon = repr(network.lon)
+        lines.append(KML_PLACEMARK % (
+            crypt, ssid, lon, lat, ssid, mac,
+            network.manuf, network.type, network.channel,
+            color, crypt_string(network.cryptset).upper(), utils.format_timestamp(network.lasttime),
+            lon, lat,
+        ))
+    return "".join(lines)
+
+
+def iter_kmz(filename, snapshot, tracks=None, compresslevel=6, batch_size=1000):
+    """Write the networks with a position and the tracks as KMZ, yields
+    (networks done, total, uncompressed bytes written) after every batch
+
+    The KML is compressed while it is written, the first pass over the
+    snapshot only collects the macs per crypt folder because the number of
+    networks is part of the folder name. tracks is an iterable of KML chunks.
+    """
+    folders = {crypt: [] for crypt, icon in KML_FOLDERS}
+
+    def partition(batch):
+        for mac, network in batch:
+            if network.lat != 0 or network.lon != 0:
+                folders[crypt_label(network.cryptset)].append(mac)
+
+    for size, result in snapshot.render_batches(partition, batch_size):
+        pass
+    total = sum(len(macs) for macs in folders.values())
+    done = 0
+    written = 0
+
+    with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zip_output:
+        with zip_output.open("kismon.kml", "w") as kml:
+            written += kml.write(KML_HEADER.encode())
+            for crypt, icon in KML_FOLDERS:
+                macs = folders[crypt]
+                written += kml.write((KML_FOLDER % (crypt, len(macs), crypt, icon)).encode())
+
+                def render(batch):
+                    return kml_placemarks(batch, crypt)
+
+                for size, data in snapshot.render_batches(render, batch_size, macs):
+                    written += kml.write(data.encode())
+                    done += size
+                    yield done, total, written
+                written += kml.write(b"\n</Folder>")
+            if tracks is not None:
+                for data in tracks:
+                    written += kml.write(data.encode())
+            kml.write(KML_FOOTER.encode())
+
+
+def write_kmz(filename, snapshot, tracks=None, compresslevel=6, progress=None, batch_size=1000):
+    """Write the networks with a position and the tracks as KMZ, progress(done, total)
+    is called after every batch
+    """
+    for done, total, written in iter_kmz(filename, snapshot, tracks, compresslevel, batch_size):
+        if progress is not None:
+            progress(done, total)
+
+
+def csv_networks(batch):
+    """Lines of the MapPoint CSV of a batch of (mac, record), networks without a position are skipped
+    """
+    lines = []
+    for mac, network in batch:
+        if network.lat == 0 and network.lon == 0:
+            continue
+        gps = "%s;%s" % (network.lat, network.lon)
+        lines.append('%s;"%s";%s;%s;%s;%s;\n' % (
+            gps.replace(".", ","), network.ssid.replace(";", " ").replace('"', " "),
+            mac, crypt_label(network.cryptset), network.channel,
+            utils.format_timestamp(network.lasttime)
+        ))
+    return "".join(lines)
+
+
+def iter_csv(filename, snapshot, batch_size=1000):
+    """Write the networks with a position as MapPoint CSV, yields
+    (networks done, total, characters written) after every batch
+    """
+    total = len(snapshot)
+    done = 0
+    with open(filename, "w") as f:
+        written = f.write('Latitude;Longitude;SSID;BSSID;Encryption;Channel;Last Seen;\n')
+        for size, data in snapshot.render_batches(csv_networks, batch_size):
+            written += f.write(data)
+            done += size
+            yield done, total, written
+
+
+def json_networks(batch):
+    return ",\n".join("%s: %s" % (json.dumps(mac), json.dumps(network.to_dict(), sort_keys=True))
+                       for mac, network in batch)
+
+
+def iter_json(filename, snapshot, batch_size=1000):
+    """Write the networks as a kismon networks file sorted by mac, yields
+    (networks done, total, characters written) after every batch
+    """
+    snapshot.macs.sort()
+    total = len(snapshot)
+    done = 0
+    with open(filename, "w") as f:
+        written = f.write('{"schema": %s, "networks": {' % SCHEMA_VERSION)
+        separator = "\n"
+        for size, data in snapshot.render_batches(json_networks, batch_size):
+            if size > 0:
+                written += f.write(separator)
+                written += f.write(data)
+                separator = ",\n"
+            done += size
+            yield done, total, written
+        f.write("\n}}\n")
+
+
+class ExportJob:
+    """An export of a snapshot, one of the iter_* writers
+
+    run() writes the whole file, e.g. in a worker thread, step() writes one
+    batch and can be used as a main loop task. cancel() can be called from
+    any thread, the export stops after the current batch and the partially
+    written file is removed.
+    """
+
+    def __init__(self, name, filename, snapshot, writer):
+        self.name = name
+        self.filename = filename
+        self.snapshot = snapshot
+        self.writer = writer
+        self.done = 0
+        self.total = len(snapshot)
+        self.written = 0
+        self.state = "running"  # done, cancelled or failed
+        self.error = None
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.start_time = time.time()
+        self.duration = 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_running(self):
+        return self.state == "running"
+
+    def fraction(self):
+        if self.state == "done":
+            return 1.0
+        if self.total == 0:
+            return 0.0
+        return self.done / self.total
+
+    def step(self):
+        """Write the next batch, returns False once the job is finished
+        """
+        if self.state != "running":
+            return False
+        if self.cancelled.is_set():
+            return self.finish("cancelled")
+        try:
+            self.done, self.total, self.written = next(self.writer)
+        except StopIteration:
+            return self.finish("done")
+        except Exception as error:
+            self.error = error
+            return self.finish("failed")
+        return True
+
+    def run(self):
+        while self.step():
+            continue
+
+    def finish(self, state):
+        self.writer.close()
+        if state != "done":
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+        self.duration = time.time() - self.start_time
+        self.state = state
+        self.finished.set()
+        return False
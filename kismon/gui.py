@@ -30,6 +30,7 @@ POSSIBILITY OF SUCH DAMAGE.
 
 from kismon.windows import *
 from kismon.widgets import *
+from kismon.store import CHANGE_ALL
 import kismon.utils as utils
 
 from gi.repository import Gtk
@@ -42,6 +43,7 @@ class MainWindow(TemplateWindow):
         TemplateWindow.__init__(self)
         self.config = config
         self.config_window = None
+        self.export_window = None
         self.progress_bar_win = None
         self.client_start = client_start
         self.client_stop = client_stop
@@ -57,6 +59,8 @@ class MainWindow(TemplateWindow):
 
         self.export_networks = {}
         self.networks.notify_add_list["export"] = self.export_add_network
+        self.networks.notify_add_fields["export"] = 0  # only the visibility matters
+        self.networks.notify_add_batch_list["export"] = self.export_add_networks
         self.networks.notify_remove_list["export"] = self.export_remove_network
 
         self.network_list = NetworkList(self.networks, self.locate_marker, self.on_signal_graph, config=config)
@@ -393,6 +397,8 @@ class MainWindow(TemplateWindow):
         mac = self.network_list.network_selected
         signal_window = SignalWindow(mac, self.on_signal_graph_destroy, seconds=self.config['window']['signal_window_seconds'])
         self.signal_graphs[mac] = signal_window
+        if self.networks.signal_history is not None:
+            signal_window.load_history(self.networks.signal_history.get(mac), self.sources)
 
     def on_signal_graph_destroy(self, window, mac):
         del self.signal_graphs[mac]
@@ -428,11 +434,29 @@ class MainWindow(TemplateWindow):
             networks = None
             filtered = False
 
-        self.networks.export_networks(export_format, filename, networks, self.tracks, filtered)
+        job = self.networks.start_export(export_format, filename, networks, self.tracks, filtered,
+                                         done=self.on_export_done)
+        if self.export_window is None:
+            self.export_window = ExportWindow(self.gtkwin)
+            self.export_window.gtkwin.connect("destroy", self.on_export_window_destroy)
+        self.export_window.add_job(job)
 
-    def export_add_network(self, mac):
+    def on_export_done(self, job):
+        if self.export_window is not None and job in self.export_window.jobs:
+            self.export_window.update_job(job)
+        if job.error is not None:
+            self.log_list.add("Kismon", "export to %s failed: %s" % (job.filename, job.error))
+
+    def on_export_window_destroy(self, window):
+        self.export_window = None
+
+    def export_add_network(self, mac, changes=CHANGE_ALL):
         self.export_networks[mac] = True
 
+    def export_add_networks(self, macs, networks, changes):
+        for mac in macs:
+            self.export_networks[mac] = True
+
     def export_remove_network(self, mac):
         self.export_networks[mac] = False
 
@@ -443,8 +467,12 @@ class MainWindow(TemplateWindow):
             on_map = 0
 
         text = "Networks: %s in the current session, %s total, %s in the network list, %s on the map" % \
-               (len(self.networks.recent_networks), len(self.networks.networks), len(self.network_list.network_iter),
+               (len(self.networks.session), len(self.networks.networks), len(self.network_list.network_iter),
                 on_map)
+        if self.networks.loading:
+            progress = self.networks.load_progress
+            text = "Loading networks: %s networks, %.1f of %.1f MB - %s" % (
+                progress["networks"], progress["bytes"] / 1024 / 1024, progress["total_bytes"] / 1024 / 1024, text)
         self.statusbar.push(self.statusbar_context, text)
 
 
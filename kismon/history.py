@@ -0,0 +1,142 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Signal history of the networks per datasource
+#
+# Every (network, source) pair gets a ring buffer with one slot per second of
+# the retention, kismet reports the seenby times in seconds and a second
+# value in the same second replaces the last one. The number of sources per
+# network and the total size are limited, the least recently updated source
+# or network is dropped first.
+
+import array
+import collections
+
+
+class SignalRing:
+    """Fixed size ring buffer of (timestamp, signal, packets)
+    """
+    __slots__ = ('times', 'signals', 'packets', 'next', 'size')
+
+    def __init__(self, capacity):
+        self.times = array.array('d', bytes(8 * capacity))
+        self.signals = array.array('h', bytes(2 * capacity))
+        self.packets = array.array('q', bytes(8 * capacity))
+        self.next = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def nbytes(self):
+        return len(self.times) * (8 + 2 + 8)
+
+    def add(self, timestamp, signal, packets):
+        capacity = len(self.times)
+        if self.size > 0:
+            last = (self.next - 1) % capacity
+            if self.times[last] == timestamp:
+                self.signals[last] = signal
+                self.packets[last] = packets
+                return
+        self.times[self.next] = timestamp
+        self.signals[self.next] = signal
+        self.packets[self.next] = packets
+        self.next = (self.next + 1) % capacity
+        self.size = min(self.size + 1, capacity)
+
+    def last_time(self):
+        return self.times[(self.next - 1) % len(self.times)]
+
+    def values(self, start=None):
+        """(timestamp, signal, packets), oldest first
+        """
+        capacity = len(self.times)
+        first = (self.next - self.size) % capacity
+        result = []
+        for num in range(self.size):
+            slot = (first + num) % capacity
+            timestamp = self.times[slot]
+            if start is None or timestamp >= start:
+                result.append((timestamp, self.signals[slot], self.packets[slot]))
+        return result
+
+
+class SignalHistory:
+    def __init__(self, seconds=600, max_sources=8, max_bytes=32 * 1024 * 1024):
+        self.seconds = seconds
+        self.max_sources = max_sources
+        self.max_bytes = max_bytes
+        self.networks = collections.OrderedDict()  # mac -> {source: SignalRing}, least recently updated first
+        self.bytes = 0
+        self.ring_bytes = seconds * (8 + 2 + 8)
+
+    def __len__(self):
+        return len(self.networks)
+
+    def __contains__(self, mac):
+        return mac in self.networks
+
+    def add(self, mac, source, timestamp, signal, packets):
+        try:
+            sources = self.networks[mac]
+            self.networks.move_to_end(mac)
+        except KeyError:
+            sources = self.networks[mac] = {}
+
+        try:
+            ring = sources[source]
+        except KeyError:
+            if len(sources) >= self.max_sources:
+                oldest = min(sources, key=lambda key: sources[key].last_time())
+                del sources[oldest]
+                self.bytes -= self.ring_bytes
+            ring = sources[source] = SignalRing(self.seconds)
+            self.bytes += self.ring_bytes
+            while self.bytes > self.max_bytes and len(self.networks) > 1:
+                self.remove(next(iter(self.networks)))
+        ring.add(timestamp, signal, packets)
+
+    def remove(self, mac):
+        sources = self.networks.pop(mac, None)
+        if sources is not None:
+            self.bytes -= len(sources) * self.ring_bytes
+
+    def get(self, mac):
+        """source -> [(timestamp, signal, packets)] within the retention, oldest first
+        """
+        sources = self.networks.get(mac)
+        if sources is None:
+            return {}
+        start = max(ring.last_time() for ring in sources.values()) - self.seconds
+        return {source: ring.values(start) for source, ring in sources.items()}
+
+    def clear(self):
+        self.networks = collections.OrderedDict()
+        self.bytes = 0
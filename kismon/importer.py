@@ -0,0 +1,724 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Import of kismet netxml, CSV and .kismet logs and kismon networks files
+#
+# The files are parsed in a pool of worker processes, a worker puts the
+# networks of a file as batches of compact rows into a bounded queue. The
+# main loop merges the batches within a time slice per call, so it stays
+# responsive while the other files are still parsed and the progress of
+# every file can be shown. gzip, bzip2 and xz compressed logs are
+# decompressed while they are read.
+
+import bz2
+import concurrent.futures
+import gzip
+import logging
+import lzma
+import multiprocessing
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import time
+import urllib.parse
+import xml.parsers.expat
+
+import simplejson as json
+
+from kismon.crypt import encode_cryptset
+from kismon.export import MONTH_NAMES
+from kismon.journal import NetworksJournal
+from kismon.store import NetworkRecord, NetworksFileReader, SCHEMA_VERSION, upgrade_network
+
+FILETYPES = ("netxml", "csv", "networks", "kismet")
+
+# extension -> filetype, a compressed file has one of COMPRESSED_EXTENSIONS after it
+EXTENSIONS = {".netxml": "netxml", ".csv": "csv", ".json": "networks", ".kismet": "kismet"}
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".xz")
+
+# magic bytes -> open function of the compressed files
+COMPRESSIONS = (
+    (b"\x1f\x8b", gzip.open),
+    (b"BZh", bz2.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+)
+
+
+def guess_filetype(filename):
+    """Filetype of a file by its extension, "unknown" if it is not supported
+    """
+    name, extension = os.path.splitext(filename.lower())
+    if extension in COMPRESSED_EXTENSIONS:
+        name, extension = os.path.splitext(name)
+    return EXTENSIONS.get(extension, "unknown")
+
+
+def log_opener(filename):
+    """open() for a log file, or gzip.open(), bz2.open() or lzma.open()
+    if the file is compressed
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(6)
+    for prefix, opener in COMPRESSIONS:
+        if magic.startswith(prefix):
+            return opener
+    return open
+
+
+class NetxmlReader:
+    """Incremental kismet netxml parser
+
+    The file is fed to expat in chunks and the networks are yielded as
+    batches of (mac, network dict) while the file is parsed, only the
+    current batch is kept in memory. The text is only collected inside the
+    elements in NETXML_LEAVES, the parent is taken from a stack of the open
+    elements.
+    """
+
+    def __init__(self, f, batch_size=1000, chunk_size=1 << 20):
+        self.f = f
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.stack = []
+        self.text = []
+        self.network = None
+        self.encryption = None
+        self.batch = []
+        self.parser = None
+
+    def __iter__(self):
+        self.parser = parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True  # avoid chunked data
+        parser.ordered_attributes = True  # no dict for the attributes of every element
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        batch_size = self.batch_size
+        while True:
+            data = self.f.read(self.chunk_size)
+            parser.Parse(data, len(data) == 0)
+            while len(self.batch) >= batch_size:
+                yield self.batch[:batch_size]
+                del self.batch[:batch_size]
+            if len(data) == 0:
+                if len(self.batch) > 0:
+                    yield self.batch
+                    self.batch = []
+                return
+
+    def start_element(self, name, attrs):
+        """<name attr="">
+        """
+        self.stack.append(name)
+        if name in NETXML_LEAVES:
+            del self.text[:]
+            self.parser.CharacterDataHandler = self.text.append
+        elif name == "wireless-network":
+            attrs = dict(zip(attrs[::2], attrs[1::2]))
+            self.network = {
+                "type": attrs["type"],
+                "firsttime": timestring2timestamp(attrs["first-time"]),
+                "lasttime": timestring2timestamp(attrs["last-time"]),
+                "ssid": "",
+                "cryptset": 0,
+                "crypt": "",
+                "lat": 0.0,
+                "lon": 0.0,
+                "signal_dbm": {}
+            }
+        elif name == "SSID":
+            self.encryption = []
+
+    def end_element(self, name):
+        """</name>, the text of a child of wireless-network, SSID, gps-info or snr-info
+        """
+        stack = self.stack
+        stack.pop()
+        leaf = NETXML_LEAVES.get(name)
+        if leaf is not None:
+            self.parser.CharacterDataHandler = None
+        network = self.network
+        if network is None:
+            return
+        if leaf is None:
+            if name == "wireless-network":
+                mac = network.pop("mac", None)
+                if mac is not None:
+                    self.batch.append((mac, network))
+                self.network = None
+            elif name == "SSID" and len(self.encryption) > 0 and stack[-1] == "wireless-network":
+                crypts = []
+                for crypt in self.encryption:
+                    if crypt.startswith("WPA"):
+                        if "wpa" not in crypts:
+                            crypts.append("wpa")
+                        if crypt.startswith("WPA+"):
+                            crypts.append(crypt.split("+")[1].lower().replace("-", "_"))
+                    else:
+                        crypts.append(crypt.lower().replace("-", "_"))
+                network["crypt"] = ",".join(crypts)
+                network["cryptset"] = encode_cryptset(crypts)
+            return
+
+        parent, key, convert = leaf
+        if stack[-1] != parent:
+            return
+        data = "".join(self.text)
+        if data.strip() == "":
+            return
+        if parent == "wireless-network":
+            network[key] = convert(data)
+        elif parent == "SSID":
+            if key == "encryption":
+                if data not in self.encryption:
+                    self.encryption.append(data)
+            elif stack[-2] == "wireless-network":
+                network["ssid"] = data
+        elif stack[-2] == "wireless-network":
+            if parent == "gps-info":
+                network[key] = convert(data)
+            else:
+                network["signal_dbm"][key] = convert(data)
+
+
+# element -> (parent, key, type) of the values read from a netxml file
+NETXML_LEAVES = {
+    "BSSID": ("wireless-network", "mac", str),
+    "channel": ("wireless-network", "channel", int),
+    "manuf": ("wireless-network", "manuf", str),
+    "encryption": ("SSID", "encryption", str),
+    "essid": ("SSID", "ssid", str),
+    "peak-lat": ("gps-info", "lat", float),
+    "peak-lon": ("gps-info", "lon", float),
+    "min_signal_dbm": ("snr-info", "min", int),
+    "max_signal_dbm": ("snr-info", "max", int),
+    "last_signal_dbm": ("snr-info", "last", int),
+}
+
+
+def iter_csv(filename, logger, batch_size=1000):
+    """Yield batches of (mac, network dict) of a kismet CSV file
+    """
+    batch = []
+    with log_opener(filename)(filename, "rt") as f:
+        head = f.readline().split(";")[:-1]
+        for line in f:
+            data = dict(zip(head, line.split(";")[:-1]))
+
+            crypts = []
+            for crypt in data["Encryption"].split(","):
+                crypts.append(crypt.lower().replace("-", "_"))
+
+            batch.append((data["BSSID"], {
+                "type": data["NetType"],
+                "channel": int(data["Channel"]),
+                "firsttime": timestring2timestamp(data["FirstTime"]),
+                "lasttime": timestring2timestamp(data["LastTime"]),
+                "lat": float(data["GPSBestLat"]),
+                "lon": float(data["GPSBestLon"]),
+                "manuf": "",
+                "ssid": data["ESSID"],
+                "cryptset": encode_cryptset(crypts),
+                "crypt": ",".join(crypts)
+            }))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+MONTHS = {name: num + 1 for num, name in enumerate(MONTH_NAMES)}
+
+_timestamps = {}  # timestring -> timestamp
+_hours = {}  # "Oct 24 09 2009" -> timestamp of the full hour
+
+
+def time_tuple(timestring, minute=None, second=None):
+    try:
+        month = MONTHS[timestring[4:7]]
+    except KeyError:
+        raise ValueError("unknown month in %r" % timestring)
+    if minute is None:
+        minute = int(timestring[14:16])
+        second = int(timestring[17:19])
+    return int(timestring[20:]), month, int(timestring[8:10]), int(timestring[11:13]), minute, second, 0, 0, -1
+
+
+def hour_start(timestring):
+    """Timestamp of the start of the hour, None if the hour has a daylight
+    saving time switch or exists twice
+    """
+    start = int(time.mktime(time_tuple(timestring, 0, 0)))
+    first = time.localtime(start)
+    last = time.localtime(start + 3599)
+    if (first.tm_min, first.tm_sec, last.tm_min, last.tm_sec) != (0, 0, 59, 59) or first.tm_hour != last.tm_hour:
+        return None
+    for other in (time.localtime(start - 3600), time.localtime(start + 3600)):
+        if (other.tm_mday, other.tm_hour) == (first.tm_mday, first.tm_hour):
+            return None
+    return start
+
+
+def timestring2timestamp(timestring):
+    """Local timestamp of a kismet time like "Sat Oct 24 09:05:35 2009"
+
+    The same as time.mktime(time.strptime(timestring)) in the C locale,
+    without strptime and the locale. The start of the hour comes from
+    mktime once per hour, the results are cached because many networks
+    share the same second.
+    """
+    try:
+        return _timestamps[timestring]
+    except KeyError:
+        pass
+    if len(timestring) != 24 or timestring[13] != ":" or timestring[16] != ":" or timestring[19] != " ":
+        raise ValueError("time data %r does not match format '%%a %%b %%d %%H:%%M:%%S %%Y'" % timestring)
+    hour = timestring[4:13] + timestring[19:]
+    try:
+        start = _hours[hour]
+    except KeyError:
+        start = _hours[hour] = hour_start(timestring)
+        if len(_hours) > 10000:
+            _hours.clear()
+    if start is None:
+        timestamp = int(time.mktime(time_tuple(timestring)))
+    else:
+        timestamp = start + int(timestring[14:16]) * 60 + int(timestring[17:19])
+    if len(_timestamps) > 100000:
+        _timestamps.clear()
+    _timestamps[timestring] = timestamp
+    return timestamp
+
+
+def record_row(mac, network):
+    """Compact row of a network dict or record, a tuple pickles without the keys
+    """
+    if type(network) is not NetworkRecord:
+        network = NetworkRecord.from_dict(network)
+    return (mac, network.type, network.channel, network.firsttime, network.lasttime, network.lat, network.lon,
+            network.manuf, network.ssid, network.cryptset, network.crypt, network.signal_min, network.signal_max,
+            network.signal_last, network.comment, network.servers, network.codename)
+
+
+def row_record(row):
+    """mac and NetworkRecord of a row
+    """
+    (mac, network_type, channel, firsttime, lasttime, lat, lon, manuf, ssid, cryptset, crypt,
+     signal_min, signal_max, signal_last, comment, servers, codename) = row
+    record = NetworkRecord(network_type, channel, firsttime, lasttime, lat, lon, manuf, ssid, cryptset, crypt,
+                           comment, servers, codename)
+    record.set_signal(signal_min, signal_max, signal_last)
+    return mac, record
+
+
+def iter_networks_file(filename, logger, batch_size=1000):
+    """Yield batches of (mac, network) of a kismon networks file while it
+    is read, the networks of its journal follow in the last batches
+    """
+    batch = []
+    with log_opener(filename)(filename, "rb") as f:
+        reader = NetworksFileReader(f)
+        for mac, network in reader:
+            # "Upgrade" networks created by older versions of kismon
+            if reader.schema < SCHEMA_VERSION:
+                upgrade_network(network)
+            batch.append((mac, network))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    journal = NetworksJournal(filename, logger=logger)
+    for mac, network in journal.replay():
+        batch.append((mac, network))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def iter_netxml(filename, logger, batch_size=1000):
+    """Yield batches of (mac, network dict) of a netxml file
+    """
+    if not os.path.isfile(filename):
+        logger.error("Parser: filename is not a file (%s)" % filename)
+        return
+    with log_opener(filename)(filename, "rb") as f:
+        yield from NetxmlReader(f, batch_size)
+
+
+def decode_network_typeset(num):
+    """see phy_80211.h from kismet
+    """
+    bits = "{0:b}".format(int(num + 1))
+    type_bits = ['unknown', 'beakon_ap', 'adhoc', 'client', 'wds', 'turbocell', 'inferred_wireless', 'inferred_wired',
+                 'probe_ap']
+
+    flags = []
+    position = len(bits) - 1
+    for bit in bits:
+        if bit == "1":
+            flags.append(type_bits[position])
+        position -= 1
+
+    if 'beakon_ap' in flags or 'probe_ap' in flags:
+        return 'infrastructure'
+    elif 'client' in flags:
+        return 'client'
+    elif 'adhoc' in flags:
+        return 'ad-hoc'
+    elif 'unknown' in flags and len(flags) == 1:
+        return 'unknown'
+    else:
+        logging.getLogger(__name__).warning("unknown network typeset %s (%s), flags %s" % (num, bits, flags))
+        return 'unknown'
+
+
+def parse_device(device, logger=None):
+    """mac and NetworkRecord of a kismet device
+    """
+    mac = device['kismet.device.base.macaddr']
+    dot11 = device['dot11.device']
+    channel = device['kismet.device.base.channel']
+    channel = int(channel) if channel.isdigit() else 0
+
+    ssid = ''
+    cryptset = 0
+    ssid_map = dot11.get('dot11.device.advertised_ssid_map')
+    if ssid_map:
+        if len(ssid_map) > 1 and logger is not None:
+            logger.error("todo: multiple SSIDs per device %s" % mac)
+        ssid = ssid_map[0]['dot11.advertisedssid.ssid']
+        cryptset = ssid_map[0]['dot11.advertisedssid.crypt_set']
+    if ssid == '':
+        ssid = dot11.get('dot11.device.last_beaconed_ssid', '')
+
+    lat = 0
+    lon = 0
+    location = device.get('kismet.device.base.location')
+    if location and location['kismet.common.location.loc_fix'] >= 2:
+        geopoint = location['kismet.common.location.avg_loc']['kismet.common.location.geopoint']
+        lon = geopoint[0]
+        lat = geopoint[1]
+
+    network = NetworkRecord(
+        network_type=decode_network_typeset(dot11['dot11.device.typeset']),
+        channel=channel,
+        firsttime=device['kismet.device.base.first_time'],
+        lasttime=device['kismet.device.base.last_time'],
+        lat=lat,
+        lon=lon,
+        manuf=device['kismet.device.base.manuf'],
+        ssid=ssid,
+        cryptset=cryptset,
+        crypt=device['kismet.device.base.crypt'],
+    )
+    if device['kismet.common.signal.type'] == 'dbm':
+        network.set_signal(device['kismet.common.signal.min_signal'], device['kismet.common.signal.max_signal'],
+                           device['kismet.common.signal.last_signal'])
+    else:
+        network.set_signal(0, 0, 0)
+    return mac, network
+
+
+def log_device(device):
+    """A device from the devices table of a .kismet log in the layout of
+    the devices of the REST client, which are requested with simplified
+    signal fields
+    """
+    signal = device.get('kismet.device.base.signal')
+    if signal:
+        for field in ('type', 'min_signal', 'max_signal', 'last_signal'):
+            device['kismet.common.signal.' + field] = signal.get('kismet.common.signal.' + field, 0)
+    else:
+        device['kismet.common.signal.type'] = 'none'
+    dot11 = device['dot11.device']
+    ssid_map = dot11.get('dot11.device.advertised_ssid_map')
+    if isinstance(ssid_map, dict):
+        # a map of the ssid hashes in older logs
+        dot11['dot11.device.advertised_ssid_map'] = list(ssid_map.values())
+    return device
+
+
+def iter_kismet(filename, logger, batch_size=1000):
+    """Yield batches of (mac, NetworkRecord) of the 802.11 devices of a .kismet log
+
+    The JSON of the devices is fetched from the devices table in chunks. A
+    compressed log is decompressed into a temporary file first, SQLite
+    needs a file it can seek in.
+    """
+    if not os.path.isfile(filename):
+        logger.error("Parser: filename is not a file (%s)" % filename)
+        return
+    opener = log_opener(filename)
+    database = filename
+    if opener is not open:
+        fd, database = tempfile.mkstemp(suffix=".kismet")
+        with os.fdopen(fd, "wb") as f, opener(filename, "rb") as compressed:
+            shutil.copyfileobj(compressed, f, 1 << 20)
+    try:
+        # read only, kismet might still write the log
+        connection = sqlite3.connect("file:%s?mode=ro" % urllib.parse.quote(os.path.abspath(database)), uri=True)
+        try:
+            cursor = connection.execute("SELECT device FROM devices WHERE phyname = 'IEEE802.11'")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                batch = []
+                for row in rows:
+                    device = json.loads(row[0])
+                    if not device.get('dot11.device'):
+                        continue
+                    batch.append(parse_device(log_device(device)))
+                if len(batch) > 0:
+                    yield batch
+        finally:
+            connection.close()
+    finally:
+        if database != filename:
+            os.remove(database)
+
+
+def iter_file(filetype, filename, batch_size=1000):
+    """Yield the networks of a file as batches of rows
+    """
+    logger = logging.getLogger(__name__)
+    if filetype == "networks":
+        batches = iter_networks_file(filename, logger, batch_size)
+    elif filetype == "netxml":
+        batches = iter_netxml(filename, logger, batch_size)
+    elif filetype == "csv":
+        batches = iter_csv(filename, logger, batch_size)
+    elif filetype == "kismet":
+        batches = iter_kismet(filename, logger, batch_size)
+    else:
+        raise ValueError("unknown filetype %s" % filetype)
+    for batch in batches:
+        yield [record_row(mac, network) for mac, network in batch]
+
+
+_batches = None
+_stopped = None
+
+
+def init_worker(batches, stopped):
+    """Initializer of the worker processes, a multiprocessing queue can
+    only be handed to a process when it is started
+    """
+    global _batches, _stopped
+    _batches = batches
+    _stopped = stopped
+    # the batches of a cancelled import are not needed anymore
+    batches.cancel_join_thread()
+
+
+def parse_file(num, filetype, filename, batch_size=1000):
+    """Parse a file in a worker process, returns the number of batches
+
+    The batches of rows are put into the bounded queue of the pipeline as
+    (num, batch), a worker waits while the queue is full.
+    """
+    count = 0
+    for batch in iter_file(filetype, filename, batch_size):
+        while True:
+            try:
+                _batches.put((num, batch), timeout=0.1)
+                break
+            except queue.Full:
+                if _stopped.is_set():
+                    return count
+        count += 1
+    return count
+
+
+class ImportFile:
+    """State of a file in the import pipeline
+    """
+    def __init__(self, filename, filetype):
+        self.filename = filename
+        self.filetype = filetype
+        self.status = "queued"  # parsing, done, failed or skipped
+        self.networks = 0
+        self.new = 0
+        self.error = None
+        self.future = None
+        self.reader = None
+        self.batches = 0
+
+    def progress(self):
+        if self.status == "parsing" and self.batches > 0:
+            return "parsing, %s batches" % self.batches
+        return self.status
+
+
+class ImportPipeline:
+    """Parses files in worker processes and merges the networks in the main loop
+
+    merge(mac, record) is called for every network and returns True if
+    the network is new. The workers put the batches into a queue of
+    queue_size batches, so the memory is bounded by the batches in flight
+    and not by the size of the files. With workers=0 the files are parsed
+    in the main process, a batch at a time.
+    """
+
+    def __init__(self, files, merge, workers=None, batch_size=1000, time_slice=0.02, queue_size=None):
+        self.files = [ImportFile(filename, filetype) for filename, filetype in files]
+        self.merge = merge
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.batch_size = batch_size
+        self.time_slice = time_slice
+        self.queue_size = queue_size or self.workers * 2
+        self.executor = None
+        self.batches = None
+        self.stopped = None
+        self.current = None
+        self.idle = False
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        for import_file in self.files:
+            if import_file.filetype not in FILETYPES:
+                import_file.status = "skipped"
+        if self.workers > 0:
+            # spawn, a forked worker would inherit the threads and the GTK state of the main process
+            context = multiprocessing.get_context("spawn")
+            self.batches = context.Queue(self.queue_size)
+            self.stopped = context.Event()
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context,
+                initializer=init_worker, initargs=(self.batches, self.stopped))
+            for num, import_file in enumerate(self.files):
+                if import_file.status == "queued":
+                    import_file.future = self.executor.submit(parse_file, num, import_file.filetype,
+                                                              import_file.filename, self.batch_size)
+                    import_file.status = "parsing"
+
+    def stop(self):
+        if self.executor is not None:
+            self.stopped.set()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.current is not None:
+            self.current.reader.close()
+            self.current = None
+
+    def is_finished(self):
+        return all(import_file.status in ("done", "failed", "skipped") for import_file in self.files)
+
+    def files_done(self):
+        return sum(1 for import_file in self.files if import_file.status in ("done", "failed", "skipped"))
+
+    def next_batch(self):
+        """(ImportFile, batch) of the next parsed batch, None if no batch is ready
+        """
+        if self.executor is not None:
+            try:
+                num, batch = self.batches.get_nowait()
+            except queue.Empty:
+                return None
+            import_file = self.files[num]
+            import_file.batches += 1
+            return import_file, batch
+
+        while True:
+            if self.current is None:
+                for import_file in self.files:
+                    if import_file.status == "queued":
+                        import_file.reader = iter_file(import_file.filetype, import_file.filename, self.batch_size)
+                        import_file.status = "parsing"
+                        self.current = import_file
+                        break
+                else:
+                    return None
+            import_file = self.current
+            try:
+                batch = next(import_file.reader)
+            except StopIteration:
+                import_file.status = "done"
+            except Exception as error:
+                import_file.status = "failed"
+                import_file.error = error
+            else:
+                import_file.batches += 1
+                return import_file, batch
+            import_file.reader = None
+            self.current = None
+
+    def update_files(self):
+        """A file parsed by a worker is done once all of its batches are merged
+        """
+        for import_file in self.files:
+            if import_file.status != "parsing" or import_file.future is None or not import_file.future.done():
+                continue
+            try:
+                count = import_file.future.result()
+            except Exception as error:
+                import_file.status = "failed"
+                import_file.error = error
+                continue
+            if import_file.batches == count:
+                import_file.status = "done"
+                import_file.future = None
+
+    def step(self):
+        """Merge batches until the time slice is used up, returns False once all files are done
+        """
+        deadline = time.time() + self.time_slice
+        merge = self.merge
+        self.idle = True
+        while time.time() < deadline:
+            next_batch = self.next_batch()
+            if next_batch is None:
+                break
+            self.idle = False
+            import_file, batch = next_batch
+            new = 0
+            for row in batch:
+                mac, record = row_record(row)
+                if merge(mac, record):
+                    new += 1
+            import_file.networks += len(batch)
+            import_file.new += new
+        self.update_files()
+
+        if self.is_finished():
+            self.stop()
+            return False
+        return True
+
+    def run(self):
+        """Import all files and wait until they are merged
+        """
+        self.start()
+        while self.step():
+            if self.idle:
+                time.sleep(0.005)
@@ -0,0 +1,127 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+import simplejson as json
+
+from kismon.store import record_to_json
+
+
+class NetworksJournal:
+    """Append-only log of changed networks since the last snapshot
+
+    The first line identifies the snapshot (networks.json) the journal
+    belongs to, every following line contains one complete network:
+    ["mac", {network}]
+    A journal which doesn't match the current snapshot is ignored.
+    """
+
+    def __init__(self, snapshot_filename, logger):
+        self.snapshot_filename = snapshot_filename
+        self.filename = "%s.journal" % snapshot_filename
+        self.logger = logger
+        self.entries = 0
+        self.broken = False
+
+    def snapshot_header(self):
+        try:
+            stat = os.stat(self.snapshot_filename)
+        except FileNotFoundError:
+            return None
+        return {"snapshot_size": stat.st_size, "snapshot_mtime": stat.st_mtime}
+
+    def read_header(self):
+        try:
+            with open(self.filename) as f:
+                line = f.readline()
+        except FileNotFoundError:
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def is_valid(self):
+        header = self.snapshot_header()
+        return header is not None and header == self.read_header()
+
+    def reset(self):
+        """Start an empty journal for the current snapshot
+        """
+        new_file = "%s.new" % self.filename
+        with open(new_file, "w") as f:
+            f.write(json.dumps(self.snapshot_header()))
+            f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(new_file, self.filename)
+        self.entries = 0
+        self.broken = False
+
+    def remove(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+        self.entries = 0
+
+    def append(self, networks):
+        """Append (mac, network) pairs, returns the number of written bytes
+        """
+        lines = []
+        for mac, network in networks:
+            lines.append(json.dumps([mac, network], separators=(',', ':'), default=record_to_json))
+        lines.append("")
+        data = "\n".join(lines)
+        with open(self.filename, "a") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries += len(lines) - 1
+        return len(data)
+
+    def replay(self):
+        """Yield the (mac, network) pairs of a valid journal
+        """
+        self.entries = 0
+        if not self.is_valid():
+            if os.path.isfile(self.filename):
+                self.logger.info("Ignoring outdated journal %s" % self.filename)
+            return
+
+        with open(self.filename) as f:
+            f.readline()
+            for line in f:
+                try:
+                    mac, network = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete after a crash
+                    self.logger.error("Invalid line in %s, stopping replay" % self.filename)
+                    self.broken = True
+                    break
+                self.entries += 1
+                yield mac, network
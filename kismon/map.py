@@ -91,10 +91,9 @@ class Map:
             pass
 
         self.coordinates = {}
-        for mac in list(self.markers.keys()):
-            marker = self.markers[mac]
-            del self.markers[mac]
-            self.add_marker(marker.key, marker.color, marker.lat, marker.lon)
+        markers = [(marker.key, marker.color, marker.lat, marker.lon) for marker in self.markers.values()]
+        self.markers = {}
+        self.add_markers(markers)
 
         self.widget = self.osm
 
@@ -221,24 +220,36 @@ class Map:
         lat: latitude
         lon: longitude
         """
-        if self.is_position_invalid(lat, lon):
-            return
-        try:
-            marker = self.markers[key]
-            self.update_marker(marker, key, lat, lon)
-            return
-        except KeyError:
-            pass
+        self.add_markers(((key, color, lat, lon),))
 
-        self.add_image(lat, lon, key, color)
-        self.markers[key] = Marker(key, lat, lon, color)
+    def add_markers(self, markers):
+        """Add or move a batch of markers, a list of (key, color, lat, lon)
 
-    def add_image(self, lat, lon, key, color):
-        if not self.occupy_position(lat, lon, key):
-            return
+        All markers are placed first, then the image of every touched
+        position is updated once. A position which changes several times
+        within the batch is only changed once in osm-gps-map, which redraws
+        in its next idle callback.
+        """
+        touched = set()
+        update_positions = self.config["update_marker_positions"]
+        for key, color, lat, lon in markers:
+            if self.is_position_invalid(lat, lon):
+                continue
+            marker = self.markers.get(key)
+            if marker is None:
+                self.markers[key] = Marker(key, lat, lon, color)
+            elif update_positions is False or (marker.lat == lat and marker.lon == lon):
+                continue
+            else:
+                self.coordinates[marker.lat][marker.lon]["markers"].remove(key)
+                touched.add((marker.lat, marker.lon))
+                marker.lat = lat
+                marker.lon = lon
+            self.occupy_position(lat, lon, key)
+            touched.add((lat, lon))
 
-        image = self.osm.image_add(lat, lon, self.textures[color])
-        self.coordinates[lat][lon]["image"] = image
+        for lat, lon in touched:
+            self.update_image(lat, lon)
 
     def add_track(self, lat, lon, key, color=None):
         if key not in self.tracks:
@@ -266,62 +277,29 @@ class Map:
             color = Gdk.RGBA(r / 65535, g / 65535, b / 65535, 1)
             track.set_property('color', color)
 
-    def clear_position(self, lat, lon, key):
-        self.coordinates[lat][lon]["markers"].remove(key)
-        renew = False
-        if len(self.coordinates[lat][lon]["markers"]) != 0:
-            next = self.coordinates[lat][lon]["markers"][0]
-            if self.markers[key].color != self.markers[next].color:
-                renew = True
-        else:
-            next = None
-
-        if next is None or renew is True:
-            self.osm.image_remove(self.coordinates[lat][lon]["image"])
-            del self.coordinates[lat][lon]["image"]
-
-        if renew is True:
-            next = self.coordinates[lat][lon]["markers"][0]
-            self.add_image(lat, lon, next, self.markers[next].color)
-
-    def update_marker(self, marker, key, lat, lon):
-        if self.config["update_marker_positions"] is False:
+    def update_image(self, lat, lon):
+        """Show the color of the first marker at a position, the image is
+        only replaced if the color changes
+        """
+        position = self.coordinates[lat][lon]
+        markers = position["markers"]
+        color = self.markers[markers[0]].color if len(markers) > 0 else None
+        if color == position["color"]:
             return
-        old_lat = marker.lat
-        old_lon = marker.lon
-        if old_lat != lat or old_lon != lon:
-            new = False
-            try:
-                if len(self.coordinates[lat][lon]["markers"]) > 0:
-                    self.coordinates[lat][lon]["markers"].append(key)
-                else:
-                    new = True
-            except KeyError:
-                new = True
-
-            if new:
-                self.add_image(lat, lon, key, marker.color)
-
-            marker.lat = lat
-            marker.lon = lon
-            self.clear_position(old_lat, old_lon, key)
+        if position["color"] is not None:
+            self.osm.image_remove(position.pop("image"))
+        if color is not None:
+            position["image"] = self.osm.image_add(lat, lon, self.textures[color])
+        position["color"] = color
 
     def occupy_position(self, lat, lon, key):
         try:
-            if key in self.coordinates[lat][lon]["markers"]:
-                return True
-            self.coordinates[lat][lon]["markers"].append(key)
-            if len(self.coordinates[lat][lon]["markers"]) == 1:
-                return True
-            else:
-                return False
+            position = self.coordinates[lat][lon]
         except KeyError:
-            if lat not in self.coordinates:
-                self.coordinates[lat] = {lon: {"markers": [key, ]}}
-                return True
-            else:
-                self.coordinates[lat][lon] = {"markers": [key, ]}
-                return True
+            position = {"markers": [], "color": None}
+            self.coordinates.setdefault(lat, {})[lon] = position
+        if key not in position["markers"]:
+            position["markers"].append(key)
 
     def remove_marker(self, key):
         try:
@@ -329,8 +307,9 @@ class Map:
         except KeyError:
             return
 
-        self.clear_position(marker.lat, marker.lon, key)
+        self.coordinates[marker.lat][marker.lon]["markers"].remove(key)
         del self.markers[key]
+        self.update_image(marker.lat, marker.lon)
 
     def remove_track(self, key):
         if key in self.tracks:
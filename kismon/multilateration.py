@@ -0,0 +1,239 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Position estimates from the signals of several sensors
+#
+# Every datasource which sees a network is a sensor at the GPS position of its
+# server. The signal is converted into a distance with a log-distance path
+# loss model, the position of the network is the weighted least squares fit
+# of these distances, solved with a few Gauss-Newton steps for all networks at
+# once. The observations are collected in the main loop and solved in a
+# worker thread.
+#
+# numpy is optional, without it no positions are estimated.
+
+import logging
+import queue
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from kismon.spatial import METERS_PER_DEGREE
+
+
+def is_available():
+    return numpy is not None
+
+
+def signal_distance(signal, tx_power=-40.0, exponent=2.7):
+    """Distance in meters for a signal in dBm, tx_power is the signal at 1 meter
+    """
+    return 10 ** ((tx_power - signal) / (10 * exponent))
+
+
+def multilaterate(lat, lon, distances, mask, iterations=10):
+    """Weighted least squares positions of n networks from up to m sensors each
+
+    lat, lon, distances and mask are (n, m) arrays, mask marks the used
+    sensors. Distant sensors get a lower weight, the start is the weighted
+    centroid. Returns the lat, lon and rms residual in meters as arrays.
+    """
+    count = mask.sum(axis=1)
+    ref_lat = (lat * mask).sum(axis=1) / count
+    ref_lon = (lon * mask).sum(axis=1) / count
+    scale_lon = METERS_PER_DEGREE * numpy.cos(numpy.radians(ref_lat))
+    x = (lon - ref_lon[:, None]) * scale_lon[:, None]
+    y = (lat - ref_lat[:, None]) * METERS_PER_DEGREE
+    weights = numpy.where(mask, 1 / numpy.maximum(distances, 1.0) ** 2, 0.0)
+    total = weights.sum(axis=1)
+    px = (x * weights).sum(axis=1) / total
+    py = (y * weights).sum(axis=1) / total
+
+    for iteration in range(iterations):
+        dx = px[:, None] - x
+        dy = py[:, None] - y
+        ranges = numpy.maximum(numpy.sqrt(dx * dx + dy * dy), 1e-3)
+        residuals = ranges - distances
+        jx = dx / ranges
+        jy = dy / ranges
+        # 2x2 normal equations, damped to stay solvable for sensors on a line
+        a = (weights * jx * jx).sum(axis=1)
+        b = (weights * jx * jy).sum(axis=1)
+        c = (weights * jy * jy).sum(axis=1)
+        damping = 1e-3 * (a + c) + 1e-12
+        a += damping
+        c += damping
+        gx = (weights * jx * residuals).sum(axis=1)
+        gy = (weights * jy * residuals).sum(axis=1)
+        determinant = a * c - b * b
+        px -= (c * gx - b * gy) / determinant
+        py -= (a * gy - b * gx) / determinant
+
+    ranges = numpy.sqrt((px[:, None] - x) ** 2 + (py[:, None] - y) ** 2)
+    rms = numpy.sqrt((weights * (ranges - distances) ** 2).sum(axis=1) / total)
+    return ref_lat + py / METERS_PER_DEGREE, ref_lon + px / scale_lon, rms
+
+
+class Multilateration:
+    """Collects the sensor observations per network and solves them in a worker
+
+    add() and submit() are called from the main loop, get_results() returns
+    the (mac, lat, lon) of the finished estimates. Only the newest
+    observation per sensor and position is kept, at most max_sensors per
+    network and none older than max_age seconds. Fits with a rms residual
+    above max_rms meters are dropped.
+    """
+
+    def __init__(self, tx_power=-40.0, exponent=2.7, min_sensors=3, max_sensors=16, max_age=300, max_rms=50.0,
+                 logger=None):
+        self.tx_power = tx_power
+        self.exponent = exponent
+        self.max_rms = max_rms
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.min_sensors = min_sensors
+        self.max_sensors = max_sensors
+        self.max_age = max_age
+        self.observations = {}  # mac -> {(sensor, position cell): (lat, lon, signal, timestamp)}
+        self.pending = set()
+        self.last_prune = time.time()
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.busy = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.jobs.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def add(self, mac, sensor, lat, lon, signal, timestamp):
+        # about 10 meters, a moving sensor adds an observation per cell
+        key = (sensor, round(lat, 4), round(lon, 4))
+        try:
+            sensors = self.observations[mac]
+        except KeyError:
+            sensors = self.observations[mac] = {}
+        sensors[key] = (lat, lon, signal, timestamp)
+        if len(sensors) > self.max_sensors:
+            del sensors[min(sensors, key=lambda item: sensors[item][3])]
+        if len(sensors) >= self.min_sensors:
+            self.pending.add(mac)
+
+    def submit(self):
+        """Hand the networks with new observations to the worker, the
+        next job is only created after the last one was solved
+        """
+        now = time.time()
+        if now - self.last_prune > self.max_age:
+            self.prune(now)
+        if self.busy or len(self.pending) == 0:
+            return False
+
+        oldest = now - self.max_age
+        macs = []
+        rows = []
+        for mac in self.pending:
+            sensors = self.observations.get(mac)
+            if sensors is None:
+                continue
+            row = [value for value in sensors.values() if value[3] >= oldest]
+            if len(set((value[0], value[1]) for value in row)) >= self.min_sensors:
+                macs.append(mac)
+                rows.append(row)
+        self.pending = set()
+        if len(macs) == 0:
+            return False
+
+        shape = (len(macs), max(len(row) for row in rows))
+        lat = numpy.zeros(shape)
+        lon = numpy.zeros(shape)
+        signal = numpy.zeros(shape)
+        mask = numpy.zeros(shape, dtype=bool)
+        for num, row in enumerate(rows):
+            size = len(row)
+            row_lat, row_lon, row_signal, row_time = zip(*row)
+            lat[num, :size] = row_lat
+            lon[num, :size] = row_lon
+            signal[num, :size] = row_signal
+            mask[num, :size] = True
+        self.busy = True
+        self.jobs.put((macs, lat, lon, signal, mask))
+        return True
+
+    def worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            results = []
+            try:
+                results = self.solve(*job)
+            except Exception as error:
+                self.logger.error("Multilateration failed: %s" % error)
+            # an empty result clears busy too, the next job is submitted
+            self.results.put(results)
+
+    def solve(self, macs, lat, lon, signal, mask):
+        distances = signal_distance(signal, self.tx_power, self.exponent)
+        lat, lon, rms = multilaterate(lat, lon, distances, mask)
+        valid = numpy.isfinite(lat) & numpy.isfinite(lon) & (rms <= self.max_rms)
+        return [(mac, mac_lat, mac_lon) for mac, mac_lat, mac_lon, mac_valid
+                in zip(macs, lat.tolist(), lon.tolist(), valid.tolist()) if mac_valid]
+
+    def get_results(self):
+        results = []
+        while True:
+            try:
+                results.extend(self.results.get(block=False))
+            except queue.Empty:
+                return results
+            self.busy = False
+
+    def prune(self, now):
+        """Remove the observations older than max_age
+        """
+        oldest = now - self.max_age
+        for mac in list(self.observations):
+            sensors = self.observations[mac]
+            for key in [key for key, value in sensors.items() if value[3] < oldest]:
+                del sensors[key]
+            if len(sensors) == 0:
+                del self.observations[mac]
+        self.last_prune = now
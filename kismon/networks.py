@@ -28,26 +28,58 @@ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 POSSIBILITY OF SUCH DAMAGE.
 """
 
+import collections
+import math
 import os
 import simplejson as json
-import xml.parsers.expat
-import locale
 from gi.repository import GLib
-import zipfile
 import re
+import threading
+import queue
 
 from kismon.client_rest import *
+from kismon.store import NetworkRecord, NetworkStore, StoreSnapshot, NetworkIndex, NetworkQuery, NetworksFileReader, \
+    SessionTracker, SCHEMA_VERSION, load_networks_json, upgrade_network, CHANGE_POSITION, CHANGE_SIGNAL, \
+    CHANGE_SSID, CHANGE_CRYPT, CHANGE_CHANNEL, CHANGE_LASTTIME, CHANGE_SERVERS, CHANGE_TYPE, CHANGE_FIRSTTIME, \
+    CHANGE_NEW, CHANGE_ALL
+from kismon.sqlstore import SQLiteNetworkStore
+from kismon.export import ExportJob, iter_csv, iter_json, iter_kmz, iter_netxml
+from kismon.history import SignalHistory
+from kismon.importer import FILETYPES, ImportPipeline, iter_file, parse_device, row_record
+from kismon.observations import ObservationStore, is_available as observations_available
+from kismon.scheduler import NotifyScheduler
+from kismon.spatial import EARTH_RADIUS, distance, radius_bbox
+from kismon.journal import NetworksJournal
 import kismon.utils as utils
 
 class Networks:
     def __init__(self, config, logger):
-        self.networks = {}
+        self.networks = NetworkStore()
         self.config = config
         self.logger = logger
-        self.recent_networks = []
+        self.session = SessionTracker()
+        self.index = NetworkIndex()
         self.notify_add_list = {}
         self.notify_add_queue = {}
+        self.notify_add_order = collections.deque()  # (mac, queue time), networks of the session first
+        self.notify_scheduler = NotifyScheduler()
+        self.observations = None
+        self.estimated_positions = {}  # mac -> (lat, lon) from the multilateration
+        self.signal_history = None
+        if config is not None:
+            history = config["signal_history"]
+            if history["seconds"] > 0:
+                self.signal_history = SignalHistory(history["seconds"], history["max_sources"],
+                                                    history["max_megabytes"] * 1024 * 1024)
+            self.notify_scheduler.set_budget(config["networks"]["notify_budget"])
+            if observations_available() and config["networks"]["observations"] > 0:
+                self.observations = ObservationStore(config["networks"]["observations"])
         self.notify_remove_list = {}
+        self.notify_add_fields = {}  # target -> changes the target is interested in
+        # target -> function(macs, networks, changes), called with lists instead of every single network
+        self.notify_add_batch_list = {}
+        self.notify_targets = {}  # target -> macs which were queued for the target
+        self.notify_counters = {"queued": 0, "suppressed": 0, "unchanged": 0}
         self.disable_refresh_functions = []
         self.refresh_disabled = False
         self.resume_refresh_functions = []
@@ -57,22 +89,232 @@ class Networks:
         self.autosave_task = None
         self.autosave_filename = None
         self.autosave_notify = None
+        self.changed_networks = set()
+        self.journal = None
+        self.snapshot = None
+        self.export_snapshots = []
+        self.export_jobs = []
+        self.save_thread = None
+        self.save_result = None
+        self.loading = False
+        self.load_filename = None
+        self.load_thread = None
+        self.load_queue = None
+        self.load_task = None
+        self.load_done_callback = None
+        self.load_progress = {"networks": 0, "bytes": 0, "total_bytes": 0}
+        self.load_updated_networks = set()
+        self.snapshot_required = False
+        self.network_filter = None
+        self.filter_targets = None
 
     def get_network(self, mac):
         return self.networks[mac]
 
-    def save(self, filename, notify=None, force=False):
-        if self.queue_running and not force:
-            self.logger.info("Cannot save networks - queue is running")
+    def set_changed(self, mac):
+        self.changed_networks.add(mac)
+
+    def get_journal(self, filename):
+        if self.journal is None or self.journal.snapshot_filename != filename:
+            self.journal = NetworksJournal(filename, logger=self.logger)
+        return self.journal
+
+    def prepare_change(self, mac):
+        """Has to be called before an existing network is changed,
+        index_network() has to be called after the change
+        """
+        if self.snapshot is not None:
+            self.snapshot.freeze(mac)
+        for snapshot in self.export_snapshots:
+            snapshot.freeze(mac)
+        self.networks.touch(mac)
+        if self.index is not None:
+            self.index.discard(mac, self.networks[mac])
+
+    def update_locations(self, macs=None):
+        """Write the location estimates of the networks with new observations
+        into the records, all networks if macs is None
+
+        Returns the macs of the moved networks.
+        """
+        moved = []
+        if self.observations is None:
+            return moved
+        for mac, lat, lon in self.observations.estimate(macs):
+            network = self.networks[mac]
+            if mac in self.estimated_positions or (network.lat == lat and network.lon == lon):
+                continue
+            self.prepare_change(mac)
+            network = self.networks[mac]
+            network.lat = lat
+            network.lon = lon
+            self.index_network(mac)
+            self.changed_networks.add(mac)
+            moved.append(mac)
+        return moved
+
+    def set_estimated_positions(self, positions):
+        """Positions (mac, lat, lon) from the multilateration, they take
+        precedence over the estimates from the observations
+        """
+        changes = {}
+        for mac, lat, lon in positions:
+            network = self.networks.get(mac)
+            if network is None:
+                continue
+            self.estimated_positions[mac] = (lat, lon)
+            if network.lat == lat and network.lon == lon:
+                continue
+            self.prepare_change(mac)
+            network = self.networks[mac]
+            network.lat = lat
+            network.lon = lon
+            changes[mac] = CHANGE_POSITION
+        if len(changes) > 0:
+            self.notify_add_batch(list(changes), changes)
+
+    def index_network(self, mac):
+        if self.index is not None:
+            self.index.add(mac, self.networks[mac])
+
+    def set_network(self, mac, network):
+        """Add or replace a network
+        """
+        if self.index is not None and mac in self.networks:
+            self.index.discard(mac, self.networks[mac])
+        self.networks[mac] = network
+        self.index_network(mac)
+
+    def edit_network(self, mac, values):
+        self.prepare_change(mac)
+        network = self.networks[mac]
+        for key in values:
+            network[key] = values[key]
+        self.index_network(mac)
+        self.set_changed(mac)
+
+    def save(self, filename, notify=None, force=False, background=False):
+        """Save the changed networks to the journal or all networks to a new snapshot
+
+        Only a cheap snapshot is taken on the calling thread, the networks
+        are written in a worker thread if background is True.
+        """
+        if self.save_thread is not None:
+            if not force:
+                self.logger.info("Cannot save networks - the previous save is still running")
+                return True
+            # apply the result of the running save before its idle callback, a failed save
+            # has to put its networks back into changed_networks for this one
+            self.save_thread.join()
+            self.finish_save()
+        if self.loading:
+            # a save now would overwrite the file with the partially loaded networks
+            if not force:
+                self.logger.info("Cannot save networks - the networks are still loading")
+                return True
+            self.finish_loading()
+
+        start_time = time.time()
+        # the estimates of the networks which were not displayed or exported since their last observations
+        moved = self.update_locations()
+        if len(moved) > 0:
+            self.notify_add_batch(moved, dict.fromkeys(moved, CHANGE_POSITION))
+        if self.networks.is_database:
+            return self.save_database(notify)
+
+        changed = self.changed_networks
+        self.changed_networks = set()
+        journal = self.get_journal(filename)
+        if self.config["networks"]["journal"] and not journal.broken and not self.snapshot_required and \
+                journal.is_valid() and \
+                journal.entries + len(changed) <= self.config["networks"]["journal_compact"]:
+            networks = [(mac, self.networks[mac].copy()) for mac in changed]
+            job = (self.save_journal, journal, networks)
+            msg = "saving %s changed networks to %s" % (len(networks), journal.filename)
+        else:
+            self.snapshot = StoreSnapshot(self.networks)
+            job = (self.save_snapshot, filename, journal, self.snapshot)
+            msg = "saving %s networks to %s" % (len(self.snapshot), filename)
+        pause = time.time() - start_time
+
+        if len(changed) == 0 and job[0] == self.save_journal:
             return True
 
-        msg = "saving %s networks to %s" % (len(self.networks), filename)
         self.logger.info(msg)
         if notify is not None:
             notify("Kismon", msg)
 
+        if background:
+            self.save_thread = threading.Thread(target=self.save_worker,
+                                                args=(job, changed, notify, start_time, pause, True))
+            self.save_thread.start()
+        else:
+            self.save_worker(job, changed, notify, start_time, pause, False)
+        return True
+
+    def save_worker(self, job, changed, notify, start_time, pause, background):
+        try:
+            job[0](*job[1:])
+            error = None
+        except Exception as e:
+            error = e
+
+        duration = time.time() - start_time
+        if background:
+            self.save_result = (changed, notify, pause, duration, error)
+            GLib.idle_add(self.finish_save)
+        else:
+            self.save_done(changed, notify, pause, duration, error)
+
+    def finish_save(self):
+        """Apply the result of a background save, only once if a forced save was faster than the idle callback
+        """
+        result = self.save_result
+        self.save_result = None
+        if result is not None:
+            self.save_done(*result)
+        return False
+
+    def save_done(self, changed, notify, pause, duration, error):
+        if self.snapshot is not None and error is None:
+            self.snapshot_required = False
+        self.snapshot = None
+        if self.save_thread is not None:
+            self.save_thread.join()
+            self.save_thread = None
+
+        if error is not None:
+            # keep the networks for the next try
+            self.changed_networks.update(changed)
+            msg = "saving networks failed: %s" % error
+            self.logger.error(msg)
+        else:
+            msg = "networks saved, snapshot pause %.1fms, total %.2fsec" % (pause * 1000, duration)
+            self.logger.info(msg)
+        if notify is not None:
+            notify("Kismon", msg)
+        return False
+
+    def save_database(self, notify):
+        """The database is always complete, only the changed records are flushed
+        """
+        start_time = time.time()
+        count = self.networks.flush()
+        self.changed_networks = set()
+        if count == 0:
+            return True
+        msg = "%s networks saved to %s in %.2fsec" % (count, self.networks.filename, time.time() - start_time)
+        self.logger.info(msg)
+        if notify is not None:
+            notify("Kismon", msg)
+        return True
+
+    def save_journal(self, journal, networks):
+        journal.append(networks)
+
+    def save_snapshot(self, filename, journal, snapshot):
         tmpfilename = filename + ".new"
-        self.save_networks(tmpfilename)
+        self.write_networks(tmpfilename, snapshot.iter_dicts())
         for num in range(self.config["networks"]["num_backups"] - 2, -1, -1):
             backup_filename = "%s.%s" % (filename, num)
             if os.path.isfile(backup_filename):
@@ -81,13 +323,40 @@ class Networks:
         if os.path.isfile(filename):
             os.rename(filename, filename + ".0")
         os.rename(tmpfilename, filename)
-        return True
 
-    def save_networks(self, filename):
+        if self.config["networks"]["journal"]:
+            journal.reset()
+        else:
+            journal.remove()
+
+    def save_networks(self, filename, networks=None):
+        if networks is None:
+            networks = self.networks
+        self.write_networks(filename, ((mac, self.networks[mac].to_dict()) for mac in sorted(networks)))
+
+    @staticmethod
+    def write_networks(filename, networks):
+        """Write (mac, network dict) pairs as json, one network per line
+        after the schema header
+        """
         new_file = "%s.new" % filename
-        f = open(new_file, "w")
-        json.dump(self.networks, f, sort_keys=True, indent=2)
-        f.close()
+        with open(new_file, "w") as f:
+            f.write('{"schema": %s, "networks": {' % SCHEMA_VERSION)
+            separator = "\n"
+            lines = []
+            for mac, network in networks:
+                lines.append("%s: %s" % (json.dumps(mac), json.dumps(network, sort_keys=True)))
+                if len(lines) == 1000:
+                    f.write(separator)
+                    f.write(",\n".join(lines))
+                    separator = ",\n"
+                    lines = []
+            if len(lines) > 0:
+                f.write(separator)
+                f.write(",\n".join(lines))
+            f.write("\n}}\n")
+            f.flush()
+            os.fsync(f.fileno())
         os.rename(new_file, filename)
 
     def set_autosave(self, minutes, filename=None, notify=None):
@@ -100,103 +369,423 @@ class Networks:
             GLib.source_remove(self.autosave_task)
 
         if minutes > 0:
-            self.autosave_task = GLib.timeout_add(minutes * 60 * 1000, self.save, self.autosave_filename,
-                                                  self.autosave_notify)
+            self.autosave_task = GLib.timeout_add(minutes * 60 * 1000, self.autosave)
+
+    def autosave(self):
+        self.save(self.autosave_filename, self.autosave_notify, background=True)
+        return True
 
     def load(self, filename):
         f = open(filename)
 
         self.logger.info("Loading networks.json")
 
-        self.networks = json.load(f)
+        # the networks are converted to records while parsing, this keeps
+        # the peak memory usage close to the size of the final store
+        self.networks, schema = load_networks_json(f)
+        f.close()
+        if schema < SCHEMA_VERSION:
+            self.logger.info("Upgraded networks from schema %s to %s" % (schema, SCHEMA_VERSION))
+            self.snapshot_required = True
 
-        # "Upgrade" networks created by older versions of kismon
-        for mac in self.networks:
-            network = self.networks[mac]
-            if 'comment' not in network:
-                network['comment'] = ""
-            if 'codename' not in network:
-                network['codename'] = ""                
-            if 'servers' not in network:
-                network['servers'] = []
-            if 'crypt' not in network:
-                crypt = decode_cryptset(network['cryptset'], return_str=True)
-                if 'WEP,' in crypt and 'WPA' in crypt:
-                    crypt = crypt.replace('WEP,', '')
-                network['crypt'] = crypt
-            if network["type"] in ('generic', 'probe', 'data'):
-                network["type"] = 'unknown'
+        journal = self.get_journal(filename)
+        for mac, network in journal.replay():
+            self.networks[mac] = network
+        if journal.entries > 0:
+            self.logger.info("Replayed %s changes from %s" % (journal.entries, journal.filename))
+        self.changed_networks = set()
+        self.index = NetworkIndex()
+        self.index.rebuild(self.networks)
 
-        f.close()
+        self.logger.info("Total networks %d" % (len(self.networks)))
+
+    def load_progressive(self, filename, done=None, batch_size=1000):
+        """Load networks.json without blocking the main loop
+
+        A worker thread parses the file, the records are added to the
+        store and the notify queue in batches from the main loop.
+        done(error) is called when the file is completely loaded.
+        """
+        self.logger.info("Loading %s" % filename)
+        self.loading = True
+        self.load_filename = filename
+        self.load_done_callback = done
+        self.load_updated_networks = set()
+        self.load_progress = {"networks": 0, "bytes": 0, "total_bytes": os.path.getsize(filename),
+                              "start_time": time.time()}
+        self.load_queue = queue.Queue(maxsize=20)
+        self.load_thread = threading.Thread(target=self.load_worker, args=(filename, batch_size))
+        self.load_thread.daemon = True
+        self.load_thread.start()
+        self.load_task = GLib.timeout_add(50, self.load_process)
+
+    def load_worker(self, filename, batch_size):
+        """Runs in the worker thread, puts (networks, bytes read) batches into the load queue
+        """
+        try:
+            with open(filename, "rb") as f:
+                reader = NetworksFileReader(f)
+                batch = []
+                for mac, network in reader:
+                    # "Upgrade" networks created by older versions of kismon
+                    if reader.schema < SCHEMA_VERSION:
+                        upgrade_network(network)
+                    batch.append((mac, network))
+                    if len(batch) == batch_size:
+                        self.load_queue.put((batch, reader.bytes_read))
+                        batch = []
+                self.load_queue.put((batch, reader.bytes_read))
+            if reader.schema < SCHEMA_VERSION:
+                self.logger.info("Upgraded networks from schema %s to %s" % (reader.schema, SCHEMA_VERSION))
+                self.snapshot_required = True
+            self.load_queue.put(None)
+        except Exception as error:
+            self.load_queue.put(error)
+
+    def load_process(self, block=False):
+        """Add the parsed batches to the store, limited to 50ms per call
+        """
+        start_time = time.time()
+        while block or time.time() - start_time < 0.05:
+            try:
+                item = self.load_queue.get(block=block)
+            except queue.Empty:
+                break
+            if item is None or isinstance(item, Exception):
+                self.start_queue()
+                self.load_done(item)
+                return False
+
+            networks, bytes_read = item
+            macs = []
+            for mac, network in networks:
+                if mac in self.load_updated_networks:
+                    # the network was seen again while the file was loading
+                    self.merge_loaded_network(mac, network)
+                else:
+                    self.set_network(mac, network)
+                macs.append(mac)
+            self.load_progress["networks"] += len(networks)
+            self.load_progress["bytes"] = bytes_read
+            self.apply_filters_on_networks(macs)
+        self.start_queue()
+        return True
+
+    def merge_loaded_network(self, mac, loaded):
+        self.prepare_change(mac)
+        network = self.networks[mac]
+        network.firsttime = min(network.firsttime, loaded.firsttime)
+        if network.lat == 0 and network.lon == 0:
+            network.lat = loaded.lat
+            network.lon = loaded.lon
+        for key in ("comment", "codename"):
+            if loaded[key] != "":
+                network[key] = loaded[key]
+        for server_uri in loaded.servers:
+            network.add_server(server_uri)
+        if loaded.has_signal() and network.has_signal():
+            network.signal_min = min(network.signal_min, loaded.signal_min)
+            network.signal_max = max(network.signal_max, loaded.signal_max)
+        self.index_network(mac)
+
+    def load_done(self, error):
+        self.load_task = None
+        self.load_thread.join()
+        self.load_thread = None
+        self.load_queue = None
+
+        if error is None:
+            journal = self.get_journal(self.load_filename)
+            macs = []
+            for mac, network in journal.replay():
+                network = NetworkRecord.from_dict(network)
+                if mac in self.load_updated_networks:
+                    self.merge_loaded_network(mac, network)
+                else:
+                    self.set_network(mac, network)
+                macs.append(mac)
+            if journal.entries > 0:
+                self.logger.info("Replayed %s changes from %s" % (journal.entries, journal.filename))
+                self.apply_filters_on_networks(macs)
+                self.start_queue()
+            self.logger.info("Loaded %s networks in %.1fsec, total networks %d" % (
+                self.load_progress["networks"], time.time() - self.load_progress["start_time"], len(self.networks)))
+        else:
+            self.logger.error("Loading %s failed: %s" % (self.load_filename, error))
 
+        self.loading = False
+        self.load_updated_networks = set()
+        if self.load_done_callback is not None:
+            self.load_done_callback(error)
+
+    def finish_loading(self):
+        """Block until the file is completely loaded
+        """
+        if self.load_task is not None:
+            GLib.source_remove(self.load_task)
+            self.load_process(block=True)
+
+    def open_database(self, filename):
+        """Use a SQLite database instead of networks.json, the records
+        are loaded on demand.
+        """
+        self.logger.info("Opening %s" % filename)
+        self.networks = SQLiteNetworkStore(filename)
+        self.changed_networks = set()
+        # the database evaluates the filters itself
+        self.index = None
         self.logger.info("Total networks %d" % (len(self.networks)))
 
+    def filter_query(self):
+        """The compiled filter, it is only rebuilt by apply_filters() after a config change
+        """
+        if self.network_filter is None:
+            try:
+                self.network_filter = NetworkQuery.from_config(self.config)
+            except re.error as error:
+                self.logger.error("Invalid regular expression in the filter: %s" % error)
+                config = dict(self.config)
+                config["filter_regexpr"] = {"ssid": "", "bssid": ""}
+                self.network_filter = NetworkQuery.from_config(config)
+        return self.network_filter
+
+    def select_networks(self, query, networks=None):
+        """macs of the networks which match the query, evaluated by the
+        database if possible
+        """
+        if self.networks.is_database and (networks is None or networks is self.networks or len(networks) > 1000):
+            macs = self.networks.select_macs(query)
+            if networks is None or networks is self.networks:
+                return macs
+            macs = set(macs)
+            return [mac for mac in networks if mac in macs]
+        if networks is None:
+            if query.bbox is not None and self.index is not None:
+                networks = self.index.positions.bbox(*query.bbox)
+            elif query.lasttime_min is not None and self.index is not None:
+                networks = self.index.lasttimes.range(query.lasttime_min)
+            else:
+                networks = self.networks
+        return [mac for mac in networks if query.matches(mac, self.networks[mac])]
+
+    def networks_seen_between(self, start=None, end=None):
+        """macs of the networks with start <= lasttime <= end
+        """
+        if self.index is not None:
+            return self.index.lasttimes.range(start, end)
+        macs = self.select_networks(NetworkQuery(lasttime_min=start))
+        if end is None:
+            return macs
+        return [mac for mac in macs if self.networks[mac].lasttime <= end]
+
+    def networks_first_seen_between(self, start=None, end=None):
+        """macs of the networks with start <= firsttime <= end
+        """
+        if self.index is not None:
+            return self.index.firsttimes.range(start, end)
+        return [mac for mac, network in self.networks.items()
+                if (start is None or network.firsttime >= start) and (end is None or network.firsttime <= end)]
+
+    def networks_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """macs of the networks inside the bounding box
+        """
+        if self.index is not None:
+            return self.index.positions.bbox(min_lat, min_lon, max_lat, max_lon)
+        return self.select_networks(NetworkQuery(has_position=True, bbox=(min_lat, min_lon, max_lat, max_lon)))
+
+    def networks_in_radius(self, lat, lon, meters):
+        """(distance, mac) of the networks within meters around lat/lon, nearest first
+        """
+        if self.index is not None:
+            return self.index.positions.radius(lat, lon, meters)
+        result = []
+        for mac in self.networks_in_bbox(*radius_bbox(lat, lon, meters)):
+            network = self.networks[mac]
+            network_distance = distance(lat, lon, network.lat, network.lon)
+            if network_distance <= meters:
+                result.append((network_distance, mac))
+        result.sort()
+        return result
+
+    def nearest_networks(self, lat, lon, count):
+        """(distance, mac) of the count nearest networks with a position
+        """
+        if self.index is not None:
+            return self.index.positions.nearest(lat, lon, count)
+        meters = 1000
+        while True:
+            result = self.networks_in_radius(lat, lon, meters)
+            if len(result) >= count or meters > math.pi * EARTH_RADIUS:
+                return result[:count]
+            meters *= 4
+
     def apply_filters(self):
-        self.stop_queue()
-        self.apply_filters_on_networks()
+        old_filter = self.network_filter
+        old_targets = self.filter_targets
+        self.network_filter = None
+        self.filter_targets = self.get_filter_targets()
+        new_filter = self.filter_query()
+        if self.index is not None and old_filter is not None and old_targets == self.filter_targets and \
+                new_filter.same_patterns(old_filter):
+            self.apply_filter_delta(old_filter, new_filter)
+        else:
+            self.stop_queue()
+            self.apply_filters_on_networks()
         self.disable_refresh()
         self.start_queue()
 
+    def get_filter_targets(self):
+        targets = {}
+        for target in self.config["filter_networks"]:
+            if target in self.notify_add_list:
+                targets[target] = self.config["filter_networks"][target]
+        return targets
+
+    def apply_filter_delta(self, old_filter, new_filter):
+        """Only the type or crypt filter changed, the networks which have to be
+        added or removed are found with the indexes
+        """
+        hidden = self.index.select(new_filter.excluded_types - old_filter.excluded_types,
+                                   new_filter.excluded_crypts - old_filter.excluded_crypts)
+        shown = self.index.select(old_filter.excluded_types - new_filter.excluded_types,
+                                  old_filter.excluded_crypts - new_filter.excluded_crypts)
+        removed = [mac for mac in hidden if old_filter.matches(mac, self.networks[mac])]
+        added = [mac for mac in shown if new_filter.matches(mac, self.networks[mac])]
+        self.logger.debug("filter changed, %s networks removed, %s added" % (len(removed), len(added)))
+
+        self.unqueue_networks(removed)
+        for mac in removed:
+            self.notify_remove(mac)
+        self.apply_filters_on_networks(added)
+
     def check_filter(self, mac, network):
-        if network["type"] not in self.config["filter_type"]:
-            self.logger.error("fixme: unknown network type %s" % network["type"])
+        if network.type not in self.config["filter_type"]:
+            self.logger.error("fixme: unknown network type %s" % network.type)
             self.logger.error(mac)
             self.logger.error(network)
-        elif not self.config["filter_type"][network["type"]]:
-            return False
-
-        crypts = decode_cryptset(network["cryptset"])
-        if crypts == ["none"]:
-            crypt = "none"
-        elif "aes_ccm" in crypts or "aes_ocb" in crypts:
-            crypt = "wpa2"
-        elif "wpa" in crypts:
-            crypt = "wpa"
-        elif "wep" in crypts:
-            crypt = "wep"
-        else:
-            crypt = "other"
-        if not self.config["filter_crypt"][crypt]:
-            return False
-
-        if self.config["filter_regexpr"]["ssid"] != "":
-            if re.search(r"%s" % self.config["filter_regexpr"]["ssid"], network["ssid"]) is None:
-                return False
-        if self.config["filter_regexpr"]["bssid"] != "":
-            if re.search(r"%s" % self.config["filter_regexpr"]["bssid"], mac, re.IGNORECASE) is None:
-                return False
+        return self.filter_query().matches(mac, network)
 
-        return True
+    def apply_filters_on_networks(self, networks=None, changes=None):
+        """Queue the matching networks for the targets and remove the others
 
-    def apply_filters_on_networks(self, networks=None):
+        A network which is already queued for a target is only queued again
+        if the changes include fields the target is interested in.
+        """
         if networks is None:
             networks = self.networks
 
-        targets = {}
-        for target in self.config["filter_networks"]:
-            if target in self.notify_add_list:
-                targets[target] = self.config["filter_networks"][target]
+        targets = self.get_filter_targets()
+        recent_min = time.time() - self.config["filter_recent"]["minutes"] * 60
+        if networks is self.networks or changes is None:
+            changes = {}
+        if networks is self.networks:
+            # every matching network is queued again
+            shown = self.notify_targets
+            self.notify_targets = {}
+            if self.index is not None and "all" not in targets.values():
+                networks = self.get_limited_networks(targets, shown, recent_min)
+        target_macs = {}
+        target_fields = {}
+        for target in targets:
+            target_macs[target] = self.notify_targets.setdefault(target, set())
+            target_fields[target] = self.notify_add_fields.get(target, CHANGE_ALL)
+        counters = self.notify_counters
+
+        if self.networks.is_database and networks is self.networks:
+            # let the database evaluate the filters instead of loading every record
+            visible = set(self.select_networks(self.filter_query()))
+            check_filter = lambda mac: mac in visible
+        else:
+            check_filter = lambda mac: self.check_filter(mac, self.networks[mac])
 
         for mac in networks:
-            network = self.networks[mac]
-            if self.check_filter(mac, network):
+            if check_filter(mac):
+                changed = changes.get(mac, CHANGE_ALL)
                 for target in targets:
                     show = targets[target]
-                    if show == "all" or (show == "current" and mac in self.recent_networks):
-                        if mac not in self.notify_add_queue:
-                            self.notify_add_queue[mac] = {}
-                        self.notify_add_queue[mac][target] = True
+                    if show == "all" or (show == "current" and mac in self.session) or \
+                            (show == "recent" and self.networks[mac].lasttime >= recent_min):
+                        macs = target_macs[target]
+                        if mac in macs:
+                            changed_fields = changed & target_fields[target]
+                            if changed_fields == 0:
+                                counters["suppressed"] += 1
+                                continue
+                        else:
+                            macs.add(mac)
+                            changed_fields = CHANGE_ALL
+                        try:
+                            queued = self.notify_add_queue[mac]
+                        except KeyError:
+                            queued = self.notify_add_queue[mac] = {}
+                            if mac in self.session:
+                                self.notify_add_order.appendleft((mac, time.monotonic()))
+                            else:
+                                self.notify_add_order.append((mac, time.monotonic()))
+                        queued[target] = queued.get(target, 0) | changed_fields
+                        counters["queued"] += 1
                     else:
+                        target_macs[target].discard(mac)
                         self.notify_remove_list[target](mac)
             else:
-                for target in self.notify_remove_list:
-                    self.notify_remove_list[target](mac)
+                self.notify_remove(mac)
+
+    def get_limited_networks(self, targets, shown, recent_min):
+        """Networks which are visible or have to be removed if no target shows all networks
+        """
+        macs = set()
+        for target_macs in shown.values():
+            macs.update(target_macs)
+        modes = set(targets.values())
+        if "current" in modes:
+            macs.update(self.session)
+        if "recent" in modes:
+            macs.update(self.index.lasttimes.range(recent_min))
+        return macs
+
+    def expire_recent(self):
+        """Remove the networks which were not seen in the last minutes from the
+        targets which only show recent networks, called periodically
+        """
+        recent_min = time.time() - self.config["filter_recent"]["minutes"] * 60
+        targets = self.get_filter_targets()
+        for target in targets:
+            if targets[target] != "recent" or target not in self.notify_targets:
+                continue
+            macs = self.notify_targets[target]
+            expired = [mac for mac in macs if self.networks[mac].lasttime < recent_min]
+            for mac in expired:
+                macs.discard(mac)
+                queued = self.notify_add_queue.get(mac)
+                if queued is not None:
+                    queued.pop(target, None)
+                self.notify_remove_list[target](mac)
+            if len(expired) > 0:
+                self.logger.debug("%s networks expired from %s" % (len(expired), target))
+        return True
 
-    def notify_add(self, mac):
-        if mac not in self.recent_networks:
-            self.recent_networks.append(mac)
+    def notify_remove(self, mac):
+        for target in self.notify_remove_list:
+            if target in self.notify_targets:
+                self.notify_targets[target].discard(mac)
+            self.notify_remove_list[target](mac)
 
-        self.apply_filters_on_networks((mac,))
+    def notify_add(self, mac, server_id=None):
+        self.session.add(mac, server_id)
+        self.notify_add_batch((mac,))
+
+    def notify_add_batch(self, macs, changes=None):
+        """The networks were added or changed, the session has to be updated before
+
+        changes: mac -> CHANGE_* flags, all fields are assumed to be changed without it
+        """
+        self.changed_networks.update(macs)
+        if self.loading:
+            self.load_updated_networks.update(macs)
+        for mac in macs:
+            self.index_network(mac)
+
+        self.apply_filters_on_networks(macs, changes)
 
     def disable_refresh(self):
         if self.refresh_disabled is True:
@@ -206,26 +795,37 @@ class Networks:
             hook()
 
     def notify_add_queue_process(self):
+        """Generator for GLib.idle_add, every step processes the queue until
+        the time budget of the scheduler is used up
+        """
         self.queue_running = True
+        scheduler = self.notify_scheduler
         start_time = time.time()
+        log_time = start_time
         counter = 0
 
-        while self.queue_running:
-            for mac in list(self.notify_add_queue.keys()):
-                for target in self.notify_add_queue[mac]:
-                    self.notify_add_list[target](mac)
-
-                del self.notify_add_queue[mac]
-
-                counter += 1
-                if time.time() - start_time > 0.9:
-                    self.logger.info("%s networks added in %.1fsec, %s networks left" % (
-                        counter, round(time.time() - start_time, 3), len(self.notify_add_queue)))
-                    yield True
-                    start_time = time.time()
-                    counter = 0
-            if len(self.notify_add_queue) == 0:
-                break
+        while self.queue_running and len(self.notify_add_order) > 0:
+            deadline = scheduler.start_slice()
+            while self.queue_running and len(self.notify_add_order) > 0:
+                count = scheduler.batch_size(deadline)
+                if count == 0:
+                    break
+                batch_start = time.monotonic()
+                processed = self.notify_add_queue_run(count)
+                scheduler.measure(processed, time.monotonic() - batch_start)
+                counter += processed
+
+            if time.time() - log_time > 1:
+                log_time = time.time()
+                self.logger.info("%s networks added in %.1fsec, %s networks left" % (
+                    counter, log_time - start_time, len(self.notify_add_queue)))
+            if len(self.notify_add_order) > 0:
+                yield True
+
+        if counter > 0:
+            latency = scheduler.latency_percentiles()
+            self.logger.debug("%s networks added in %.1fsec, latency p50 %.3fsec, p90 %.3fsec, p99 %.3fsec" % (
+                counter, time.time() - start_time, latency[50], latency[90], latency[99]))
 
         self.queue_running = False
         self.queue_task = None
@@ -236,6 +836,66 @@ class Networks:
 
         yield False
 
+    def notify_add_queue_run(self, count):
+        """Process count networks from the queue, returns the number of processed networks
+        """
+        processed = 0
+        order = self.notify_add_order
+        queue = self.notify_add_queue
+        batch_list = self.notify_add_batch_list
+        batches = {}
+        latencies = self.notify_scheduler.latencies
+        now = time.monotonic()
+        items = []
+        while len(items) < count and len(order) > 0:
+            mac, queued = order.popleft()
+            try:
+                items.append((mac, queued, queue.pop(mac)))
+            except KeyError:
+                # removed or already processed
+                continue
+        if self.observations is not None:
+            self.update_locations([item[0] for item in items])
+
+        for mac, queued, targets in items:
+            network = None
+            for target in targets:
+                if target in batch_list:
+                    if network is None:
+                        network = self.networks[mac]
+                    try:
+                        macs, networks, changes = batches[target]
+                    except KeyError:
+                        macs, networks, changes = batches[target] = ([], [], [])
+                    macs.append(mac)
+                    networks.append(network)
+                    changes.append(targets[target])
+                elif target in self.notify_add_fields:
+                    self.notify_add_list[target](mac, targets[target])
+                else:
+                    self.notify_add_list[target](mac)
+            latencies.append(now - queued)
+            processed += 1
+        for target in batches:
+            batch_list[target](*batches[target])
+        return processed
+
+    def unqueue_networks(self, macs):
+        """Remove the networks from the queue and its order, a network
+        queued again later gets a new queue time
+        """
+        unqueued = set(mac for mac in macs if self.notify_add_queue.pop(mac, None) is not None)
+        if len(unqueued) == 0:
+            return
+        order = [item for item in self.notify_add_order if item[0] not in unqueued]
+        self.notify_add_order.clear()
+        self.notify_add_order.extend(order)
+
+    def queue_is_large(self):
+        """The queue would block the list and the map for more than a second
+        """
+        return self.notify_scheduler.drain_time(len(self.notify_add_queue)) > 1
+
     def start_queue(self):
         if self.queue_task is not None or self.block_queue_start:
             return
@@ -243,564 +903,311 @@ class Networks:
         self.queue_task = GLib.idle_add(task.__next__)
 
     def stop_queue(self):
+        """Drop the queue, the targets can miss networks until the next
+        apply_filters_on_networks() on all networks
+        """
         self.queue_running = False
         if self.queue_task is not None:
             GLib.source_remove(self.queue_task)
             self.queue_task = None
         self.notify_add_queue = {}
+        self.notify_add_order.clear()
 
     def add_device_data(self, device, server_id):
-        mac = device['kismet.device.base.macaddr']
-        # print(mac)
-        new_channel = device['kismet.device.base.channel']
-        if new_channel.isdigit():
-            new_channel = int(new_channel)
+        mac, record = parse_device(device, self.logger)
+        changed = self.merge_device(mac, record, self.config['servers'][server_id]['uri'])
+        if self.session.add(mac, server_id) or changed:
+            self.notify_add_batch((mac,), {mac: changed})
         else:
-            new_channel = 0
+            self.notify_counters["unchanged"] += 1
 
-        if 'dot11.device.advertised_ssid_map' in device['dot11.device']:
-            ssid_map = device['dot11.device']['dot11.device.advertised_ssid_map']
-            if len(ssid_map) > 1:
-                self.logger.error("todo: multiple SSIDs per device %s" % mac)
-        else:
-            ssid_map = []
-
-        new_cryptset = 0
-        new_ssid = ''
-        if len(ssid_map) > 0:
-            for ssid_entry in ssid_map:
-                new_ssid = ssid_entry['dot11.advertisedssid.ssid']
-                new_cryptset = ssid_entry['dot11.advertisedssid.crypt_set']
-                break
+    def add_devices(self, devices, server_id):
+        """Merge a poll of kismet devices, the filters and notifications
+        run once for the whole batch
 
-        if new_ssid == '' and 'dot11.device.last_beaconed_ssid' in device['dot11.device']:
-            new_ssid = device['dot11.device']['dot11.device.last_beaconed_ssid']
-
-        try:
-            location = device['kismet.device.base.location']
-        except KeyError:
-            location = None
-        if location and location['kismet.common.location.loc_fix'] >= 2:
-            new_lat = location['kismet.common.location.avg_loc']['kismet.common.location.geopoint'][1]
-            new_lon = location['kismet.common.location.avg_loc']['kismet.common.location.geopoint'][0]
-            gps_fix = True
-        else:
-            new_lat = 0
-            new_lon = 0
-            gps_fix = False
-
-        if device['kismet.common.signal.type'] == 'dbm':
-            signal_dbm_min = device['kismet.common.signal.min_signal']
-            signal_dbm_max = device['kismet.common.signal.max_signal']
-            signal_dbm_last = device['kismet.common.signal.last_signal']
-        else:
-            signal_dbm_min = 0
-            signal_dbm_max = 0
-            signal_dbm_last = 0
+        Returns the number of new, updated and unchanged networks.
+        """
+        counters = {"new": 0, "updated": 0, "unchanged": 0}
+        server_uri = self.config['servers'][server_id]['uri']
+        changes = {}
+        for device in devices:
+            if 'dot11.device' not in device or device['dot11.device'] == 0:  # skip non-802.11 devices
+                continue
+            mac, record = parse_device(device, self.logger)
+            changed = self.merge_device(mac, record, server_uri)
+            if changed & CHANGE_NEW:
+                counters["new"] += 1
+            elif changed:
+                counters["updated"] += 1
+            else:
+                counters["unchanged"] += 1
+            if self.session.add(mac, server_id) or changed:
+                changes[mac] = changes.get(mac, 0) | changed
+            else:
+                self.notify_counters["unchanged"] += 1
+        self.notify_add_batch(changes, changes)
+        return counters
 
-        if mac not in self.networks:
-            network = {
-                "type": decode_network_typeset(device['dot11.device']['dot11.device.typeset']),
-                "channel": new_channel,
-                "firsttime": device['kismet.device.base.first_time'],
-                "lasttime": device['kismet.device.base.last_time'],
-                "lat": new_lat,
-                "lon": new_lon,
-                "manuf": device['kismet.device.base.manuf'],
-                "ssid": new_ssid,
-                "cryptset": new_cryptset,
-                "crypt": device['kismet.device.base.crypt'],
-                "signal_dbm": {
-                    "min": signal_dbm_min,
-                    "max": signal_dbm_max,
-                    "last": signal_dbm_last,
-                },
-                "comment": '',
-                "servers": [],
-                "codename": '',                
-            }
-            self.networks[mac] = network
+    def merge_device(self, mac, record, server_uri):
+        """Merge a record from parse_device() into the networks,
+        returns the CHANGE_* flags of the changed fields
+        """
+        network = self.networks.get(mac)
+        if network is None:
+            record.add_server(server_uri)
+            self.networks[mac] = record
+            if self.observations is not None and (record.lat != 0 or record.lon != 0):
+                self.observations.add(mac, record.lat, record.lon, record.signal_last or None, record.lasttime)
+            return CHANGE_ALL
+
+        signal_min, signal_max, signal_last = network.signal_min, network.signal_max, network.signal_last
+        if not network.has_signal() or signal_max == 0:
+            signal_min, signal_max, signal_last = record.signal_min, record.signal_max, record.signal_last
+
+        lat, lon = network.lat, network.lon
+        observed = False
+        if record.lasttime > network.lasttime:
+            if record.lat == 0 and record.lon == 0:
+                pass
+            elif self.observations is not None:
+                if mac not in self.observations and (lat != 0 or lon != 0):
+                    # a network from an earlier session, its stored position counts with its strongest signal
+                    self.observations.add(mac, lat, lon, network.signal_max or None, network.lasttime)
+                # the estimate is updated when the network is displayed or exported
+                kept = self.observations.add(mac, record.lat, record.lon, record.signal_last or None, record.lasttime)
+                if lat == 0 and lon == 0:
+                    lat, lon = record.lat, record.lon
+                else:
+                    observed = kept
+            elif (signal_max < record.signal_max and record.signal_max != 0) or (lat == 0 and lon == 0):
+                lat, lon = record.lat, record.lon
+            newer = record
+            signal_last = record.signal_last
         else:
-            network = self.networks[mac]
-            if "signal_dbm" not in network or network["signal_dbm"]['max'] == 0:
-                network["signal_dbm"] = {
-                    "min": signal_dbm_min,
-                    "max": signal_dbm_max,
-                    "last": signal_dbm_last,
-                }
-            if 'comment' not in network:
-                network['comment'] = ''
-            if 'codename' not in network:
-                network['codename'] = ''                
-
-            if device['kismet.device.base.last_time'] > network["lasttime"]:
-                if gps_fix and ((network["signal_dbm"]["max"] < signal_dbm_max and signal_dbm_max != 0) or
-                                (network["lat"] == 0 and network["lon"] == 0)):
-                    network["lat"] = new_lat
-                    network["lon"] = new_lon
-
-                network["channel"] = new_channel
-                network["lasttime"] = device['kismet.device.base.last_time']
-                network["cryptset"] = new_cryptset
-                network["crypt"] = device['kismet.device.base.crypt']
-                network["signal_dbm"]["last"] = signal_dbm_last
-                network["ssid"] = new_ssid
-
-            network["firsttime"] = min(network["firsttime"], device['kismet.device.base.first_time'])
-            network["signal_dbm"]["min"] = min(network["signal_dbm"]["min"], signal_dbm_min)
-            network["signal_dbm"]["max"] = min(network["signal_dbm"]["max"], signal_dbm_max)
-            network["type"] = decode_network_typeset(device['dot11.device']['dot11.device.typeset'])
-
-            server_uri = self.config['servers'][server_id]['uri']
-            if server_uri not in network['servers']:
-                network['servers'].append(server_uri)
+            newer = network
+
+        old = (network.type, network.channel, network.firsttime, network.lasttime, network.lat, network.lon,
+               network.ssid, network.cryptset, network.crypt,
+               network.signal_min, network.signal_max, network.signal_last)
+        new = (record.type, newer.channel, min(network.firsttime, record.firsttime), newer.lasttime, lat, lon,
+               newer.ssid, newer.cryptset, newer.crypt,
+               min(signal_min, record.signal_min),
+               signal_max if record.signal_max == 0 else max(signal_max, record.signal_max), signal_last)
+        changed = 0 if server_uri in network.servers else CHANGE_SERVERS
+        if observed:
+            changed |= CHANGE_POSITION
+        if old != new:
+            for num, change in enumerate(merge_changes):
+                if old[num] != new[num]:
+                    changed |= change
+        if changed == 0:
+            return 0
 
-        self.notify_add(mac)
+        self.prepare_change(mac)
+        network = self.networks[mac]
+        (network.type, network.channel, network.firsttime, network.lasttime, network.lat, network.lon,
+         network.ssid, network.cryptset, network.crypt,
+         network.signal_min, network.signal_max, network.signal_last) = new
+        network.add_server(server_uri)
+        return changed
 
     def add_network_data(self, mac, data):
+        """Merge an imported network into the networks
+
+        The signal values are merged if the network and the data have them:
+        min and max are widened, last is taken from newer data and a
+        stronger max signal moves the network to the position of the data.
+        Data with signal values replaces a network without any. Every merge
+        notifies the subscribers with all fields changed.
+        """
         if len(mac) != 17 or mac == "00:00:00:00:00:00":
             return
 
         if mac not in self.networks:
-            if 'comment' not in data:
-                data['comment'] = ""
-            if 'codename' not in data:
-                data['codename'] = ""               
-            if 'servers' not in data:
-                data['servers'] = []
             self.networks[mac] = data
             self.notify_add(mac)
             return
 
+        self.prepare_change(mac)
         network = self.networks[mac]
-        signal = False
-        data_signal = False
+        signal = network.has_signal()
+        data_signal = len(data.get("signal_dbm") or {}) == 3  # min, max and last
 
-        if data["lasttime"] > network["lasttime"]:
+        if data["lasttime"] > network.lasttime:
             newer = True
-            network["channel"] = data["channel"]
-            network["lasttime"] = data["lasttime"]
-            network["cryptset"] = data["cryptset"]
+            network.channel = data["channel"]
+            network.lasttime = data["lasttime"]
+            network.cryptset = data["cryptset"]
             if signal and data_signal:
-                network["signal_dbm"]["last"] = data["signal_dbm"]["last"]
+                network.signal_last = data["signal_dbm"]["last"]
         else:
             newer = False
-        if (network["lat"] == 0.0 and network["lon"] == 0.0) or \
-                (((signal and data_signal and network["signal_dbm"]["max"] < data["signal_dbm"]["max"]) or
+        if (network.lat == 0.0 and network.lon == 0.0) or \
+                (((signal and data_signal and network.signal_max < data["signal_dbm"]["max"]) or
                   (not signal and data_signal)) and data["lat"] != 0.0 and data["lon"] != 0.0):
-            network["lat"] = data["lat"]
-            network["lon"] = data["lon"]
-        if newer or network["ssid"] == "":
-            network["ssid"] = data["ssid"]
+            network.lat = data["lat"]
+            network.lon = data["lon"]
+        if newer or network.ssid == "":
+            network.ssid = data["ssid"]
 
-        if network["manuf"] == "":
-            network["manuf"] = data["manuf"]
+        if network.manuf == "":
+            network['manuf'] = data["manuf"]
 
-        network["firsttime"] = min(network["firsttime"], data["firsttime"])
+        network.firsttime = min(network.firsttime, data["firsttime"])
         if signal and data_signal:
-            network["signal_dbm"]["min"] = min(network["signal_dbm"]["min"], data["signal_dbm"]["min"])
-            network["signal_dbm"]["max"] = min(network["signal_dbm"]["max"], data["signal_dbm"]["max"])
+            network.signal_min = min(network.signal_min, data["signal_dbm"]["min"])
+            network.signal_max = max(network.signal_max, data["signal_dbm"]["max"])
         elif data_signal:
             network["signal_dbm"] = data["signal_dbm"]
 
         self.notify_add(mac)
 
     def import_networks(self, filetype, filename):
-        if filetype == "networks":
-            parser = Networks(None, logger=self.logger)
-            parser.parse = parser.load
-        if filetype == "netxml":
-            parser = Netxml(logger=self.logger)
-        elif filetype == "csv":
-            parser = CSV()
-        else:
-            self.logger.error("unknown filetype")
+        """Import a file in the main loop, returns the number of networks in the file
+        """
+        if filetype not in FILETYPES:
+            self.logger.error("unknown filetype %s" % filetype)
             return 0
 
-        parser.parse(filename)
-
-        for mac in parser.networks:
-            self.add_network_data(mac, parser.networks[mac])
+        count = 0
+        for batch in iter_file(filetype, filename):
+            for row in batch:
+                mac, network = row_record(row)
+                self.add_network_data(mac, network)
+            count += len(batch)
+        return count
+
+    def import_files(self, files, workers=None):
+        """ImportPipeline for a list of (filename, filetype), the files are
+        parsed in worker processes and merged with import_step()
+        """
+        if workers is None:
+            workers = self.config["import"]["workers"] or None
+        pipeline = ImportPipeline(files, self.import_merge, workers=workers)
+        pipeline.start()
+        return pipeline
 
-        return len(parser.networks)
+    def import_merge(self, mac, network):
+        new = mac not in self.networks
+        self.add_network_data(mac, network)
+        return new and mac in self.networks
 
     def export_networks(self, export_format, filename, networks=None, tracks=None, filtered=False):
-        if networks is None:
-            networks = self.networks
+        """Export the networks and wait until the file is written
+        """
+        job = self.create_export_job(export_format, filename, networks, tracks, filtered)
+        try:
+            job.run()
+        finally:
+            self.release_snapshot(job.snapshot)
+        if job.error is not None:
+            raise job.error
+
+    def start_export(self, export_format, filename, networks=None, tracks=None, filtered=False, done=None):
+        """Export the networks in the background, returns the ExportJob
+
+        The job writes a snapshot of the networks in a worker thread, with the
+        database store in the main loop because the database is only read by
+        the main thread. done(job) is called in the main loop afterwards.
+        """
+        job = self.create_export_job(export_format, filename, networks, tracks, filtered)
+        self.export_jobs.append(job)
+        if self.networks.is_database:
+            GLib.idle_add(self.export_step, job, done)
+        else:
+            thread = threading.Thread(target=self.export_worker, args=(job, done))
+            thread.daemon = True
+            thread.start()
+        return job
+
+    def create_export_job(self, export_format, filename, networks, tracks, filtered):
+        moved = self.update_locations(networks)
+        if len(moved) > 0:
+            # the map and the list show the old positions otherwise
+            self.notify_add_batch(moved, dict.fromkeys(moved, CHANGE_POSITION))
+
         if export_format == "kismon":
-            self.save_networks(filename, networks)
+            writer = iter_json
         elif export_format == "kismet netxml":
-            self.export_networks_netxml(filename, networks)
+            writer = iter_netxml
         elif export_format == "google earth kmz":
-            self.export_networks_kmz(filename, networks, tracks, filtered)
+            tracks_kml = None
+            if tracks is not None:
+                if filtered:
+                    track_filter = self.config['filter_networks']['export']
+                else:
+                    track_filter = False
+                tracks_kml = tracks.iter_kml(track_filter)
+            compresslevel = self.config["export"]["compression_level"]
+
+            def writer(filename, snapshot):
+                return iter_kmz(filename, snapshot, tracks_kml, compresslevel)
+            networks = self.select_networks(NetworkQuery(has_position=True), networks)
         elif export_format == "mappoint csv":
-            self.export_networks_mappoint(filename, networks)
-
-    def export_networks_netxml(self, filename, networks):
-        locale.setlocale(locale.LC_TIME, 'C')
-        f = open(filename, "w")
-        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n')
-        f.write('<!DOCTYPE detection-run SYSTEM "http://kismetwireless.net/kismet-3.1.0.dtd">\n')
-        f.write('<detection-run kismet-version="2009.06.R1" start-time="Sat Oct 24 09:05:35 2009">\n\n')
-
-        num = 0
-        for mac in networks:
-            network = self.networks[mac]
-            firsttime = timestamp2timestring(network["firsttime"])
-            lasttime = timestamp2timestring(network["lasttime"])
-            ssid = network["ssid"].replace("<", "&lt;").replace(">", "&gt;").replace("&", "&amp;")
-            manuf = "Unknown" if network["manuf"] == "" else network["manuf"].replace("&", "&amp;")
-            f.write('<wireless-network number="%s" type="%s" first-time="%s" last-time="%s">\n' % \
-                    (num, network["type"], firsttime, lasttime)
-                    )
-            f.write(' <SSID first-time="%s" last-time="%s">\n' % (firsttime, lasttime))
-
-            crypts = decode_cryptset(network["cryptset"])
-            if network["cryptset"] == 0:
-                f.write('  <encryption>None</encryption>\n')
-            if crypts == ["wep"]:
-                f.write('  <encryption>WEP</encryption>\n')
-            if "layer3" in crypts:
-                f.write('  <encryption>Layer3</encryption>\n')
-            if "wpa_migmode" in crypts:
-                f.write('  <encryption>WPA Migration Mode</encryption>\n')
-            if "wep40" in crypts:
-                f.write('  <encryption>WEP40</encryption>\n')
-            if "wep104" in crypts:
-                f.write('  <encryption>WEP104</encryption>\n')
-            if "tkip" in crypts:
-                f.write('  <encryption>WPA+TKIP</encryption>\n')
-            if "psk" in crypts:
-                f.write('  <encryption>WPA+PSK</encryption>\n')
-            if "aes_ocb" in crypts:
-                f.write('  <encryption>WPA+AES-OCB</encryption>\n')
-            if "aes_ccm" in crypts:
-                f.write('  <encryption>WPA+AES-CCM</encryption>\n')
-            if "leap" in crypts:
-                f.write('  <encryption>WPA+LEAP</encryption>\n')
-            if "ttls" in crypts:
-                f.write('  <encryption>WPA+TTLS</encryption>\n')
-            if "tls" in crypts:
-                f.write('  <encryption>WPA+TLS</encryption>\n')
-            if "peap" in crypts:
-                f.write('  <encryption>WPA+PEAP</encryption>\n')
-            if "isakmp" in crypts:
-                f.write('  <encryption>ISAKMP</encryption>\n')
-            if "pptp" in crypts:
-                f.write('  <encryption>PPTP</encryption>\n')
-            if "tls" in crypts:
-                f.write('  <encryption>Fortress</encryption>\n')
-            if "fortress" in crypts:
-                f.write('  <encryption>Keyguard</encryption>\n')
-
-            f.write('  <essid cloaked="%s">%s</essid>\n' % (True if ssid == "" else False, ssid))
-
-            f.write(' </SSID>\n')
-            f.write(' <BSSID>%s</BSSID>\n' % mac)
-            f.write(' <manuf>%s</manuf>\n' % manuf)
-            f.write(' <channel>%s</channel>\n' % network["channel"])
-            if "signal_dbm" in network:
-                f.write(' <snr-info>\n')
-                f.write('  <last_signal_dbm>%s</last_signal_dbm>\n' % network["signal_dbm"]["last"])
-                f.write('  <min_signal_dbm>%s</min_signal_dbm>\n' % network["signal_dbm"]["min"])
-                f.write('  <max_signal_dbm>%s</max_signal_dbm>\n' % network["signal_dbm"]["max"])
-                f.write(' </snr-info>\n')
-            if network["lat"] != 0 and network["lon"] != 0:
-                f.write(' <gps-info>\n')
-                f.write('  <min-lat>%s</min-lat>\n' % network["lat"])
-                f.write('  <min-lon>%s</min-lon>\n' % network["lon"])
-                f.write('  <max-lat>%s</max-lat>\n' % network["lat"])
-                f.write('  <max-lon>%s</max-lon>\n' % network["lon"])
-                f.write('  <peak-lat>%s</peak-lat>\n' % network["lat"])
-                f.write('  <peak-lon>%s</peak-lon>\n' % network["lon"])
-                f.write('  <avg-lat>%s</avg-lat>\n' % network["lat"])
-                f.write('  <avg-lon>%s</avg-lon>\n' % network["lon"])
-                f.write(' </gps-info>\n')
-            f.write('</wireless-network>\n')
-            num += 1
-
-        f.write('</detection-run>')
-        f.close()
-        locale.setlocale(locale.LC_TIME, '')
-
-    def export_networks_kmz(self, filename, networks, tracks, filtered):
-        kml_folder = """
-<Folder>
-<name>%s: %s APs</name>
-<Style id="%s"><IconStyle><scale>0.5</scale>
-<Icon>
-<href>http://files.salecker.org/kismon/images/%s.gif</href>
-</Icon></IconStyle></Style>
-%s
-</Folder>"""
-        data = []
-        zip_output = zipfile.ZipFile(filename, "w")
-        data.append("<?xml version='1.0' encoding='UTF-8'?>\r\n")
-        data.append("<kml xmlns='http://earth.google.com/kml/2.1'>\r\n")
-        data.append("<Document>\r\n")
-        data.append("<name>Kismon</name>\r\n")
-        data.append("<open>1</open>")
-
-        count = {"WPA2": 0, "WPA": 0, "WEP": 0, "None": 0, "Other": 0}
-        folders = self.export_networks_kmz_folders(count, networks)
-
-        for crypt in ("WPA2", "WPA", "WEP", "None", "Other"):
-            if crypt == "WPA2":
-                pic = "WPA"
-            elif crypt == "WPA":
-                pic = "WPA"
-            elif crypt == "WEP":
-                pic = "WEP"
-            else:
-                pic = "Open"
-
-            data.append(kml_folder % (
-                crypt,
-                count[crypt],
-                crypt,
-                pic,
-                "".join(folders[crypt])
-            ))
-
-        if tracks is not None:
-            if filtered:
-                track_filter = self.config['filter_networks']['export']
-            else:
-                track_filter = False
-            data.append(tracks.export_kml(track_filter))
-
-        data.append("\r\n</Document>\r\n</kml>")
-
-        zinfo = zipfile.ZipInfo("kismon.kml")
-        zinfo.compress_type = zipfile.ZIP_DEFLATED
-        zip_output.writestr(zinfo, "".join(data))
-        zip_output.close()
-
-    def export_networks_kmz_folders(self, count, networks):
-        kml_placemark = """<Placemark><styleUrl>#%s</styleUrl><name>%s</name>
-<Point><coordinates>%s,%s</coordinates></Point>
-<description><![CDATA[
-SSID: %s<br />
-MAC: %s<br />
-Manuf: %s<br />
-Type: %s<br />
-Channel: %s<br />
-Encryption: <FONT color=%s>%s</FONT><br />
-Last time: %s<br />
-GPS: %s,%s]]></description></Placemark>"""
-
-        folders = {"WPA2": [], "WPA": [], "WEP": [], "None": [], "Other": []}
-        colors = {"WPA2": "red", "WPA": "orange", "WEP": "yellow", "None": "green", "Other": "grey"}
-        for mac in networks:
-            network = self.networks[mac]
-            if network["lat"] == 0 and network["lon"] == 0:
-                continue
-
-            ssid = network["ssid"].replace("<", "&lt;").replace(">", "&gt;").replace("&", "&amp;")
-
-            crypts = decode_cryptset(network["cryptset"])
-
-            crypt = "Other"
-            if "aes_ccm" in crypts or "aes_ocb" in crypts:
-                crypt = "WPA2"
-            elif "wpa" in crypts:
-                crypt = "WPA"
-            elif "wep" in crypts:
-                crypt = "WEP"
-            elif "none" in crypts:
-                crypt = "None"
-
-            folders[crypt].append(kml_placemark % (
-                crypt, ssid, network["lon"], network["lat"], ssid, mac,
-                network["manuf"], network["type"], network["channel"],
-                colors[crypt], ",".join(crypts).upper(), utils.format_timestamp(network["lasttime"]),
-                network["lon"], network["lat"],
-            ))
-            count[crypt] += 1
-        return folders
-
-    def export_networks_mappoint(self, filename, networks):
-        f = open(filename, "w")
-
-        f.write('Latitude;Longitude;SSID;BSSID;Encryption;Channel;Last Seen;\n')
-        for mac in networks:
-            network = self.networks[mac]
-            if network["lat"] == 0 and network["lon"] == 0:
-                continue
-            gps = "%s;%s" % (network["lat"], network["lon"])
-            f.write('%s;"%s";%s;%s;%s;%s;\n' % (
-                gps.replace(".", ","), network["ssid"].replace(";", " ").replace('"', " "),
-                mac, print_cryptset(network["cryptset"]), network["channel"],
-                utils.format_timestamp(network["lasttime"])
-            ))
-        f.close()
-
-
-def print_cryptset(cryptset):
-    crypts = decode_cryptset(cryptset)
-    crypt = "Other"
-
-    if "aes_ccm" in crypts:
-        crypt = "WPA2"
-    elif "wpa" in crypts:
-        crypt = "WPA"
-    elif "wep" in crypts:
-        crypt = "WEP"
-    elif "none" in crypts:
-        crypt = "None"
-
-    return crypt
+            writer = iter_csv
+            networks = self.select_networks(NetworkQuery(has_position=True), networks)
+        else:
+            raise ValueError("unknown export format %s" % export_format)
 
+        snapshot = self.take_snapshot(networks)
+        return ExportJob(export_format, filename, snapshot, writer(filename, snapshot))
 
-class Netxml:
-    def __init__(self, logger):
-        self.networks = {}
-        self.logger = logger
+    def export_worker(self, job, done):
+        job.run()
+        GLib.idle_add(self.export_done, job, done)
 
-    def parse(self, filename):
-        self.parser = {
-            "laststart": "",
-            "parents": [],
-            "network": None,
-            "encryption": {}
-        }
-        locale.setlocale(locale.LC_TIME, 'C')
-
-        p = xml.parsers.expat.ParserCreate()
-        p.buffer_text = True  # avoid chunked data
-        p.StartElementHandler = self.parse_start_element
-        p.EndElementHandler = self.parse_end_element
-        p.CharacterDataHandler = self.parse_char_data
-        if os.path.isfile(filename):
-            f = open(filename, 'rb')
-            p.ParseFile(f)
-            f.close()
+    def export_step(self, job, done):
+        if job.step():
+            return True
+        self.export_done(job, done)
+        return False
+
+    def export_done(self, job, done):
+        self.release_snapshot(job.snapshot)
+        self.export_jobs.remove(job)
+        if job.error is not None:
+            self.logger.error("export to %s failed: %s" % (job.filename, job.error))
         else:
-            self.logger.error("Parser: filename is not a file (%s)" % filename)
-
-        locale.setlocale(locale.LC_TIME, '')
-
-    def parse_start_element(self, name, attrs):
-        """<name attr="">
-        """
-        if name == "wireless-network":
-            self.parser["network"] = {
-                "type": attrs["type"],
-                "firsttime": timestring2timestamp(attrs["first-time"]),
-                "lasttime": timestring2timestamp(attrs["last-time"]),
-                "ssid": "",
-                "cryptset": 0,
-                "crypt": "",
-                "lat": 0.0,
-                "lon": 0.0,
-                "signal_dbm": {}
-            }
-        elif name == "SSID":
-            self.parser["encryption"] = {}
-
-        self.parser["parents"].insert(0, self.parser["laststart"])
-        self.parser["laststart"] = name
-
-    def parse_end_element(self, name):
-        """</name>
-        """
-        if name == "wireless-network":
-            mac = self.parser["network"]["mac"]
-            del self.parser["network"]["mac"]
-            self.networks[mac] = self.parser["network"]
-        elif name == "SSID":
-            if len(self.parser["encryption"]) > 0:
-                if self.parser["parents"][0] == "wireless-network":
-                    crypts = []
-                    for crypt in self.parser["encryption"]:
-                        if crypt.startswith("WPA"):
-                            if "wpa" not in crypts:
-                                crypts.append("wpa")
-                            if crypt.startswith("WPA+"):
-                                crypts.append(crypt.split("+")[1].lower().replace("-", "_"))
-                        else:
-                            crypts.append(crypt.lower().replace("-", "_"))
-                    cryptset = encode_cryptset(crypts)
-                    self.parser["network"]["crypt"] = ",".join(crypts)
-                    self.parser["network"]["cryptset"] = cryptset
-            del self.parser["encryption"]
-
-        self.parser["laststart"] = self.parser["parents"].pop(0)
+            self.logger.info("export to %s %s, %s networks in %.1fsec" % (
+                job.filename, job.state, job.done, job.duration))
+        if done is not None:
+            done(job)
+        return False
+
+    def cancel_exports(self):
+        """Cancel the running exports and wait until their files are removed
+        """
+        for job in list(self.export_jobs):
+            job.cancel()
+            if self.networks.is_database:
+                job.step()
+            else:
+                job.finished.wait(10)
 
-    def parse_char_data(self, data):
-        """<self.parser["laststart"]>data</self.parser["laststart"]>
+    def take_snapshot(self, networks=None):
+        """Snapshot of the networks for an export, the records in it stay
+        unchanged until release_snapshot()
         """
-        if data.strip() == "":
-            return
+        snapshot = StoreSnapshot(self.networks, None if networks is None or networks is self.networks else networks)
+        self.export_snapshots.append(snapshot)
+        return snapshot
 
-        if self.parser["parents"][0] == "SSID":
-            if self.parser["laststart"] == "encryption":
-                self.parser["encryption"][data] = True
-            elif self.parser["laststart"] == "essid":
-                self.parser["network"]["ssid"] = data
-        elif self.parser["parents"][1] == "wireless-network":
-            if self.parser["parents"][0] == "gps-info":
-                if self.parser["laststart"] == "peak-lat":
-                    self.parser["network"]["lat"] = float(data)
-                elif self.parser["laststart"] == "peak-lon":
-                    self.parser["network"]["lon"] = float(data)
-            elif self.parser["parents"][0] == "snr-info":
-                if self.parser["laststart"] == "min_signal_dbm":
-                    self.parser["network"]["signal_dbm"]["min"] = int(data)
-                elif self.parser["laststart"] == "max_signal_dbm":
-                    self.parser["network"]["signal_dbm"]["max"] = int(data)
-                elif self.parser["laststart"] == "last_signal_dbm":
-                    self.parser["network"]["signal_dbm"]["last"] = int(data)
-        elif self.parser["parents"][0] == "wireless-network":
-            if self.parser["laststart"] == "BSSID":
-                self.parser["network"]["mac"] = data
-            elif self.parser["laststart"] == "channel":
-                self.parser["network"]["channel"] = int(data)
-            elif self.parser["laststart"] == "manuf":
-                self.parser["network"]["manuf"] = data
-
-
-class CSV:
-    def __init__(self):
-        self.networks = {}
-
-    def parse(self, filename):
-        locale.setlocale(locale.LC_TIME, 'C')
-        f = open(filename)
-        head = f.readline().split(";")[:-1]
-        for line in f.readlines():
-            x = 0
-            data = {}
-            for column in line.split(";")[:-1]:
-                data[head[x]] = column
-                x += 1
-
-            crypts = []
-            for crypt in data["Encryption"].split(","):
-                crypts.append(crypt.lower().replace("-", "_"))
-
-            self.networks[data["BSSID"]] = {
-                "type": data["NetType"],
-                "channel": int(data["Channel"]),
-                "firsttime": timestring2timestamp(data["FirstTime"]),
-                "lasttime": timestring2timestamp(data["LastTime"]),
-                "lat": float(data["GPSBestLat"]),
-                "lon": float(data["GPSBestLon"]),
-                "manuf": "",
-                "ssid": data["ESSID"],
-                "cryptset": encode_cryptset(crypts),
-                "crypt": ",".join(crypts)
-            }
-        locale.setlocale(locale.LC_TIME, '')
-        f.close()
+    def release_snapshot(self, snapshot):
+        self.export_snapshots.remove(snapshot)
+
+    def export_networks_netxml(self, filename, networks):
+        self.export_networks("kismet netxml", filename, networks)
 
+    def export_networks_kmz(self, filename, networks, tracks, filtered):
+        self.export_networks("google earth kmz", filename, networks, tracks, filtered)
 
-def timestring2timestamp(timestring):
-    return int(time.mktime(time.strptime(timestring)))
+    def export_networks_mappoint(self, filename, networks):
+        self.export_networks("mappoint csv", filename, networks)
 
 
-def timestamp2timestring(timestamp):
-    return time.strftime("%a %b %d %H:%M:%S %Y", time.gmtime(timestamp))
+# CHANGE_* flag of each value compared in Networks.merge_device()
+merge_changes = (CHANGE_TYPE, CHANGE_CHANNEL, CHANGE_FIRSTTIME, CHANGE_LASTTIME, CHANGE_POSITION, CHANGE_POSITION,
+                 CHANGE_SSID, CHANGE_CRYPT, CHANGE_CRYPT, CHANGE_SIGNAL, CHANGE_SIGNAL, CHANGE_SIGNAL)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Bounded reservoir of position observations per network
+#
+# Every observed network gets a row in a set of preallocated arrays which
+# holds up to capacity observations of (lat, lon, signal, time). Once a row is
+# full, a new observation replaces a random slot with the probability
+# capacity/seen (reservoir sampling), so the row stays a uniform sample of all
+# observations and the memory per network is fixed. The location is the
+# signal weighted centroid of a row, it is only computed for rows which
+# changed since their last estimate.
+#
+# numpy is optional, without it Networks keeps the position with the
+# strongest signal.
+
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NO_SIGNAL = -100.0  # dBm of observations without a signal
+
+
+def is_available():
+    return numpy is not None
+
+
+class ObservationStore:
+    def __init__(self, capacity=16, rows=1024, seed=None):
+        self.capacity = capacity
+        self.random = random.Random(seed)
+        self.rows = {}  # mac -> row
+        self.macs = []  # row -> mac
+        self.allocated = 0
+        self.lat = None
+        self.lon = None
+        self.signal = None
+        self.time = None
+        self.seen = None
+        self.changed = None
+        self.allocate(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, mac):
+        return mac in self.rows
+
+    def allocate(self, rows):
+        """Grow the arrays to rows rows, the existing rows are kept
+        """
+        shape = (rows, self.capacity)
+        arrays = {
+            "lat": numpy.zeros(shape, dtype=numpy.float64),
+            "lon": numpy.zeros(shape, dtype=numpy.float64),
+            "signal": numpy.zeros(shape, dtype=numpy.float32),
+            "time": numpy.zeros(shape, dtype=numpy.uint32),
+            "seen": numpy.zeros(rows, dtype=numpy.int64),
+            "changed": numpy.zeros(rows, dtype=bool),
+        }
+        for name, array in arrays.items():
+            old = getattr(self, name)
+            if old is not None:
+                array[:self.allocated] = old[:self.allocated]
+            setattr(self, name, array)
+        self.allocated = rows
+
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.lat, self.lon, self.signal, self.time, self.seen, self.changed))
+
+    def add(self, mac, lat, lon, signal, timestamp):
+        """Add an observation, returns True if it was kept in the reservoir
+        """
+        row = self.rows.get(mac)
+        if row is None:
+            row = len(self.macs)
+            if row == self.allocated:
+                self.allocate(self.allocated * 2)
+            self.rows[mac] = row
+            self.macs.append(mac)
+
+        seen = int(self.seen[row])
+        self.seen[row] = seen + 1
+        if seen < self.capacity:
+            slot = seen
+        else:
+            slot = self.random.randrange(seen + 1)
+            if slot >= self.capacity:
+                return False
+
+        self.lat[row, slot] = lat
+        self.lon[row, slot] = lon
+        self.signal[row, slot] = NO_SIGNAL if signal is None else signal
+        self.time[row, slot] = timestamp
+        self.changed[row] = True
+        return True
+
+    def observations(self, mac):
+        """(lat, lon, signal, time) of the observations in the reservoir
+        """
+        row = self.rows[mac]
+        size = min(int(self.seen[row]), self.capacity)
+        return list(zip(self.lat[row, :size].tolist(), self.lon[row, :size].tolist(),
+                        self.signal[row, :size].tolist(), self.time[row, :size].tolist()))
+
+    def estimate(self, macs=None):
+        """Signal weighted centroids of the changed rows, returns [(mac, lat, lon)]
+
+        The signal is converted from dBm to mW, an observation with a 10dB
+        stronger signal has 10 times the weight.
+        """
+        if macs is None:
+            rows = numpy.flatnonzero(self.changed[:len(self.macs)])
+        else:
+            rows = numpy.fromiter((self.rows.get(mac, -1) for mac in macs), dtype=numpy.int64)
+            rows = rows[rows >= 0]
+            rows = rows[self.changed[rows]]
+        if len(rows) == 0:
+            return []
+
+        sizes = numpy.minimum(self.seen[rows], self.capacity)
+        used = numpy.arange(self.capacity) < sizes[:, None]
+        signal = numpy.where(used, self.signal[rows], -numpy.inf).astype(numpy.float64)
+        # relative to the strongest signal of the row to stay in the float range
+        weights = numpy.power(10.0, (signal - signal.max(axis=1)[:, None]) / 10)
+        total = weights.sum(axis=1)
+        lat = (self.lat[rows] * weights).sum(axis=1) / total
+        lon = (self.lon[rows] * weights).sum(axis=1) / total
+        self.changed[rows] = False
+
+        macs = self.macs
+        return [(macs[row], row_lat, row_lon)
+                for row, row_lat, row_lon in zip(rows.tolist(), lat.tolist(), lon.tolist())]
+
+    def clear(self):
+        self.rows = {}
+        self.macs = []
+        self.seen[:] = 0
+        self.changed[:] = False
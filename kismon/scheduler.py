@@ -0,0 +1,91 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import collections
+import time
+
+
+class NotifyScheduler:
+    """Splits the processing of a queue into slices which fit into a time budget
+
+    The cost per item is measured and smoothed, the number of items between
+    two clock checks is derived from it. The latency between queueing and
+    processing is kept for the last items.
+    """
+
+    def __init__(self, budget=0.012, item_cost=0.002, latency_samples=10000):
+        self.budget = budget
+        # the initial estimate matches the old fixed limit of 500 items per second
+        self.item_cost = item_cost
+        self.measured = False
+        self.latencies = collections.deque(maxlen=latency_samples)
+        self.items = 0
+        self.slices = 0
+
+    def set_budget(self, milliseconds):
+        self.budget = max(1, milliseconds) / 1000
+
+    def start_slice(self):
+        self.slices += 1
+        return time.monotonic() + self.budget
+
+    def batch_size(self, deadline):
+        """Number of items which fit into the rest of the slice
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return 0
+        if not self.measured:
+            return 1
+        return max(1, int(remaining / self.item_cost))
+
+    def measure(self, items, duration):
+        if items == 0:
+            return
+        cost = max(duration / items, 1e-7)
+        if self.measured:
+            self.item_cost += (cost - self.item_cost) * 0.2
+        else:
+            self.item_cost = cost
+            self.measured = True
+        self.items += items
+
+    def drain_time(self, count):
+        """Estimated time in seconds to process count items
+        """
+        return count * self.item_cost
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """Queue latency in seconds of the last processed items
+        """
+        if len(self.latencies) == 0:
+            return {}
+        values = sorted(self.latencies)
+        return {percentile: values[min(len(values) - 1, len(values) * percentile // 100)]
+                for percentile in percentiles}
@@ -0,0 +1,210 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Grid index over the positions of the networks
+#
+# The positions are bucketed into cells of cell_size degrees. Bounding box,
+# radius and nearest neighbour queries only look at the cells which can
+# contain a result. Positions at 0/0 are unknown and are not indexed,
+# bounding boxes across the antimeridian are not supported.
+
+import heapq
+import math
+
+EARTH_RADIUS = 6371000.0  # meters
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great circle distance in meters
+    """
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    """mac -> position, bucketed into a grid
+
+    add() has to be called again after the position of a network changed.
+    """
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+        self.cells = {}  # (lat cell, lon cell) -> {mac: (lat, lon)}
+        self.positions = {}  # mac -> cell
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, mac):
+        return mac in self.positions
+
+    def cell(self, lat, lon):
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def add(self, mac, lat, lon):
+        if not lat and not lon:
+            self.discard(mac)
+            return
+        cell = self.cell(lat, lon)
+        old_cell = self.positions.get(mac)
+        if old_cell is not None and old_cell != cell:
+            self.discard(mac)
+        try:
+            self.cells[cell][mac] = (lat, lon)
+        except KeyError:
+            self.cells[cell] = {mac: (lat, lon)}
+        self.positions[mac] = cell
+
+    def discard(self, mac):
+        cell = self.positions.pop(mac, None)
+        if cell is None:
+            return
+        points = self.cells[cell]
+        del points[mac]
+        if len(points) == 0:
+            del self.cells[cell]
+
+    def clear(self):
+        self.cells = {}
+        self.positions = {}
+
+    def position(self, mac):
+        return self.cells[self.positions[mac]][mac]
+
+    def bbox_points(self, min_lat, min_lon, max_lat, max_lon):
+        """Yield (mac, lat, lon) of the positions inside the bounding box
+        """
+        min_cell_lat, min_cell_lon = self.cell(min_lat, min_lon)
+        max_cell_lat, max_cell_lon = self.cell(max_lat, max_lon)
+        if (max_cell_lat - min_cell_lat + 1) * (max_cell_lon - min_cell_lon + 1) > len(self.cells):
+            cells = [cell for cell in self.cells
+                     if min_cell_lat <= cell[0] <= max_cell_lat and min_cell_lon <= cell[1] <= max_cell_lon]
+        else:
+            cells = [(cell_lat, cell_lon)
+                     for cell_lat in range(min_cell_lat, max_cell_lat + 1)
+                     for cell_lon in range(min_cell_lon, max_cell_lon + 1)
+                     if (cell_lat, cell_lon) in self.cells]
+
+        for cell in cells:
+            points = self.cells[cell]
+            if min_cell_lat < cell[0] < max_cell_lat and min_cell_lon < cell[1] < max_cell_lon:
+                # the whole cell is inside
+                for mac, (lat, lon) in points.items():
+                    yield mac, lat, lon
+            else:
+                for mac, (lat, lon) in points.items():
+                    if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                        yield mac, lat, lon
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """macs inside the bounding box
+        """
+        return [mac for mac, lat, lon in self.bbox_points(min_lat, min_lon, max_lat, max_lon)]
+
+    def radius(self, lat, lon, meters):
+        """(distance, mac) of the positions within meters around lat/lon, nearest first
+        """
+        result = []
+        for mac, point_lat, point_lon in self.bbox_points(*radius_bbox(lat, lon, meters)):
+            point_distance = distance(lat, lon, point_lat, point_lon)
+            if point_distance <= meters:
+                result.append((point_distance, mac))
+        result.sort()
+        return result
+
+    def nearest(self, lat, lon, count):
+        """(distance, mac) of the count nearest positions, nearest first
+
+        The rings of cells around the position are searched until no
+        cell outside can contain a nearer position.
+        """
+        if count <= 0 or len(self.positions) == 0:
+            return []
+        center_lat, center_lon = self.cell(lat, lon)
+        found = []
+        seen = 0
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > 4 * len(self.cells):
+                # the rings cover more cells than there are, check the rest directly
+                for cell, points in self.cells.items():
+                    if max(abs(cell[0] - center_lat), abs(cell[1] - center_lon)) >= ring:
+                        for mac, (point_lat, point_lon) in points.items():
+                            found.append((distance(lat, lon, point_lat, point_lon), mac))
+                break
+
+            for cell in ring_cells(center_lat, center_lon, ring):
+                points = self.cells.get(cell)
+                if points is None:
+                    continue
+                seen += len(points)
+                for mac, (point_lat, point_lon) in points.items():
+                    found.append((distance(lat, lon, point_lat, point_lon), mac))
+
+            if seen == len(self.positions):
+                break
+            if len(found) >= count:
+                # nearest possible distance of a position in the next ring
+                limit_lat = min(90.0, abs(lat) + (ring + 1) * self.cell_size)
+                min_distance = ring * self.cell_size * METERS_PER_DEGREE * math.cos(math.radians(limit_lat))
+                if heapq.nsmallest(count, found)[-1][0] <= min_distance:
+                    break
+            ring += 1
+        return heapq.nsmallest(count, found)
+
+
+def ring_cells(center_lat, center_lon, ring):
+    """Cells with a distance of ring cells to the center cell
+    """
+    if ring == 0:
+        return [(center_lat, center_lon)]
+    cells = []
+    for offset in range(-ring, ring + 1):
+        cells.append((center_lat - ring, center_lon + offset))
+        cells.append((center_lat + ring, center_lon + offset))
+    for offset in range(-ring + 1, ring):
+        cells.append((center_lat + offset, center_lon - ring))
+        cells.append((center_lat + offset, center_lon + ring))
+    return cells
+
+
+def radius_bbox(lat, lon, meters):
+    """Bounding box which contains the circle
+    """
+    delta_lat = meters / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(90.0, abs(lat) + delta_lat)))
+    if cos_lat < 1e-6:
+        delta_lon = 180.0
+    else:
+        delta_lon = min(180.0, delta_lat / cos_lat)
+    return lat - delta_lat, lon - delta_lon, lat + delta_lat, lon + delta_lon
@@ -0,0 +1,261 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import collections
+import os
+import re
+import sqlite3
+import time
+
+import simplejson as json
+
+from kismon.crypt import crypt_category
+from kismon.store import NetworkRecord, geo_bucket, load_networks_json
+from kismon.journal import NetworksJournal
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS networks (
+    mac TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    channel INTEGER,
+    firsttime INTEGER,
+    lasttime INTEGER,
+    lat REAL,
+    lon REAL,
+    manuf TEXT,
+    ssid TEXT,
+    cryptset INTEGER,
+    crypt TEXT,
+    crypt_category TEXT,
+    signal_min INTEGER,
+    signal_max INTEGER,
+    signal_last INTEGER,
+    comment TEXT,
+    servers TEXT,
+    codename TEXT,
+    extra TEXT,
+    geo_bucket INTEGER
+);
+CREATE INDEX IF NOT EXISTS networks_lasttime ON networks (lasttime);
+CREATE INDEX IF NOT EXISTS networks_type ON networks (type);
+CREATE INDEX IF NOT EXISTS networks_crypt_category ON networks (crypt_category);
+CREATE INDEX IF NOT EXISTS networks_channel ON networks (channel);
+CREATE INDEX IF NOT EXISTS networks_geo_bucket ON networks (geo_bucket);
+"""
+
+COLUMNS = ('mac', 'type', 'channel', 'firsttime', 'lasttime', 'lat', 'lon', 'manuf', 'ssid',
+           'cryptset', 'crypt', 'crypt_category', 'signal_min', 'signal_max', 'signal_last',
+           'comment', 'servers', 'codename', 'extra', 'geo_bucket')
+
+
+def record_to_row(mac, network):
+    return (
+        mac, network.type, network.channel, network.firsttime, network.lasttime,
+        network.lat, network.lon, network.manuf, network.ssid, network.cryptset, network.crypt,
+        crypt_category(network.cryptset),
+        network.signal_min, network.signal_max, network.signal_last,
+        network.comment, json.dumps(list(network.servers)), network.codename,
+        None if network.extra is None else json.dumps(network.extra),
+        geo_bucket(network.lat, network.lon),
+    )
+
+
+def row_to_record(row):
+    record = NetworkRecord(network_type=row[1], channel=row[2], firsttime=row[3], lasttime=row[4],
+                           lat=row[5], lon=row[6], manuf=row[7], ssid=row[8], cryptset=row[9], crypt=row[10],
+                           comment=row[15], servers=json.loads(row[16]), codename=row[17])
+    record.set_signal(row[12], row[13], row[14])
+    if row[18] is not None:
+        record.extra = json.loads(row[18])
+    return record
+
+
+def regexp(pattern, value):
+    return value is not None and re.search(pattern, value) is not None
+
+
+def iregexp(pattern, value):
+    return value is not None and re.search(pattern, value, re.IGNORECASE) is not None
+
+
+class SQLiteNetworkStore:
+    """mac -> NetworkRecord, stored in a SQLite database
+
+    Only a bounded number of clean records is kept in memory. Changed
+    and new records are kept until flush() writes them in one transaction,
+    touch() has to be called before an existing record is changed.
+    """
+    is_database = True
+
+    def __init__(self, filename, cache_size=10000):
+        self.filename = filename
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.dirty = {}
+        # the database is only used by the main thread, but the
+        # shutdown save may run on another thread after the join
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.create_function("regexp", 2, regexp, deterministic=True)
+        self.db.create_function("iregexp", 2, iregexp, deterministic=True)
+        self.count = self.db.execute("SELECT COUNT(*) FROM networks").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __getitem__(self, mac):
+        try:
+            return self.dirty[mac]
+        except KeyError:
+            pass
+        try:
+            self.cache.move_to_end(mac)
+            return self.cache[mac]
+        except KeyError:
+            pass
+        row = self.db.execute("SELECT %s FROM networks WHERE mac=?" % ",".join(COLUMNS), (mac,)).fetchone()
+        if row is None:
+            raise KeyError(mac)
+        record = row_to_record(row)
+        self.cache[mac] = record
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return record
+
+    def __setitem__(self, mac, network):
+        if type(network) is not NetworkRecord:
+            network = NetworkRecord.from_dict(network)
+        if mac not in self:
+            self.count += 1
+        self.cache.pop(mac, None)
+        self.dirty[mac] = network
+
+    def touch(self, mac):
+        """Called before an existing record is changed
+        """
+        if mac not in self.dirty:
+            self.dirty[mac] = self[mac]
+            self.cache.pop(mac, None)
+
+    def __contains__(self, mac):
+        if mac in self.dirty or mac in self.cache:
+            return True
+        return self.db.execute("SELECT 1 FROM networks WHERE mac=?", (mac,)).fetchone() is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        self.flush()
+        return [row[0] for row in self.db.execute("SELECT mac FROM networks")]
+
+    def values(self):
+        for mac, network in self.items():
+            yield network
+
+    def items(self, batch_size=1000):
+        """Yield (mac, record) pairs, the records are not cached
+        """
+        self.flush()
+        cursor = self.db.execute("SELECT %s FROM networks" % ",".join(COLUMNS))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row[0], row_to_record(row)
+
+    def get(self, mac, default=None):
+        try:
+            return self[mac]
+        except KeyError:
+            return default
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, dict):
+            other = other.items()
+        elif hasattr(other, 'keys'):
+            other = [(key, other[key]) for key in other.keys()]
+        for mac, network in other:
+            self[mac] = network
+        for mac in kwargs:
+            self[mac] = kwargs[mac]
+
+    def to_dict(self, macs=None):
+        if macs is None:
+            return {mac: network.to_dict() for mac, network in self.items()}
+        return {mac: self[mac].to_dict() for mac in macs}
+
+    def flush(self):
+        """Write the changed records in one transaction
+        """
+        if len(self.dirty) == 0:
+            return 0
+        dirty = self.dirty
+        self.dirty = {}
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO networks (%s) VALUES (%s)" % (
+                ",".join(COLUMNS), ",".join("?" * len(COLUMNS))),
+                (record_to_row(mac, network) for mac, network in dirty.items()))
+        return len(dirty)
+
+    def select_macs(self, query):
+        """macs of the networks matching a NetworkQuery
+        """
+        self.flush()
+        where, params = query.to_sql()
+        return [row[0] for row in self.db.execute("SELECT mac FROM networks WHERE %s" % where, params)]
+
+
+def migrate_json(json_file, db_file, logger):
+    """One-shot import of networks.json and its journal into a new database
+    """
+    start_time = time.time()
+    with open(json_file) as f:
+        networks, schema = load_networks_json(f)
+    journal = NetworksJournal(json_file, logger=logger)
+    for mac, network in journal.replay():
+        networks[mac] = network
+
+    new_file = "%s.new" % db_file
+    if os.path.isfile(new_file):
+        os.remove(new_file)
+    store = SQLiteNetworkStore(new_file)
+    store.update(networks)
+    store.close()
+    os.rename(new_file, db_file)
+    logger.info("Migrated %s networks from %s to %s in %.1fsec" % (
+        len(networks), json_file, db_file, time.time() - start_time))
+    return len(networks)
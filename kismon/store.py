@@ -0,0 +1,862 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import bisect
+import codecs
+import os
+import re
+import sys
+import threading
+import time
+
+import simplejson as json
+
+from kismon.crypt import crypt_category, crypt_string
+from kismon.spatial import SpatialIndex
+
+# version of the networks.json layout, files without a schema header
+# are version 1 and need upgrade_network() for every record
+SCHEMA_VERSION = 2
+
+# fields of a network which changed in a merge, subscribers of Networks
+# are only notified about the changes they are interested in
+CHANGE_POSITION = 1
+CHANGE_SIGNAL = 2
+CHANGE_SSID = 4
+CHANGE_CRYPT = 8
+CHANGE_CHANNEL = 16
+CHANGE_LASTTIME = 32
+CHANGE_SERVERS = 64
+CHANGE_TYPE = 128
+CHANGE_FIRSTTIME = 256
+CHANGE_NEW = 512
+CHANGE_ALL = 1023
+
+_shared_values = {}
+
+
+def share_value(value):
+    """Return a shared instance of a frequently repeated value
+
+    Types, encryption strings, manufacturers and server lists are
+    repeated across thousands of networks, only one copy is kept.
+    """
+    if type(value) is str:
+        return sys.intern(value)
+    try:
+        return _shared_values.setdefault(value, value)
+    except TypeError:
+        return value
+
+
+def share_servers(servers):
+    if servers is None:
+        return ()
+    if type(servers) is str:
+        servers = (servers,)
+    return share_value(tuple(servers))
+
+
+class SignalDbm:
+    """dict-like view on the signal_dbm fields of a NetworkRecord
+    """
+    __slots__ = ('record',)
+    keys_to_slots = {'min': 'signal_min', 'max': 'signal_max', 'last': 'signal_last'}
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getitem__(self, key):
+        value = getattr(self.record, self.keys_to_slots[key])
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        setattr(self.record, self.keys_to_slots[key], value)
+
+    def __contains__(self, key):
+        return key in self.keys_to_slots and getattr(self.record, self.keys_to_slots[key]) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def keys(self):
+        return [key for key in self.keys_to_slots if key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class NetworkRecord:
+    """A single network, stored in slots instead of a dict
+
+    The record can still be used like the old network dict, e.g.
+    network["ssid"] or network["signal_dbm"]["last"].
+    """
+    __slots__ = ('type', 'channel', 'firsttime', 'lasttime', 'lat', 'lon',
+                 'manuf', 'ssid', 'cryptset', 'crypt',
+                 'signal_min', 'signal_max', 'signal_last',
+                 'comment', 'servers', 'codename', 'extra')
+
+    fields = ('type', 'channel', 'firsttime', 'lasttime', 'lat', 'lon',
+              'manuf', 'ssid', 'cryptset', 'crypt', 'signal_dbm',
+              'comment', 'servers', 'codename')
+
+    def __init__(self, network_type='unknown', channel=0, firsttime=0, lasttime=0, lat=0.0, lon=0.0,
+                 manuf='', ssid='', cryptset=0, crypt=None, comment='', servers=(), codename=''):
+        self.type = share_value(network_type)
+        self.channel = channel
+        self.firsttime = firsttime
+        self.lasttime = lasttime
+        self.lat = lat
+        self.lon = lon
+        self.manuf = share_value(manuf)
+        self.ssid = ssid
+        self.cryptset = cryptset
+        self.crypt = share_value(crypt)
+        self.signal_min = None
+        self.signal_max = None
+        self.signal_last = None
+        self.comment = comment
+        self.servers = share_servers(servers)
+        self.codename = codename
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        record.type = share_value(data.get('type', 'unknown'))
+        record.channel = data.get('channel', 0)
+        record.firsttime = data.get('firsttime', 0)
+        record.lasttime = data.get('lasttime', 0)
+        record.lat = data.get('lat', 0.0)
+        record.lon = data.get('lon', 0.0)
+        record.manuf = share_value(data.get('manuf', ''))
+        record.ssid = data.get('ssid', '')
+        record.cryptset = data.get('cryptset', 0)
+        record.crypt = share_value(data.get('crypt'))
+        signal_dbm = data.get('signal_dbm') or {}
+        record.signal_min = signal_dbm.get('min')
+        record.signal_max = signal_dbm.get('max')
+        record.signal_last = signal_dbm.get('last')
+        record.comment = data.get('comment', '')
+        record.servers = share_servers(data.get('servers'))
+        record.codename = data.get('codename', '')
+        record.extra = None
+        for key in data:
+            if key not in cls.fields:
+                record[key] = data[key]
+        return record
+
+    def to_dict(self):
+        data = {
+            'type': self.type,
+            'channel': self.channel,
+            'firsttime': self.firsttime,
+            'lasttime': self.lasttime,
+            'lat': self.lat,
+            'lon': self.lon,
+            'manuf': self.manuf,
+            'ssid': self.ssid,
+            'cryptset': self.cryptset,
+            'comment': self.comment,
+            'servers': list(self.servers),
+            'codename': self.codename,
+        }
+        if self.crypt is not None:
+            data['crypt'] = self.crypt
+        if self.has_signal():
+            data['signal_dbm'] = dict(SignalDbm(self).items())
+        if self.extra is not None:
+            data.update(self.extra)
+        return data
+
+    def copy(self):
+        record = NetworkRecord.__new__(NetworkRecord)
+        for key in self.__slots__:
+            setattr(record, key, getattr(self, key))
+        if self.extra is not None:
+            record.extra = dict(self.extra)
+        return record
+
+    def has_signal(self):
+        return self.signal_min is not None or self.signal_max is not None or self.signal_last is not None
+
+    def set_signal(self, signal_min, signal_max, signal_last):
+        self.signal_min = signal_min
+        self.signal_max = signal_max
+        self.signal_last = signal_last
+
+    def add_server(self, server_uri):
+        if server_uri not in self.servers:
+            self.servers = share_servers(self.servers + (server_uri,))
+
+    def __getitem__(self, key):
+        if key == 'signal_dbm':
+            if not self.has_signal():
+                raise KeyError(key)
+            return SignalDbm(self)
+        elif key in NetworkRecord.fields:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'signal_dbm':
+            value = value or {}
+            self.set_signal(value.get('min'), value.get('max'), value.get('last'))
+        elif key == 'servers':
+            self.servers = share_servers(value)
+        elif key in ('type', 'manuf', 'crypt'):
+            setattr(self, key, share_value(value))
+        elif key in NetworkRecord.fields:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __eq__(self, other):
+        if isinstance(other, NetworkRecord):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return "NetworkRecord(%s)" % self.to_dict()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.to_dict()]
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+
+class NetworkStore(dict):
+    """mac -> NetworkRecord
+
+    dict values are converted to records on assignment, so the store
+    can be used like the old dict of network dicts.
+    """
+    is_database = False
+
+    def touch(self, mac):
+        """Called before an existing record is changed
+        """
+        pass
+
+    def __setitem__(self, mac, network):
+        if type(network) is not NetworkRecord:
+            network = NetworkRecord.from_dict(network)
+        dict.__setitem__(self, mac, network)
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, dict):
+            other = other.items()
+        elif hasattr(other, 'keys'):
+            other = [(key, other[key]) for key in other.keys()]
+        for mac, network in other:
+            self[mac] = network
+        for mac in kwargs:
+            self[mac] = kwargs[mac]
+
+    def to_dict(self, macs=None):
+        if macs is None:
+            macs = self
+        return {mac: self[mac].to_dict() for mac in macs}
+
+
+class StoreSnapshot:
+    """Consistent view of a NetworkStore while another thread reads it
+
+    Only the list of macs is copied when the snapshot is taken. A record
+    has to be frozen with freeze() before it is changed, the snapshot
+    then keeps the old copy of the record (copy-on-write).
+    """
+
+    def __init__(self, store, macs=None):
+        self.store = store
+        self.macs = list(store.keys() if macs is None else macs)
+        self.frozen = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.macs)
+
+    def freeze(self, mac):
+        with self.lock:
+            if mac not in self.frozen and mac in self.store:
+                self.frozen[mac] = self.store[mac].copy()
+
+    def iter_dicts(self, batch_size=1000):
+        """Yield (mac, network dict) pairs sorted by mac
+        """
+        self.macs.sort()
+        for start in range(0, len(self.macs), batch_size):
+            batch = []
+            with self.lock:
+                for mac in self.macs[start:start + batch_size]:
+                    network = self.frozen.get(mac)
+                    if network is None:
+                        network = self.store[mac]
+                    batch.append((mac, network.to_dict()))
+            yield from batch
+
+    def render_batches(self, render, batch_size=1000, macs=None):
+        """Yield (number of records, render([(mac, record), ...])) for batches of
+        the records in the order of the macs, the records can't be changed
+        while render() runs. macs is a subset of the macs of the snapshot.
+        """
+        if macs is None:
+            macs = self.macs
+        for start in range(0, len(macs), batch_size):
+            batch = []
+            with self.lock:
+                for mac in macs[start:start + batch_size]:
+                    network = self.frozen.get(mac)
+                    if network is None:
+                        network = self.store.get(mac)
+                        if network is None:
+                            continue
+                    batch.append((mac, network))
+                result = render(batch)
+            yield len(batch), result
+
+
+class NetworkIndex:
+    """Inverted indexes over the filter dimensions of a NetworkStore
+
+    type -> macs, crypt category -> macs and server -> macs, the positions
+    are kept in a SpatialIndex and the first and last seen times in a
+    TimeIndex. A record has to be discarded before one of these fields is
+    changed and added again afterwards.
+    """
+
+    def __init__(self):
+        self.types = {}
+        self.crypts = {}
+        self.servers = {}
+        self.positions = SpatialIndex()
+        self.firsttimes = TimeIndex()
+        self.lasttimes = TimeIndex()
+
+    def add(self, mac, network):
+        try:
+            self.types[network.type].add(mac)
+        except KeyError:
+            self.types[network.type] = {mac}
+        category = crypt_category(network.cryptset)
+        try:
+            self.crypts[category].add(mac)
+        except KeyError:
+            self.crypts[category] = {mac}
+        for server in network.servers:
+            try:
+                self.servers[server].add(mac)
+            except KeyError:
+                self.servers[server] = {mac}
+        self.positions.add(mac, network.lat, network.lon)
+        self.firsttimes.add(mac, network.firsttime)
+        self.lasttimes.add(mac, network.lasttime)
+
+    def discard(self, mac, network):
+        macs = self.types.get(network.type)
+        if macs is not None:
+            macs.discard(mac)
+        macs = self.crypts.get(crypt_category(network.cryptset))
+        if macs is not None:
+            macs.discard(mac)
+        for server in network.servers:
+            macs = self.servers.get(server)
+            if macs is not None:
+                macs.discard(mac)
+        self.positions.discard(mac)
+        self.firsttimes.discard(mac)
+        self.lasttimes.discard(mac)
+
+    def rebuild(self, networks):
+        self.types = {}
+        self.crypts = {}
+        self.servers = {}
+        self.positions.clear()
+        self.firsttimes.clear()
+        self.lasttimes.clear()
+        for mac, network in networks.items():
+            self.add(mac, network)
+
+    def select(self, types=(), crypts=()):
+        """macs with one of the types or one of the crypt categories
+        """
+        macs = set()
+        for network_type in types:
+            macs.update(self.types.get(network_type, ()))
+        for category in crypts:
+            macs.update(self.crypts.get(category, ()))
+        return macs
+
+
+class TimeIndex:
+    """mac -> timestamp, in buckets of bucket_size seconds
+
+    The numbers of the non-empty buckets are kept sorted, a range query
+    only visits the buckets inside the range and costs time proportional
+    to the size of the result.
+    """
+
+    def __init__(self, bucket_size=60):
+        self.bucket_size = bucket_size
+        self.buckets = {}  # bucket number -> {mac: timestamp}
+        self.bucket_numbers = []
+        self.times = {}  # mac -> timestamp
+
+    def __len__(self):
+        return len(self.times)
+
+    def __contains__(self, mac):
+        return mac in self.times
+
+    def add(self, mac, timestamp):
+        if timestamp is None:
+            self.discard(mac)
+            return
+        old = self.times.get(mac)
+        if old is not None:
+            if old == timestamp:
+                return
+            self.discard(mac)
+        number = timestamp // self.bucket_size
+        try:
+            self.buckets[number][mac] = timestamp
+        except KeyError:
+            self.buckets[number] = {mac: timestamp}
+            if len(self.bucket_numbers) == 0 or number > self.bucket_numbers[-1]:
+                # new networks are usually the most recent ones
+                self.bucket_numbers.append(number)
+            else:
+                bisect.insort(self.bucket_numbers, number)
+        self.times[mac] = timestamp
+
+    def discard(self, mac):
+        timestamp = self.times.pop(mac, None)
+        if timestamp is None:
+            return
+        number = timestamp // self.bucket_size
+        bucket = self.buckets[number]
+        del bucket[mac]
+        if len(bucket) == 0:
+            del self.buckets[number]
+            del self.bucket_numbers[bisect.bisect_left(self.bucket_numbers, number)]
+
+    def clear(self):
+        self.buckets = {}
+        self.bucket_numbers = []
+        self.times = {}
+
+    def range(self, start=None, end=None):
+        """macs with start <= timestamp <= end, oldest bucket first
+        """
+        numbers = self.bucket_numbers
+        if start is None:
+            first = 0
+        else:
+            first = bisect.bisect_left(numbers, start // self.bucket_size)
+        macs = []
+        for pos in range(first, len(numbers)):
+            number = numbers[pos]
+            if end is not None and number > end // self.bucket_size:
+                break
+            bucket = self.buckets[number]
+            if (start is None or number * self.bucket_size >= start) and \
+                    (end is None or (number + 1) * self.bucket_size <= end):
+                # the whole bucket is inside the range
+                macs.extend(bucket)
+            else:
+                for mac, timestamp in bucket.items():
+                    if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                        macs.append(mac)
+        return macs
+
+
+class SessionTracker:
+    """Networks seen in the current session, in first seen order
+
+    Membership tests are O(1). For every network the first seen time and
+    the servers which reported it in this session are kept.
+    """
+
+    def __init__(self):
+        self.networks = {}  # mac -> (first seen, server ids)
+        self.server_counts = {}
+
+    def add(self, mac, server_id=None):
+        """Returns True if the network is new in this session
+        """
+        try:
+            first_seen, servers = self.networks[mac]
+        except KeyError:
+            first_seen, servers = time.time(), ()
+            new = True
+        else:
+            if server_id is None or server_id in servers:
+                return False
+            new = False
+        if server_id is not None:
+            servers += (server_id,)
+            self.server_counts[server_id] = self.server_counts.get(server_id, 0) + 1
+        self.networks[mac] = (first_seen, servers)
+        return new
+
+    def __contains__(self, mac):
+        return mac in self.networks
+
+    def __len__(self):
+        return len(self.networks)
+
+    def __iter__(self):
+        return iter(self.networks)
+
+    def first_seen(self, mac):
+        return self.networks[mac][0]
+
+    def servers(self, mac):
+        return self.networks[mac][1]
+
+    def latest(self, count):
+        """The last count networks which were new in this session, newest first
+        """
+        macs = []
+        for mac in reversed(self.networks):
+            if len(macs) == count:
+                break
+            macs.append(mac)
+        return macs
+
+    def clear(self):
+        self.networks = {}
+        self.server_counts = {}
+
+
+class NetworkQuery:
+    """Predicates to select networks
+
+    The query is compiled once: the regular expressions are compiled and
+    the crypt category verdict is cached per cryptset. It can be evaluated
+    on a record with matches() or be turned into an SQL WHERE clause with
+    to_sql() by database backed stores.
+    """
+
+    def __init__(self, excluded_types=(), excluded_crypts=(), ssid_regexpr="", bssid_regexpr="",
+                 has_position=False, lasttime_min=None, bbox=None):
+        self.excluded_types = frozenset(excluded_types)
+        self.excluded_crypts = frozenset(excluded_crypts)
+        self.ssid_regexpr = ssid_regexpr
+        self.bssid_regexpr = bssid_regexpr
+        self.ssid_re = re.compile(ssid_regexpr) if ssid_regexpr != "" else None
+        self.bssid_re = re.compile(bssid_regexpr, re.IGNORECASE) if bssid_regexpr != "" else None
+        self.has_position = has_position
+        self.lasttime_min = lasttime_min
+        self.bbox = bbox  # (min_lat, min_lon, max_lat, max_lon)
+        self.crypt_allowed = {}
+
+    def same_patterns(self, other):
+        """True if both queries differ at most in the excluded types and crypts
+        """
+        return (self.ssid_regexpr, self.bssid_regexpr, self.has_position, self.lasttime_min, self.bbox) == \
+            (other.ssid_regexpr, other.bssid_regexpr, other.has_position, other.lasttime_min, other.bbox)
+
+    @classmethod
+    def from_config(cls, config, has_position=False):
+        excluded_types = [key for key in config["filter_type"] if not config["filter_type"][key]]
+        excluded_crypts = [key for key in config["filter_crypt"] if not config["filter_crypt"][key]]
+        return cls(excluded_types=excluded_types, excluded_crypts=excluded_crypts,
+                   ssid_regexpr=config["filter_regexpr"]["ssid"], bssid_regexpr=config["filter_regexpr"]["bssid"],
+                   has_position=has_position)
+
+    def matches(self, mac, network):
+        if network.type in self.excluded_types:
+            return False
+        if self.excluded_crypts:
+            try:
+                allowed = self.crypt_allowed[network.cryptset]
+            except KeyError:
+                allowed = crypt_category(network.cryptset) not in self.excluded_crypts
+                self.crypt_allowed[network.cryptset] = allowed
+            if not allowed:
+                return False
+        if self.ssid_re is not None and self.ssid_re.search(network.ssid) is None:
+            return False
+        if self.bssid_re is not None and self.bssid_re.search(mac) is None:
+            return False
+        if self.has_position and network.lat == 0 and network.lon == 0:
+            return False
+        if self.lasttime_min is not None and network.lasttime < self.lasttime_min:
+            return False
+        if self.bbox is not None:
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            if not (min_lat <= network.lat <= max_lat and min_lon <= network.lon <= max_lon):
+                return False
+        return True
+
+    def to_sql(self):
+        """Returns the WHERE clause and its parameters
+        """
+        where = []
+        params = []
+        if self.excluded_types:
+            where.append("type NOT IN (%s)" % ",".join("?" * len(self.excluded_types)))
+            params.extend(sorted(self.excluded_types))
+        if self.excluded_crypts:
+            where.append("crypt_category NOT IN (%s)" % ",".join("?" * len(self.excluded_crypts)))
+            params.extend(sorted(self.excluded_crypts))
+        if self.ssid_regexpr != "":
+            where.append("ssid REGEXP ?")
+            params.append(self.ssid_regexpr)
+        if self.bssid_regexpr != "":
+            where.append("iregexp(?, mac)")
+            params.append(self.bssid_regexpr)
+        if self.has_position:
+            where.append("NOT (lat = 0 AND lon = 0)")
+        if self.lasttime_min is not None:
+            where.append("lasttime >= ?")
+            params.append(self.lasttime_min)
+        if self.bbox is not None:
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            buckets = []
+            for lat_bucket in range(geo_bucket(min_lat, 0) // 10000, geo_bucket(max_lat, 0) // 10000 + 1):
+                buckets.append("geo_bucket BETWEEN ? AND ?")
+                params.extend((lat_bucket * 10000 + geo_bucket(0, min_lon) % 10000,
+                               lat_bucket * 10000 + geo_bucket(0, max_lon) % 10000))
+            where.append("(%s)" % " OR ".join(buckets))
+            where.append("lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?")
+            params.extend((min_lat, max_lat, min_lon, max_lon))
+        if len(where) == 0:
+            return "1", params
+        return " AND ".join(where), params
+
+
+def geo_bucket(lat, lon):
+    """0.1 degree grid cell of a position
+    """
+    return int((lat + 90) * 10) * 10000 + int((lon + 180) * 10)
+
+
+def network_object_hook(data):
+    """json object_hook which turns network dicts into records
+    """
+    if 'lasttime' in data and 'cryptset' in data:
+        return NetworkRecord.from_dict(data)
+    return data
+
+
+class NetworksFileReader:
+    """Incremental parser for networks.json
+
+    The file is read in chunks and the networks are decoded one by one,
+    iterating yields (mac, record) pairs. bytes_read and total_bytes can
+    be used to show the progress, schema is known once the first network
+    has been read.
+    """
+
+    def __init__(self, f, chunk_size=1024 * 1024):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder(object_hook=network_object_hook)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+        self.schema = 1
+        try:
+            self.total_bytes = os.fstat(f.fileno()).st_size
+        except (AttributeError, OSError):
+            self.total_bytes = 0
+
+    def read_chunk(self):
+        if self.eof:
+            return False
+        data = self.f.read(self.chunk_size)
+        self.bytes_read += len(data)
+        if len(data) == 0:
+            self.eof = True
+        if type(data) is bytes:
+            data = self.utf8.decode(data, final=self.eof)
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """Skip whitespace and return the next character, None at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buffer):
+                if not self.buffer[self.pos].isspace():
+                    return self.buffer[self.pos]
+                self.pos += 1
+            if not self.read_chunk():
+                return None
+
+    def expect(self, char):
+        if self.next_char() != char:
+            raise ValueError("'%s' expected at byte %s" % (char, self.bytes_read))
+        self.pos += 1
+
+    def decode(self):
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                # the value continues in the next chunk
+                if not self.read_chunk():
+                    raise
+
+    def __iter__(self):
+        self.expect("{")
+        while True:
+            char = self.next_char()
+            if char == "}":
+                return
+            elif char == ",":
+                self.pos += 1
+                continue
+            key = self.decode()
+            self.expect(":")
+            if key == "schema":
+                self.schema = check_schema(self.decode())
+            elif key == "networks":
+                yield from self.iter_networks()
+            else:
+                # version 1 files contain the networks at the top level
+                yield key, self.decode_network()
+
+    def iter_networks(self):
+        self.expect("{")
+        while True:
+            char = self.next_char()
+            if char == "}":
+                self.pos += 1
+                return
+            elif char == ",":
+                self.pos += 1
+                continue
+            mac = self.decode()
+            self.expect(":")
+            yield mac, self.decode_network()
+
+    def decode_network(self):
+        network = self.decode()
+        if type(network) is not NetworkRecord:
+            network = NetworkRecord.from_dict(network)
+        return network
+
+
+def check_schema(schema):
+    if type(schema) is not int or schema > SCHEMA_VERSION:
+        raise ValueError("Unsupported networks file schema %s, kismon supports %s" % (schema, SCHEMA_VERSION))
+    return schema
+
+
+def load_networks_json(f):
+    """Parse a complete networks.json file
+
+    Returns the NetworkStore and the schema version of the file, the
+    records of older versions are already upgraded.
+    """
+    data = json.load(f, object_hook=network_object_hook)
+    if "schema" in data:
+        schema = check_schema(data["schema"])
+        data = data["networks"]
+    else:
+        schema = 1
+    networks = NetworkStore()
+    networks.update(data)
+    if schema < SCHEMA_VERSION:
+        for network in networks.values():
+            upgrade_network(network)
+    return networks, schema
+
+
+def upgrade_network(network):
+    """Fill in fields which were missing in older versions of kismon,
+    comment, codename and servers already get defaults in the record.
+    Only needed for files without a schema header.
+    """
+    if network.crypt is None:
+        crypt = crypt_string(network.cryptset)
+        if 'WEP,' in crypt and 'WPA' in crypt:
+            crypt = crypt.replace('WEP,', '')
+        network['crypt'] = crypt
+    if network.type in ('generic', 'probe', 'data'):
+        network['type'] = 'unknown'
+
+
+def record_to_json(obj):
+    """default hook for json.dump
+    """
+    if isinstance(obj, NetworkRecord):
+        return obj.to_dict()
+    elif isinstance(obj, SignalDbm):
+        return dict(obj.items())
+    raise TypeError("%r is not JSON serializable" % obj)
@@ -28,6 +28,7 @@ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 POSSIBILITY OF SUCH DAMAGE.
 """
 
+import math
 import time
 import sys
 import os
@@ -55,8 +56,17 @@ def is_cairo_available():
         return False
 
 
+def is_numpy_available():
+    try:
+        import numpy
+        return True
+    except ImportError:
+        return False
+
+
 gi_available = is_gi_available()
 cairo_available = is_cairo_available()
+numpy_available = is_numpy_available()
 
 
 def get_client_test_data():
@@ -151,6 +161,8 @@ def networks():
     networks_file = "%s%snetworks-%s.json" % (tempfile.gettempdir(), os.sep, int(time.time()))
     networks.save(networks_file)
     networks.load(networks_file)
+    networks.load_progressive(networks_file)
+    networks.finish_loading()
     networks.import_networks("networks", networks_file)
     networks.apply_filters()
     networks.save(networks_file)
@@ -160,6 +172,8 @@ def networks():
                                  filtered=False)
     networks.export_networks_kmz(tempfile.gettempdir() + os.sep + "test.kmz", networks.networks, tracks=test_tracks,
                                  filtered=True)
+    networks.export_networks("mappoint csv", tempfile.gettempdir() + os.sep + "test.csv")
+    networks.export_networks("kismon", tempfile.gettempdir() + os.sep + "test.json", list(networks.networks)[:1])
 
     return networks
 
@@ -199,6 +213,26 @@ class TestKismon(unittest.TestCase):
     # client_thread.run()
     # client_thread.stop()
 
+    def test_crypt(self):
+        from kismon.crypt import encode_cryptset, decode_cryptset, crypt_string, crypt_category, crypt_label, \
+            crypt_color, netxml_encryption
+        self.assertEqual(decode_cryptset(0), ("none",))
+        self.assertEqual(decode_cryptset(706), ("wep", "wpa", "psk", "aes_ccm"))
+        self.assertEqual(decode_cryptset(706, True), "WEP,WPA,PSK,AES_CCM")
+        self.assertEqual(crypt_string(4), "LAYER3")
+        self.assertEqual(encode_cryptset(["layer3"]), 4)
+        # unknown bits are ignored
+        self.assertEqual(crypt_string(268436162), "WEP,WPA,PSK,AES_CCM")
+        for cryptset, category, label, color in ((0, "none", "None", "green"), (2, "wep", "WEP", "yellow"),
+                                                 (226, "wpa", "WPA", "orange"), (706, "wpa2", "WPA2", "red"),
+                                                 (256, "wpa2", "WPA2", "red"), (1, "other", "Other", "green")):
+            self.assertEqual(crypt_category(cryptset), category)
+            self.assertEqual(crypt_label(cryptset), label)
+            self.assertEqual(crypt_color(cryptset), color)
+        self.assertEqual(netxml_encryption(0), "  <encryption>None</encryption>\n")
+        self.assertEqual(netxml_encryption(226), "  <encryption>WPA+TKIP</encryption>\n"
+                                                 "  <encryption>WPA+PSK</encryption>\n")
+
     def test_config(self):
         from kismon.config import Config
         config_file = tempfile.gettempdir() + os.sep + "testconfig.conf"
@@ -208,6 +242,934 @@ class TestKismon(unittest.TestCase):
         conf = Config(config_file, logger=logger)
         conf.read()
 
+    def test_store(self):
+        from kismon.store import NetworkStore, NetworkRecord, StoreSnapshot, record_to_json
+        import json
+        network = {"type": "infrastructure", "channel": 6, "firsttime": 1, "lasttime": 2, "lat": 52.5, "lon": 13.3,
+                   "manuf": "", "ssid": "test", "cryptset": 2, "crypt": "WEP",
+                   "signal_dbm": {"min": -80, "max": -50, "last": -60},
+                   "comment": "", "servers": ["http://127.0.0.1:2501"], "codename": "", "custom": 1}
+        store = NetworkStore()
+        store["11:22:33:44:55:66"] = copy.deepcopy(network)
+        record = store["11:22:33:44:55:66"]
+        self.assertIsInstance(record, NetworkRecord)
+        self.assertEqual(record["signal_dbm"]["last"], -60)
+        self.assertEqual(record.to_dict(), network)
+        self.assertEqual(json.loads(json.dumps(store, default=record_to_json)), {"11:22:33:44:55:66": network})
+
+        record["signal_dbm"]["last"] = -70
+        record["servers"] = "http://127.0.0.1:2501"
+        record.add_server("http://127.0.0.1:2502")
+        self.assertEqual(record.signal_last, -70)
+        self.assertEqual(record["servers"], ("http://127.0.0.1:2501", "http://127.0.0.1:2502"))
+
+        del network["signal_dbm"]
+        record = NetworkRecord.from_dict(network)
+        self.assertNotIn("signal_dbm", record)
+        self.assertEqual(record.copy(), network)
+
+        snapshot = StoreSnapshot(store)
+        snapshot.freeze("11:22:33:44:55:66")
+        store["11:22:33:44:55:66"].ssid = "changed"
+        store["22:33:44:55:66:77"] = network
+        self.assertEqual([(mac, network["ssid"]) for mac, network in snapshot.iter_dicts()],
+                         [("11:22:33:44:55:66", "test")])
+
+    def test_journal(self):
+        from kismon.journal import NetworksJournal
+        from kismon.store import NetworkRecord
+        snapshot = "%s%stest-journal-%s.json" % (tempfile.gettempdir(), os.sep, int(time.time()))
+        with open(snapshot, "w") as f:
+            f.write("{}")
+        journal = NetworksJournal(snapshot, logger=logger)
+        self.assertEqual(list(journal.replay()), [])
+        journal.reset()
+        journal.append([("11:22:33:44:55:66", NetworkRecord(ssid="first"))])
+        journal.append([("11:22:33:44:55:66", NetworkRecord(ssid="second")), ("22:33:44:55:66:77", {"ssid": ""})])
+        with open(journal.filename, "a") as f:
+            f.write('["33:44:55:66:77:88", {"ssi')
+
+        journal = NetworksJournal(snapshot, logger=logger)
+        changes = list(journal.replay())
+        self.assertEqual([mac for mac, network in changes], ["11:22:33:44:55:66", "11:22:33:44:55:66",
+                                                             "22:33:44:55:66:77"])
+        self.assertEqual(changes[1][1]["ssid"], "second")
+        self.assertTrue(journal.broken)
+
+        # a new snapshot invalidates the old journal
+        with open(snapshot, "w") as f:
+            f.write('{"11:22:33:44:55:66": {}}')
+        self.assertFalse(journal.is_valid())
+        self.assertEqual(list(journal.replay()), [])
+        journal.remove()
+        os.remove(snapshot)
+
+    def test_networks_file_reader(self):
+        from kismon.store import NetworksFileReader
+        import io
+        data = '{"11:22:33:44:55:66": {"lasttime": 1, "cryptset": 0, "ssid": "\\u00e4\\u00f6", "servers": []},\n' \
+               ' "22:33:44:55:66:77" : {"lasttime": 2, "cryptset": 2, "ssid": "\u00fc{}", "signal_dbm": {"last": -50}}}\n'
+        for chunk_size in (1, 7, 1024):
+            reader = NetworksFileReader(io.BytesIO(data.encode("utf-8")), chunk_size=chunk_size)
+            networks = list(reader)
+            self.assertEqual([mac for mac, network in networks], ["11:22:33:44:55:66", "22:33:44:55:66:77"])
+            self.assertEqual(networks[0][1].ssid, "\u00e4\u00f6")
+            self.assertEqual(networks[1][1].ssid, "\u00fc{}")
+            self.assertEqual(networks[1][1]["signal_dbm"]["last"], -50)
+            # the reader stops at the closing brace
+            self.assertGreaterEqual(reader.bytes_read, len(data.encode("utf-8")) - 1)
+        self.assertEqual(list(NetworksFileReader(io.BytesIO(b"{\n}\n"))), [])
+        with self.assertRaises(ValueError):
+            list(NetworksFileReader(io.BytesIO(b'{"11:22:33:44:55:66": {"lasttime": 1, ')))
+
+    def test_networks_schema(self):
+        from kismon.store import NetworksFileReader, SCHEMA_VERSION, load_networks_json
+        import io
+        legacy = '{"11:22:33:44:55:66": {"type": "probe", "lasttime": 1, "cryptset": 706}}'
+        current = '{"schema": %s, "networks": {\n"11:22:33:44:55:66": {"type": "unknown", "lasttime": 1, ' \
+                  '"cryptset": 706, "crypt": "WPA,PSK,AES_CCM"}\n}}\n' % SCHEMA_VERSION
+        networks, schema = load_networks_json(io.StringIO(legacy))
+        self.assertEqual(schema, 1)
+        self.assertEqual(networks["11:22:33:44:55:66"].type, "unknown")
+        self.assertEqual(networks["11:22:33:44:55:66"].crypt, "WPA,PSK,AES_CCM")
+        current_networks, schema = load_networks_json(io.StringIO(current))
+        self.assertEqual(schema, SCHEMA_VERSION)
+        self.assertEqual(current_networks, networks)
+
+        reader = NetworksFileReader(io.BytesIO(current.encode()))
+        self.assertEqual(dict(reader), networks)
+        self.assertEqual(reader.schema, SCHEMA_VERSION)
+        reader = NetworksFileReader(io.BytesIO(legacy.encode()))
+        self.assertEqual(list(reader)[0][1].crypt, None)
+        self.assertEqual(reader.schema, 1)
+
+        with self.assertRaises(ValueError):
+            load_networks_json(io.StringIO('{"schema": %s, "networks": {}}' % (SCHEMA_VERSION + 1)))
+        with self.assertRaises(ValueError):
+            list(NetworksFileReader(io.BytesIO(b'{"schema": "x", "networks": {}}')))
+
+    def test_network_query(self):
+        from kismon.config import Config
+        from kismon.store import NetworkRecord, NetworkQuery
+        import re
+        config = Config(None, logger=logger).default_config
+        config["filter_crypt"]["wep"] = False
+        config["filter_regexpr"]["bssid"] = "^aa:"
+        network_filter = NetworkQuery.from_config(config)
+        self.assertTrue(network_filter.matches("AA:BB:CC:DD:EE:FF", NetworkRecord(network_type="infrastructure")))
+        self.assertFalse(network_filter.matches("AA:BB:CC:DD:EE:FF", NetworkRecord(network_type="client")))
+        self.assertFalse(network_filter.matches("AA:BB:CC:DD:EE:FF", NetworkRecord(cryptset=2)))
+        self.assertFalse(network_filter.matches("11:BB:CC:DD:EE:FF", NetworkRecord()))
+        self.assertEqual(network_filter.crypt_allowed, {0: True, 2: False})
+        with self.assertRaises(re.error):
+            NetworkQuery(ssid_regexpr="[")
+
+    def test_network_index(self):
+        from kismon.store import NetworkStore, NetworkRecord, NetworkIndex
+        networks = NetworkStore()
+        networks["11:22:33:44:55:66"] = NetworkRecord(network_type="client", cryptset=0, servers=("a",))
+        networks["22:33:44:55:66:77"] = NetworkRecord(network_type="infrastructure", cryptset=706, servers=("a", "b"))
+        index = NetworkIndex()
+        index.rebuild(networks)
+        self.assertEqual(index.types["client"], {"11:22:33:44:55:66"})
+        self.assertEqual(index.crypts["wpa2"], {"22:33:44:55:66:77"})
+        self.assertEqual(index.servers["a"], {"11:22:33:44:55:66", "22:33:44:55:66:77"})
+        self.assertEqual(index.select(types=("client",), crypts=("wpa2",)), set(networks))
+
+        network = networks["22:33:44:55:66:77"]
+        index.discard("22:33:44:55:66:77", network)
+        network.cryptset = 2
+        network.type = "client"
+        index.add("22:33:44:55:66:77", network)
+        self.assertEqual(index.types["infrastructure"], set())
+        self.assertEqual(index.select(types=("client",)), set(networks))
+        self.assertEqual(index.select(crypts=("wep",)), {"22:33:44:55:66:77"})
+
+    def test_spatial_index(self):
+        import random
+        from kismon.spatial import SpatialIndex, distance
+        rnd = random.Random(1)
+        index = SpatialIndex(cell_size=0.01)
+        points = {}
+        for num in range(2000):
+            mac = "00:00:00:00:%02X:%02X" % (num // 256, num % 256)
+            points[mac] = (52.4 + rnd.random() * 0.2, 13.3 + rnd.random() * 0.2)
+            index.add(mac, *points[mac])
+        index.add("FF:00:00:00:00:00", 52.45, 13.35)
+        index.add("FF:00:00:00:00:00", 0.0, 0.0)
+        self.assertEqual(len(index), 2000)
+        index.add("00:00:00:00:00:01", 52.5, 13.4)
+        points["00:00:00:00:00:01"] = (52.5, 13.4)
+        self.assertEqual(index.position("00:00:00:00:00:01"), (52.5, 13.4))
+
+        bbox = (52.45, 13.32, 52.51, 13.44)
+        expected = [mac for mac, (lat, lon) in points.items()
+                    if bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]]
+        self.assertEqual(sorted(index.bbox(*bbox)), sorted(expected))
+
+        brute_force = sorted((distance(52.5, 13.4, lat, lon), mac) for mac, (lat, lon) in points.items())
+        self.assertEqual(index.radius(52.5, 13.4, 1000), [item for item in brute_force if item[0] <= 1000])
+        self.assertEqual(index.nearest(52.5, 13.4, 10), brute_force[:10])
+        self.assertEqual(index.nearest(53.5, 14.4, 3), sorted(
+            (distance(53.5, 14.4, lat, lon), mac) for mac, (lat, lon) in points.items())[:3])
+        self.assertEqual(len(index.nearest(52.5, 13.4, 5000)), 2000)
+
+        index.discard("00:00:00:00:00:01")
+        self.assertNotIn("00:00:00:00:00:01", index)
+        self.assertEqual(index.nearest(52.5, 13.4, 1)[0][1], brute_force[1][1])
+
+    def test_time_index(self):
+        import random
+        from kismon.store import TimeIndex
+        rnd = random.Random(1)
+        index = TimeIndex(bucket_size=60)
+        times = {}
+        for num in range(3000):
+            mac = "00:00:00:00:%02X:%02X" % (num // 256, num % 256)
+            times[mac] = 1000000 + rnd.randint(0, 7200)
+            index.add(mac, times[mac])
+        index.add("FF:00:00:00:00:00", 1000100)
+        index.add("FF:00:00:00:00:00", None)
+        self.assertEqual(len(index), 3000)
+        index.add("00:00:00:00:00:01", 999000)
+        times["00:00:00:00:00:01"] = 999000
+        index.discard("00:00:00:00:00:02")
+        del times["00:00:00:00:00:02"]
+        self.assertNotIn("00:00:00:00:00:02", index)
+
+        for start, end in ((None, None), (1003000, None), (None, 1000500), (1001234, 1001290), (1001230, 1001230)):
+            expected = [mac for mac, timestamp in times.items()
+                        if (start is None or timestamp >= start) and (end is None or timestamp <= end)]
+            self.assertEqual(sorted(index.range(start, end)), sorted(expected))
+        self.assertEqual(index.range(2000000), [])
+
+    @unittest.skipUnless(numpy_available, "numpy module not available")
+    def test_observation_store(self):
+        from kismon.observations import ObservationStore
+        store = ObservationStore(capacity=4, rows=2, seed=1)
+        self.assertTrue(store.add("00:00:00:00:00:01", 52.0, 13.0, -40, 1000))
+        self.assertTrue(store.add("00:00:00:00:00:01", 53.0, 14.0, -50, 1001))
+        store.add("00:00:00:00:00:02", 50.0, 10.0, None, 1000)
+        store.add("00:00:00:00:00:02", 51.0, 11.0, None, 1001)
+        store.add("00:00:00:00:00:03", 48.0, 9.0, -70, 1000)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.observations("00:00:00:00:00:01"), [(52.0, 13.0, -40, 1000), (53.0, 14.0, -50, 1001)])
+
+        estimates = {mac: (lat, lon) for mac, lat, lon in store.estimate()}
+        self.assertAlmostEqual(estimates["00:00:00:00:00:01"][0], 52.0 + 1 / 11)
+        self.assertAlmostEqual(estimates["00:00:00:00:00:01"][1], 13.0 + 1 / 11)
+        self.assertEqual(estimates["00:00:00:00:00:02"], (50.5, 10.5))
+        self.assertEqual(estimates["00:00:00:00:00:03"], (48.0, 9.0))
+        self.assertEqual(store.estimate(), [])
+
+        kept = 0
+        for num in range(1000):
+            kept += store.add("00:00:00:00:00:03", 48.0, 9.0, -70, 1000 + num)
+        self.assertEqual(len(store.observations("00:00:00:00:00:03")), 4)
+        self.assertLess(kept, 100)
+        self.assertEqual(store.estimate(["00:00:00:00:00:01", "00:00:00:00:00:03"]),
+                         [("00:00:00:00:00:03", 48.0, 9.0)])
+
+    @unittest.skipUnless(numpy_available, "numpy module not available")
+    def test_multilateration(self):
+        from kismon.multilateration import Multilateration, signal_distance
+        from kismon.spatial import distance
+        sensors = ((52.5, 13.4), (52.501, 13.4), (52.5, 13.402), (52.502, 13.403))
+        signals = []
+        for lat, lon in sensors:
+            meters = distance(52.5007, 13.4011, lat, lon)
+            signals.append(-40 - 27 * math.log10(meters))
+        self.assertAlmostEqual(signal_distance(signals[0]), distance(52.5007, 13.4011, 52.5, 13.4))
+
+        multilateration = Multilateration(min_sensors=3)
+        multilateration.start()
+        now = time.time()
+        for num, ((lat, lon), signal) in enumerate(zip(sensors, signals)):
+            multilateration.add("00:12:2A:03:B9:12", (num, "uuid"), lat, lon, signal, now)
+            multilateration.add("11:22:33:44:55:66", (0, "uuid"), lat, lon, signal, now - 1000)
+        multilateration.add("22:33:44:55:66:77", (0, "uuid"), 52.5, 13.4, -50, now)
+        # contradicting signals, 1 meter away from sensors 300 meters apart
+        for num, (lat, lon) in enumerate(sensors):
+            multilateration.add("33:44:55:66:77:88", (num, "uuid"), lat, lon, -40, now)
+        self.assertEqual(multilateration.pending, {"00:12:2A:03:B9:12", "11:22:33:44:55:66", "33:44:55:66:77:88"})
+        self.assertTrue(multilateration.submit())
+        self.assertFalse(multilateration.submit())
+        results = []
+        while len(results) == 0:
+            time.sleep(0.01)
+            results = multilateration.get_results()
+        multilateration.stop()
+        self.assertEqual(len(results), 1)
+        mac, lat, lon = results[0]
+        self.assertEqual(mac, "00:12:2A:03:B9:12")
+        self.assertLess(distance(lat, lon, 52.5007, 13.4011), 0.1)
+
+        # a failing job is logged, its empty result clears busy and the worker keeps running
+        multilateration.start()
+        multilateration.busy = True
+        multilateration.jobs.put((["00:12:2A:03:B9:12"], None, None, None, None))
+        while multilateration.busy:
+            time.sleep(0.01)
+            self.assertEqual(multilateration.get_results(), [])
+        self.assertTrue(multilateration.thread.is_alive())
+        multilateration.add("00:12:2A:03:B9:12", (0, "uuid"), 52.5, 13.4, -50, time.time())
+        self.assertTrue(multilateration.submit())
+        results = []
+        while len(results) == 0:
+            time.sleep(0.01)
+            results = multilateration.get_results()
+        multilateration.stop()
+        self.assertEqual(results[0][0], "00:12:2A:03:B9:12")
+
+    def test_signal_history(self):
+        from kismon.history import SignalHistory
+        history = SignalHistory(seconds=10, max_sources=2, max_bytes=10 * 18 * 5)
+        for timestamp in range(100, 125):
+            history.add("00:12:2A:03:B9:12", (0, "a"), timestamp, -50 - timestamp % 10, timestamp * 2)
+        history.add("00:12:2A:03:B9:12", (0, "a"), 124, -40, 300)
+        values = history.get("00:12:2A:03:B9:12")[(0, "a")]
+        self.assertEqual(len(values), 10)
+        self.assertEqual(values[0], (115, -55, 230))
+        self.assertEqual(values[-1], (124, -40, 300))
+
+        history.add("00:12:2A:03:B9:12", (0, "b"), 120, -70, 1)
+        history.add("00:12:2A:03:B9:12", (1, "a"), 125, -60, 1)
+        self.assertEqual(sorted(history.get("00:12:2A:03:B9:12")), [(0, "a"), (1, "a")])
+        self.assertEqual(history.get("11:22:33:44:55:66"), {})
+
+        for num in range(5):
+            history.add("00:00:00:00:00:%02X" % num, (0, "a"), 100, -80, 1)
+        self.assertLessEqual(history.bytes, history.max_bytes)
+        self.assertNotIn("00:12:2A:03:B9:12", history)
+        self.assertIn("00:00:00:00:00:04", history)
+
+    def test_export_netxml(self):
+        from kismon.export import timestring, xml_escape, write_netxml
+        from kismon.store import NetworkStore, StoreSnapshot
+        for timestamp in (0, 1256375135, 1600000000, 1700000000.7, 4102444799):
+            self.assertEqual(timestring(timestamp), time.strftime("%a %b %d %H:%M:%S %Y", time.gmtime(timestamp)))
+        self.assertEqual(xml_escape("a<b>&c"), "a&lt;b&gt;&amp;c")
+
+        store = NetworkStore()
+        store["00:12:2A:03:B9:12"] = {"type": "infrastructure", "channel": 6, "firsttime": 1256375135,
+                                      "lasttime": 1256375200, "lat": 52.5, "lon": 13.4, "manuf": "A&B",
+                                      "ssid": "caf\u00e9 <1>", "cryptset": 0,
+                                      "signal_dbm": {"min": -80, "max": -50, "last": -60}}
+        store["11:22:33:44:55:66"] = {"type": "ad-hoc", "channel": 1, "firsttime": 1256375135,
+                                      "lasttime": 1256375135, "ssid": "", "cryptset": 2}
+        filename = "%s%stest-export-%s.netxml" % (tempfile.gettempdir(), os.sep, int(time.time()))
+        progress = []
+        write_netxml(filename, StoreSnapshot(store, ["11:22:33:44:55:66", "00:12:2A:03:B9:12", "FF:00:00:00:00:00"]),
+                     progress=lambda done, total: progress.append((done, total)), batch_size=1)
+        with open(filename, encoding="ISO-8859-1") as f:
+            data = f.read()
+        os.remove(filename)
+        self.assertEqual(progress, [(1, 3), (2, 3), (2, 3)])
+        self.assertTrue(data.endswith("</detection-run>"))
+        self.assertIn('<wireless-network number="1" type="infrastructure" first-time="Sat Oct 24 09:05:35 2009" '
+                      'last-time="Sat Oct 24 09:06:40 2009">', data)
+        self.assertIn("<essid cloaked=\"False\">caf\u00e9 &lt;1&gt;</essid>", data)
+        self.assertIn("<essid cloaked=\"True\"></essid>", data)
+        self.assertIn("<manuf>A&amp;B</manuf>", data)
+        self.assertIn("<max_signal_dbm>-50</max_signal_dbm>", data)
+        self.assertEqual(data.count("<gps-info>"), 1)
+
+    def test_export_kmz(self):
+        import zipfile
+        from kismon.export import write_kmz
+        from kismon.store import NetworkStore, StoreSnapshot
+        from kismon.tracks import Tracks
+
+        store = NetworkStore()
+        store["00:12:2A:03:B9:12"] = {"type": "infrastructure", "channel": 6, "firsttime": 1256375135,
+                                      "lasttime": 1256375200, "lat": 52.5, "lon": 13.4, "manuf": "",
+                                      "ssid": "a&b <1>", "cryptset": 0}
+        store["11:22:33:44:55:66"] = {"type": "infrastructure", "channel": 1, "firsttime": 1256375135,
+                                      "lasttime": 1256375135, "lat": 52.6, "lon": 13.5, "ssid": "x",
+                                      "cryptset": 2}
+        store["22:33:44:55:66:77"] = {"type": "infrastructure", "channel": 1, "firsttime": 1256375135,
+                                      "lasttime": 1256375135, "ssid": "no position", "cryptset": 0}
+        tracks = Tracks(None)
+        tracks.tracks = {"test": {"1256375135": (52.5, 13.4, 30), "1256375140": (52.51, 13.41, 31)}}
+        self.assertEqual(tracks.export_kml(False), "".join(tracks.iter_kml(False)))
+
+        filename = "%s%stest-export-%s.kmz" % (tempfile.gettempdir(), os.sep, int(time.time()))
+        progress = []
+        write_kmz(filename, StoreSnapshot(store), tracks=tracks.iter_kml(False), compresslevel=1,
+                  progress=lambda done, total: progress.append((done, total)), batch_size=1)
+        with zipfile.ZipFile(filename) as zip_input:
+            self.assertEqual(zip_input.namelist(), ["kismon.kml"])
+            self.assertEqual(zip_input.getinfo("kismon.kml").compress_type, zipfile.ZIP_DEFLATED)
+            data = zip_input.read("kismon.kml").decode()
+        os.remove(filename)
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        self.assertTrue(data.endswith("</Document>\r\n</kml>"))
+        self.assertEqual(data.count("<Folder>"), data.count("</Folder>"))
+        self.assertEqual(data.count("<Placemark><styleUrl>"), 2)
+        self.assertIn("<name>None: 1 APs</name>", data)
+        self.assertIn("<name>WPA2: 0 APs</name>", data)
+        self.assertIn("<name>a&amp;b &lt;1&gt;</name>", data)
+        self.assertIn(tracks.export_kml(False), data)
+        self.assertNotIn("no position", data)
+
+    def test_export_jobs(self):
+        from kismon.export import ExportJob, iter_csv, iter_json, iter_netxml
+        from kismon.store import NetworkStore, StoreSnapshot, load_networks_json
+
+        store = NetworkStore()
+        for num in range(10):
+            store["00:00:00:00:00:%02X" % num] = {"type": "infrastructure", "channel": 6, "firsttime": 1256375135,
+                                                  "lasttime": 1256375200, "lat": 52.5 if num % 2 else 0.0,
+                                                  "lon": 13.4 if num % 2 else 0.0, "ssid": "test;%s" % num,
+                                                  "cryptset": 0}
+        filename = "%s%stest-export-job-%s" % (tempfile.gettempdir(), os.sep, int(time.time()))
+
+        snapshot = StoreSnapshot(store)
+        job = ExportJob("kismon", filename, snapshot, iter_json(filename, snapshot, batch_size=3))
+        self.assertTrue(job.step())
+        self.assertEqual((job.done, job.total), (3, 10))
+        self.assertGreater(job.written, 0)
+        job.run()
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.fraction(), 1.0)
+        with open(filename) as f:
+            networks, schema = load_networks_json(f)
+        self.assertEqual(sorted(networks), sorted(store))
+
+        snapshot = StoreSnapshot(store)
+        job = ExportJob("mappoint csv", filename, snapshot, iter_csv(filename, snapshot, batch_size=4))
+        job.run()
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[1].split(";")[:3], ["52,5", "13,4", '"test 1"'])
+
+        # the partially written file is removed
+        snapshot = StoreSnapshot(store)
+        job = ExportJob("kismet netxml", filename, snapshot, iter_netxml(filename, snapshot, batch_size=2))
+        job.step()
+        self.assertTrue(os.path.isfile(filename))
+        job.cancel()
+        self.assertFalse(job.step())
+        self.assertEqual(job.state, "cancelled")
+        self.assertEqual(job.done, 2)
+        self.assertTrue(job.finished.is_set())
+        self.assertFalse(os.path.isfile(filename))
+
+        snapshot = StoreSnapshot(store)
+        job = ExportJob("kismet netxml", filename, snapshot,
+                        iter_netxml(os.path.join(filename, "missing", "test.netxml"), snapshot))
+        job.run()
+        self.assertEqual(job.state, "failed")
+        self.assertIsInstance(job.error, OSError)
+
+    @unittest.skipUnless(gi_available, "gi module not available")
+    def test_export_positions(self):
+        from kismon.config import Config
+        from kismon.networks import Networks
+        test_config = Config(None, logger=logger).default_config
+        networks = Networks(test_config, logger=logger)
+        for num in range(10):
+            networks.networks["00:00:00:00:00:%02X" % num] = {
+                "type": "infrastructure", "channel": 6, "firsttime": 1256375135, "lasttime": 1256375200,
+                "lat": 52.5 if num % 2 else 0.0, "lon": 13.4 if num % 2 else 0.0, "ssid": "test", "cryptset": 0}
+        filename = "%s%stest-export-positions-%s" % (tempfile.gettempdir(), os.sep, int(time.time()))
+
+        # only the networks with a position are written
+        job = networks.create_export_job("google earth kmz", filename, networks.networks, None, False)
+        self.assertEqual(job.total, 5)
+        job.run()
+        networks.release_snapshot(job.snapshot)
+        self.assertEqual(job.state, "done")
+
+        job = networks.create_export_job("mappoint csv", filename, networks.networks, None, False)
+        self.assertEqual(job.total, 5)
+        job.run()
+        networks.release_snapshot(job.snapshot)
+        os.remove(filename)
+
+    def test_import_pipeline(self):
+        from kismon.export import write_netxml
+        from kismon.importer import ImportPipeline, record_row, row_record
+        from kismon.store import NetworkRecord, NetworkStore, StoreSnapshot
+
+        record = NetworkRecord("infrastructure", 6, 1256375135, 1256375200, 52.5, 13.4, "A&B", "test", 2, "wep",
+                               comment="comment", servers=("http://127.0.0.1:2501",))
+        record.set_signal(-80, -50, -60)
+        self.assertEqual(row_record(record_row("00:12:2A:03:B9:12", record)), ("00:12:2A:03:B9:12", record))
+
+        store = NetworkStore()
+        for num in range(25):
+            store["00:00:00:00:00:%02X" % num] = {"type": "infrastructure", "channel": 6, "firsttime": 1256375135,
+                                                  "lasttime": 1256375200 + num, "lat": 52.5, "lon": 13.4,
+                                                  "ssid": "test %s" % num, "cryptset": 0,
+                                                  "signal_dbm": {"min": -80, "max": -50, "last": -60}}
+        prefix = "%s%stest-import-%s" % (tempfile.gettempdir(), os.sep, int(time.time()))
+        write_netxml(prefix + "-1.netxml", StoreSnapshot(store, sorted(store)[:15]))
+        write_netxml(prefix + "-2.netxml", StoreSnapshot(store, sorted(store)[10:]))
+        with open(prefix + ".csv", "w") as f:
+            f.write("Network;BSSID;\n1;00:00:00:00:00:01;\n")
+        files = [(prefix + "-1.netxml", "netxml"), (prefix + "-2.netxml", "netxml"), (prefix + ".csv", "csv"),
+                 (prefix + ".txt", "unknown")]
+
+        for workers in (0, 1):
+            networks = {}
+
+            def merge(mac, network):
+                new = mac not in networks
+                networks[mac] = network
+                return new
+
+            pipeline = ImportPipeline(files, merge, workers=workers, batch_size=4)
+            pipeline.run()
+            self.assertEqual([import_file.status for import_file in pipeline.files],
+                             ["done", "done", "failed", "skipped"])
+            self.assertEqual([import_file.networks for import_file in pipeline.files], [15, 15, 0, 0])
+            self.assertEqual(sum(import_file.new for import_file in pipeline.files), 25)
+            self.assertIsInstance(pipeline.files[2].error, KeyError)
+            self.assertEqual(sorted(networks), sorted(store))
+            self.assertEqual(networks["00:00:00:00:00:0C"].ssid, "test 12")
+            self.assertEqual(networks["00:00:00:00:00:0C"].signal_max, -50)
+        for filename, filetype in files[:3]:
+            os.remove(filename)
+
+    def test_netxml_reader(self):
+        import io
+        from kismon.importer import NetxmlReader, timestring2timestamp
+
+        for timestring in ("Sat Oct 24 09:05:35 2009", "Sat Oct 24 09:05:35 2009", "Thu Jan  1 00:00:00 2015",
+                           "Wed Jul 15 23:59:59 2020"):
+            self.assertEqual(timestring2timestamp(timestring), time.mktime(time.strptime(timestring)))
+        self.assertRaises(ValueError, timestring2timestamp, "Sat Foo 24 09:05:35 2009")
+
+        network = ('<wireless-network number="%s" type="infrastructure" first-time="Sat Oct 24 09:05:35 2009" '
+                   'last-time="Sat Oct 24 09:06:40 2009"><SSID><encryption>WEP</encryption>'
+                   '<essid cloaked="false">test %s</essid></SSID><BSSID>00:12:2A:03:B9:%02X</BSSID>'
+                   '<manuf>Unknown</manuf><channel>11</channel><snr-info><last_signal_dbm>-60</last_signal_dbm>'
+                   '<min_signal_dbm>-80</min_signal_dbm><max_signal_dbm>-50</max_signal_dbm></snr-info>'
+                   '<gps-info><peak-lat>52.5</peak-lat><peak-lon>13.4</peak-lon></gps-info>'
+                   '<wireless-client><channel>1</channel><SSID><essid>client</essid></SSID></wireless-client>'
+                   '</wireless-network>')
+        data = '<?xml version="1.0"?>\n<detection-run>%s</detection-run>' % "".join(
+            network % (num, num, num) for num in range(5))
+        batches = list(NetxmlReader(io.BytesIO(data.encode()), batch_size=2, chunk_size=100))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        mac, network = batches[2][0]
+        self.assertEqual(mac, "00:12:2A:03:B9:04")
+        self.assertEqual(network["ssid"], "test 4")
+        self.assertEqual(network["channel"], 11)
+        self.assertEqual(network["crypt"], "wep")
+        self.assertEqual((network["lat"], network["lon"]), (52.5, 13.4))
+        self.assertEqual(network["signal_dbm"], {"min": -80, "max": -50, "last": -60})
+        self.assertEqual(network["firsttime"], time.mktime(time.strptime("Sat Oct 24 09:05:35 2009")))
+
+    def test_import_formats(self):
+        import bz2
+        import gzip
+        import lzma
+        import shutil
+        import sqlite3
+        import simplejson as json
+        from kismon.export import write_netxml
+        from kismon.importer import ImportPipeline, guess_filetype, iter_file, parse_device, row_record
+        from kismon.store import NetworkRecord, NetworkStore, StoreSnapshot
+
+        self.assertEqual([guess_filetype(filename) for filename in (
+            "a.netxml", "a.netxml.gz", "A.CSV.XZ", "a.json", "a.kismet.bz2", "a.txt", "a.gz")],
+            ["netxml", "netxml", "csv", "networks", "kismet", "unknown", "unknown"])
+
+        store = NetworkStore()
+        for num in range(25):
+            store["00:00:00:00:00:%02X" % num] = NetworkRecord("infrastructure", 6, 1256375135, 1256375200 + num,
+                                                               52.5, 13.4, "", "test %s" % num, 0, "")
+        prefix = "%s%stest-formats-%s" % (tempfile.gettempdir(), os.sep, int(time.time()))
+        write_netxml(prefix + ".netxml", StoreSnapshot(store, sorted(store)))
+        files = [prefix + ".netxml"]
+        for extension, opener in ((".gz", gzip.open), (".bz2", bz2.open), (".xz", lzma.open)):
+            with open(prefix + ".netxml", "rb") as f, opener(prefix + ".netxml" + extension, "wb") as compressed:
+                shutil.copyfileobj(f, compressed)
+            files.append(prefix + ".netxml" + extension)
+        expected = [row for batch in iter_file("netxml", prefix + ".netxml") for row in batch]
+        self.assertEqual(len(expected), 25)
+        for filename in files[1:]:
+            batches = list(iter_file("netxml", filename, batch_size=10))
+            self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+            self.assertEqual([row for batch in batches for row in batch], expected)
+
+        # the devices table of a .kismet log has the full device json with the signal in its own dict
+        devices = [device for device in get_client_test_data()['dot11'] if device.get('dot11.device', 0) != 0]
+        connection = sqlite3.connect(prefix + ".kismet")
+        connection.execute("CREATE TABLE devices (first_time INT, last_time INT, devkey TEXT, phyname TEXT, "
+                           "devmac TEXT, type TEXT, device BLOB)")
+        for device in devices:
+            log_device = copy.deepcopy(device)
+            log_device['kismet.device.base.signal'] = {}
+            for key in list(log_device):
+                if key.startswith('kismet.common.signal.'):
+                    log_device['kismet.device.base.signal'][key] = log_device.pop(key)
+            connection.execute("INSERT INTO devices VALUES (0, 0, '', 'IEEE802.11', ?, 'Wi-Fi AP', ?)",
+                               (device['kismet.device.base.macaddr'], json.dumps(log_device).encode()))
+        connection.execute("INSERT INTO devices VALUES (0, 0, '', 'Bluetooth', '00:00:00:00:00:01', 'BTLE', '{}')")
+        connection.commit()
+        connection.close()
+        with open(prefix + ".kismet", "rb") as f, gzip.open(prefix + ".kismet.gz", "wb") as compressed:
+            shutil.copyfileobj(f, compressed)
+        expected = [parse_device(device) for device in devices]
+        for filename in (prefix + ".kismet", prefix + ".kismet.gz"):
+            networks = [row_record(row) for batch in iter_file("kismet", filename, batch_size=1) for row in batch]
+            self.assertEqual(networks, expected)
+
+        # networks files are read in chunks, the first batch comes before the broken end of the file
+        from kismon.store import SCHEMA_VERSION
+        networks = {}
+        for num in range(8000):
+            networks["00:00:00:00:%02X:%02X" % (num >> 8, num & 0xff)] = {
+                "type": "infrastructure", "channel": 6, "firsttime": 1256375135, "lasttime": 1256375200,
+                "lat": 52.5, "lon": 13.4, "manuf": "", "ssid": "test %s" % num, "cryptset": 0, "crypt": "none",
+                "signal_dbm": {"min": -80, "max": -50, "last": -60}, "comment": "", "servers": [], "codename": ""}
+        data = json.dumps({"schema": SCHEMA_VERSION, "networks": networks}).encode()
+        self.assertGreater(len(data), 2 * 1024 * 1024)
+        with gzip.open(prefix + ".json.gz", "wb") as f:
+            f.write(data)
+        self.assertEqual(sum(len(batch) for batch in iter_file("networks", prefix + ".json.gz")), 8000)
+        with open(prefix + ".json", "wb") as f:
+            f.write(data[:-100])
+        batches = iter_file("networks", prefix + ".json", batch_size=100)
+        batch = next(batches)
+        self.assertEqual(len(batch), 100)
+        self.assertEqual(row_record(batch[0])[1].ssid, "test 0")
+        self.assertRaises(ValueError, list, batches)
+        os.remove(prefix + ".json")
+        os.remove(prefix + ".json.gz")
+
+        # a worker has to wait for the main loop when the queue is full
+        networks = {}
+
+        def merge(mac, network):
+            new = mac not in networks
+            networks[mac] = network
+            return new
+
+        import_files = [(filename, "netxml") for filename in files[1:]] + [(prefix + ".kismet.gz", "kismet")]
+        pipeline = ImportPipeline(import_files, merge, workers=1, batch_size=2, queue_size=1)
+        pipeline.run()
+        self.assertEqual([import_file.status for import_file in pipeline.files], ["done"] * 4)
+        self.assertEqual([import_file.networks for import_file in pipeline.files], [25, 25, 25, len(devices)])
+        self.assertEqual(len(networks), 25 + len(set(mac for mac, network in expected)))
+        for filename in files + [prefix + ".kismet", prefix + ".kismet.gz"]:
+            os.remove(filename)
+
+    def test_session_tracker(self):
+        from kismon.store import SessionTracker
+        session = SessionTracker()
+        self.assertTrue(session.add("11:22:33:44:55:66", 0))
+        self.assertTrue(session.add("22:33:44:55:66:77"))
+        self.assertFalse(session.add("11:22:33:44:55:66", 0))
+        self.assertFalse(session.add("11:22:33:44:55:66", 1))
+        self.assertTrue(session.add("33:44:55:66:77:88", 1))
+        self.assertIn("22:33:44:55:66:77", session)
+        self.assertEqual(len(session), 3)
+        self.assertEqual(list(session), ["11:22:33:44:55:66", "22:33:44:55:66:77", "33:44:55:66:77:88"])
+        self.assertEqual(session.latest(2), ["33:44:55:66:77:88", "22:33:44:55:66:77"])
+        self.assertEqual(session.servers("11:22:33:44:55:66"), (0, 1))
+        self.assertEqual(session.server_counts, {0: 1, 1: 2})
+        self.assertLessEqual(session.first_seen("11:22:33:44:55:66"), session.first_seen("33:44:55:66:77:88"))
+        session.clear()
+        self.assertEqual(len(session), 0)
+
+    def test_notify_scheduler(self):
+        from kismon.scheduler import NotifyScheduler
+        scheduler = NotifyScheduler()
+        scheduler.set_budget(10)
+        self.assertEqual(scheduler.budget, 0.01)
+        deadline = scheduler.start_slice()
+        self.assertEqual(scheduler.batch_size(deadline), 1)
+        scheduler.measure(100, 0.001)
+        self.assertAlmostEqual(scheduler.item_cost, 0.00001)
+        self.assertGreater(scheduler.batch_size(deadline), 1)
+        self.assertLessEqual(scheduler.batch_size(deadline), 1000)
+        self.assertEqual(scheduler.batch_size(deadline - 1), 0)
+        self.assertAlmostEqual(scheduler.drain_time(1000), 0.01)
+        scheduler.measure(100, 0.002)
+        self.assertAlmostEqual(scheduler.item_cost, 0.000012)
+
+        self.assertEqual(scheduler.latency_percentiles(), {})
+        for latency in range(100):
+            scheduler.latencies.append(latency)
+        latency = scheduler.latency_percentiles()
+        self.assertEqual(latency[50], 50)
+        self.assertEqual(latency[99], 99)
+
+    def test_sqlstore(self):
+        from kismon.sqlstore import SQLiteNetworkStore, migrate_json
+        from kismon.store import NetworkRecord, NetworkQuery
+        tmp_dir = tempfile.mkdtemp()
+        json_file = os.path.join(tmp_dir, "networks.json")
+        db_file = os.path.join(tmp_dir, "networks.db")
+        with open(json_file, "w") as f:
+            f.write('{"11:22:33:44:55:66": {"type": "infrastructure", "lasttime": 1500000000, "cryptset": 0, '
+                    '"ssid": "open", "lat": 52.5, "lon": 13.4, "signal_dbm": {"min": -80, "max": -50, "last": -60}},'
+                    '"22:33:44:55:66:77": {"type": "probe", "lasttime": 1500000100, "cryptset": 706, "ssid": "wpa"}}')
+        self.assertEqual(migrate_json(json_file, db_file, logger), 2)
+
+        store = SQLiteNetworkStore(db_file)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store["11:22:33:44:55:66"]["signal_dbm"]["last"], -60)
+        self.assertEqual(store["22:33:44:55:66:77"].type, "unknown")
+        self.assertEqual(store["22:33:44:55:66:77"].crypt, "WPA,PSK,AES_CCM")
+        self.assertNotIn("33:44:55:66:77:88", store)
+
+        store["33:44:55:66:77:88"] = NetworkRecord(network_type="client", ssid="new", cryptset=2, lasttime=1500000200)
+        store.touch("11:22:33:44:55:66")
+        store["11:22:33:44:55:66"].ssid = "changed"
+        self.assertEqual(store.flush(), 2)
+        self.assertEqual(len(store), 3)
+
+        self.assertEqual(sorted(store.select_macs(NetworkQuery())), sorted(store.keys()))
+        self.assertEqual(store.select_macs(NetworkQuery(has_position=True)), ["11:22:33:44:55:66"])
+        self.assertEqual(store.select_macs(NetworkQuery(excluded_crypts=("none", "wpa2"))), ["33:44:55:66:77:88"])
+        self.assertEqual(store.select_macs(NetworkQuery(ssid_regexpr="^ch")), ["11:22:33:44:55:66"])
+        self.assertEqual(store.select_macs(NetworkQuery(bssid_regexpr="^22:33")), ["22:33:44:55:66:77"])
+        self.assertEqual(sorted(store.select_macs(NetworkQuery(lasttime_min=1500000100))),
+                         ["22:33:44:55:66:77", "33:44:55:66:77:88"])
+        query = NetworkQuery(bbox=(52.0, 13.0, 53.0, 14.0))
+        self.assertEqual(store.select_macs(query), ["11:22:33:44:55:66"])
+        self.assertTrue(query.matches("11:22:33:44:55:66", store["11:22:33:44:55:66"]))
+        self.assertFalse(query.matches("33:44:55:66:77:88", store["33:44:55:66:77:88"]))
+        store.close()
+
+        store = SQLiteNetworkStore(db_file)
+        self.assertEqual(store["11:22:33:44:55:66"].ssid, "changed")
+        self.assertEqual(store.to_dict(["33:44:55:66:77:88"])["33:44:55:66:77:88"]["ssid"], "new")
+        store.close()
+
+    @unittest.skipUnless(gi_available and numpy_available, "gi or numpy module not available")
+    def test_observation_seed(self):
+        from kismon.config import Config
+        from kismon.networks import Networks
+        from kismon.store import NetworkRecord
+        test_config = Config(None, logger=logger).default_config
+        networks = Networks(test_config, logger=logger)
+        self.assertIsNotNone(networks.observations)
+        mac = "00:12:2A:03:B9:12"
+
+        def record(lasttime, lat, signal):
+            network = NetworkRecord("infrastructure", 6, 1256375135, lasttime, lat, 13.4, "", "test", 0, "")
+            network.set_signal(signal, signal, signal)
+            return network
+
+        # loaded from an earlier session, seen with -30dBm at its stored position
+        networks.networks[mac] = record(1256375200, 52.5, -30)
+        networks.merge_device(mac, record(1256375300, 52.6, -95), 'http://127.0.0.1:2501')
+        networks.update_locations([mac])
+        self.assertAlmostEqual(networks.get_network(mac).lat, 52.5, places=5)
+        self.assertEqual(len(networks.observations.observations(mac)), 2)
+
+        # estimates which were never displayed or exported are written by save()
+        from kismon.journal import NetworksJournal
+        filename = "%s%stest-observations-%s.json" % (tempfile.gettempdir(), os.sep, int(time.time()))
+        networks.save(filename)
+        lat = networks.get_network(mac).lat
+        networks.merge_device(mac, record(1256375400, 52.6, -30), 'http://127.0.0.1:2501')
+        self.assertEqual(networks.get_network(mac).lat, lat)
+        networks.save(filename)
+        journal = [network for journal_mac, network in NetworksJournal(filename, logger=logger).replay()]
+        self.assertEqual(len(journal), 1)
+        self.assertAlmostEqual(journal[0]["lat"], 52.55, places=5)
+        for suffix in ("", ".journal"):
+            if os.path.isfile(filename + suffix):
+                os.remove(filename + suffix)
+
+    @unittest.skipUnless(gi_available, "gi module not available")
+    def test_add_network_data(self):
+        from kismon.config import Config
+        from kismon.networks import Networks
+        from kismon.store import NetworkRecord
+        test_config = Config(None, logger=logger).default_config
+        networks = Networks(test_config, logger=logger)
+        networks.notify_add_list["map"] = lambda mac, changes: None
+        mac = "00:12:2A:03:B9:12"
+
+        def record(lasttime, lat, signal=None):
+            network = NetworkRecord("infrastructure", 6, 1256375135, lasttime, lat, 13.4, "", "test", 0, "")
+            if signal is not None:
+                network.set_signal(*signal)
+            return network
+
+        networks.add_network_data(mac, record(1256375200, 52.5, (-80, -50, -60)))
+        # newer data: min and max are widened, last is taken, the stronger signal moves the network
+        networks.notify_add_queue = {}
+        networks.add_network_data(mac, record(1256375300, 52.6, (-90, -40, -70)))
+        network = networks.get_network(mac)
+        self.assertEqual((network.signal_min, network.signal_max, network.signal_last), (-90, -40, -70))
+        self.assertEqual(network.lat, 52.6)
+        self.assertIn(mac, networks.notify_add_queue)
+        # older data: last and the position are kept
+        networks.add_network_data(mac, record(1256375250, 52.7, (-95, -45, -30)))
+        network = networks.get_network(mac)
+        self.assertEqual((network.signal_min, network.signal_max, network.signal_last), (-95, -40, -70))
+        self.assertEqual(network.lat, 52.6)
+        # data without signal leaves the signal alone, the subscribers are still notified
+        networks.notify_add_queue = {}
+        networks.add_network_data(mac, record(1256375400, 52.8))
+        network = networks.get_network(mac)
+        self.assertEqual((network.signal_min, network.signal_max, network.signal_last), (-95, -40, -70))
+        self.assertIn(mac, networks.notify_add_queue)
+
+        # a network without signal takes the signal and the position of the data
+        other = "00:12:2A:03:B9:13"
+        networks.add_network_data(other, record(1256375200, 52.5))
+        networks.add_network_data(other, record(1256375100, 52.9, (-85, -55, -65)))
+        network = networks.get_network(other)
+        self.assertEqual((network.signal_min, network.signal_max, network.signal_last), (-85, -55, -65))
+        self.assertEqual(network.lat, 52.9)
+
+    @unittest.skipUnless(gi_available, "gi module not available")
+    def test_save_force(self):
+        from kismon.config import Config
+        from kismon.journal import NetworksJournal
+        from kismon.networks import Networks
+        test_config = Config(None, logger=logger).default_config
+        networks = Networks(test_config, logger=logger)
+        networks.notify_add_list["map"] = lambda mac: None
+        for device in get_client_test_data()['dot11']:
+            networks.add_device_data(device, server_id=0)
+        filename = "%s%stest-save-%s.json" % (tempfile.gettempdir(), os.sep, int(time.time()))
+        networks.save(filename)
+
+        mac = list(networks.networks)[0]
+        networks.edit_network(mac, {"comment": "changed"})
+
+        def failing_journal(journal, changed):
+            raise OSError("disk full")
+
+        # the background save fails and its idle callback has not run before the forced save at quit
+        networks.save_journal = failing_journal
+        networks.save(filename, background=True)
+        del networks.save_journal
+        networks.save(filename, force=True)
+        self.assertEqual(networks.changed_networks, set())
+        self.assertIsNone(networks.save_thread)
+        self.assertEqual([network["comment"] for journal_mac, network in
+                          NetworksJournal(filename, logger=logger).replay() if journal_mac == mac], ["changed"])
+        networks.finish_save()
+        self.assertEqual(networks.changed_networks, set())
+        for suffix in ("", ".journal"):
+            if os.path.isfile(filename + suffix):
+                os.remove(filename + suffix)
+
+    @unittest.skipUnless(gi_available, "gi module not available")
+    def test_filter_delta_queue(self):
+        from kismon.config import Config
+        from kismon.networks import Networks
+        from kismon.store import NetworkRecord
+        test_config = Config(None, logger=logger).default_config
+        test_config["filter_networks"]["map"] = "all"
+        networks = Networks(test_config, logger=logger)
+        networks.notify_add_list["map"] = lambda mac: None
+        networks.notify_remove_list["map"] = lambda mac: None
+        test_config["filter_type"]["ad-hoc"] = True
+        networks.apply_filters()
+        for num, network_type in enumerate(("infrastructure", "infrastructure", "ad-hoc")):
+            networks.networks["00:00:00:00:00:%02X" % num] = NetworkRecord(
+                network_type, 6, 1256375135, 1256375200, 52.5, 13.4, "", "test", 0, "")
+        networks.notify_add_batch(list(networks.networks))
+        self.assertEqual(len(networks.notify_add_order), 3)
+
+        # a hidden network leaves the queue and its order, shown again it is queued once
+        test_config["filter_type"]["ad-hoc"] = False
+        networks.apply_filters()
+        self.assertEqual(set(networks.notify_add_queue), {"00:00:00:00:00:00", "00:00:00:00:00:01"})
+        self.assertEqual([mac for mac, queued in networks.notify_add_order], ["00:00:00:00:00:00", "00:00:00:00:00:01"])
+        test_config["filter_type"]["ad-hoc"] = True
+        networks.apply_filters()
+        self.assertEqual([mac for mac, queued in networks.notify_add_order],
+                         ["00:00:00:00:00:00", "00:00:00:00:00:01", "00:00:00:00:00:02"])
+
+    @unittest.skipUnless(gi_available, "gi module not available")
+    def test_add_devices(self):
+        from kismon.config import Config
+        from kismon.networks import Networks
+        test_config = Config(None, logger=logger).default_config
+        test_config['servers'] = [{'uri': 'http://127.0.0.1:2501'}]
+        devices = get_client_test_data()['dot11']
+        dot11_devices = [device for device in devices if device.get('dot11.device', 0) != 0]
+
+        from kismon.networks import parse_device
+        from kismon.store import CHANGE_POSITION, CHANGE_SIGNAL, CHANGE_SSID, CHANGE_LASTTIME
+
+        networks = Networks(test_config, logger=logger)
+        networks.notify_add_list["map"] = lambda mac, changes: None
+        networks.notify_remove_list["map"] = lambda mac: None
+        networks.notify_add_fields["map"] = CHANGE_POSITION
+        counters = networks.add_devices(devices, 0)
+        self.assertEqual(counters, {"new": len(dot11_devices), "updated": 0, "unchanged": 0})
+        self.assertEqual(len(networks.session), len(dot11_devices))
+        queued = networks.notify_counters["queued"]
+        networks.notify_add_queue = {}
+        counters = networks.add_devices(devices, 0)
+        self.assertEqual(counters, {"new": 0, "updated": 0, "unchanged": len(dot11_devices)})
+        self.assertEqual(networks.notify_counters["unchanged"], len(dot11_devices))
+        self.assertEqual(networks.notify_counters["queued"], queued)
+        self.assertEqual(networks.notify_add_queue, {})
+
+        device = copy.deepcopy(dot11_devices[0])
+        mac = device['kismet.device.base.macaddr']
+        device['kismet.device.base.last_time'] += 10
+        device['dot11.device']['dot11.device.advertised_ssid_map'][0]['dot11.advertisedssid.ssid'] = "changed"
+        self.assertEqual(networks.merge_device(mac, parse_device(device)[1], 'http://127.0.0.1:2501'),
+                         CHANGE_SSID | CHANGE_LASTTIME)
+        device['kismet.device.base.last_time'] += 10
+        suppressed = networks.notify_counters["suppressed"]
+        counters = networks.add_devices([device], 0)
+        self.assertEqual(counters["updated"], 1)
+        self.assertEqual(networks.notify_counters["suppressed"], suppressed + 1)
+
+        device['kismet.device.base.last_time'] += 10
+        device['kismet.common.signal.max_signal'] = networks.get_network(mac).signal_max + 5
+        self.assertEqual(networks.merge_device(mac, parse_device(device)[1], 'http://127.0.0.1:2501'),
+                         CHANGE_SIGNAL | CHANGE_LASTTIME)
+        self.assertEqual(networks.get_network(mac).signal_max, device['kismet.common.signal.max_signal'])
+        if networks.observations is not None:
+            for lat, signal in ((52.5, -40), (52.6, -50)):
+                device['kismet.device.base.last_time'] += 10
+                device['kismet.common.signal.last_signal'] = signal
+                device['kismet.device.base.location'] = {
+                    'kismet.common.location.loc_fix': 3,
+                    'kismet.common.location.avg_loc': {'kismet.common.location.geopoint': [13.4, lat]}}
+                changes = networks.merge_device(mac, parse_device(device)[1], 'http://127.0.0.1:2501')
+            self.assertEqual(changes & CHANGE_POSITION, CHANGE_POSITION)
+            self.assertEqual(networks.get_network(mac).lat, 52.5)
+            self.assertEqual(networks.update_locations([mac]), [mac])
+            self.assertAlmostEqual(networks.get_network(mac).lat, 52.5 + 0.1 / 11)
+
+            # an export moves the network to the new estimate, the map is notified
+            device['kismet.device.base.last_time'] += 10
+            device['kismet.device.base.location']['kismet.common.location.avg_loc'][
+                'kismet.common.location.geopoint'] = [13.4, 52.7]
+            networks.merge_device(mac, parse_device(device)[1], 'http://127.0.0.1:2501')
+            networks.notify_add_queue = {}
+            export_file = "%s%stest-export-%s.json" % (tempfile.gettempdir(), os.sep, int(time.time()))
+            networks.export_networks("kismon", export_file, [mac])
+            os.remove(export_file)
+            self.assertGreater(networks.get_network(mac).lat, 52.5 + 0.1 / 11)
+            self.assertEqual(networks.notify_add_queue.get(mac), {"map": CHANGE_POSITION})
+
+        batches = []
+        networks.notify_add_batch_list["map"] = lambda macs, records, changes: batches.append((macs, records))
+        networks.apply_filters_on_networks()
+        queued = set(networks.notify_add_queue)
+        self.assertNotEqual(len(queued), 0)
+        task = networks.notify_add_queue_process()
+        while next(task):
+            continue
+        self.assertEqual(set(mac for macs, records in batches for mac in macs), queued)
+        for macs, records in batches:
+            for batch_mac, record in zip(macs, records):
+                self.assertIs(record, networks.get_network(batch_mac))
+        self.assertEqual(networks.get_network(mac).ssid, "changed")
+        self.assertEqual(networks.get_network(mac).servers, ('http://127.0.0.1:2501',))
+
     @unittest.skipUnless(gi_available, "gi module not available")
     def test_core(self):
         from kismon.core import Core
@@ -247,7 +1209,6 @@ class TestKismon(unittest.TestCase):
         test_tracks = Tracks(tmp_tracks_file)
         main_window = MainWindow(test_config, dummy, dummy, test_map, test_networks, test_tracks, {0: None, 1: None},
                                  test_client_threads, logger=logger)
-        main_window.network_list.crypt_cache = {}
 
         for x in range(1, 202):
             main_window.log_list.add("Kismon", "test %s" % x)
@@ -445,6 +1406,11 @@ class TestKismon(unittest.TestCase):
         test_map.change_source("openstreetmap")
         test_map.change_source("opencyclemap")
         test_map.remove_marker("333")
+        test_map.add_markers([("555", "red", 52.509, 13.32), ("666", "green", 52.509, 13.32),
+                              ("444", "green", 52.509, 13.32)])
+        self.assertEqual(test_map.coordinates[52.509][13.32]["markers"], ["555", "666", "444"])
+        self.assertEqual(test_map.coordinates[52.509][13.32]["color"], "red")
+        self.assertEqual(test_map.coordinates[52.511][13.322], {"markers": [], "color": None})
 
         test_map.add_track(52.513, 13.323, 'server1', color=(0, 16621, 19455))
         test_map.add_track(52.510, 13.321, 'server1')
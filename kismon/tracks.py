@@ -88,27 +88,49 @@ class Tracks:
         return sessions
 
     def export_kml(self, export_filter):
+        return "".join(self.iter_kml(export_filter))
+
+    def iter_kml(self, export_filter):
+        """KML of the tracks in chunks, a placemark per session
+
+        The points are read without copying the tracks, the track list and
+        the timestamps of a track are taken once, so points added meanwhile
+        from the main loop are skipped.
+        """
         if export_filter == 'current':
             filter_time = self.starttime
         else:
             filter_time = 0
-        output = ["<Folder><name>Tracks</name>"]
-        sessions = self.group_to_sessions(filter_time)
-        time_format = "%a %b %d %H:%M:%S %Y"
-        for track_name in sessions:
-            output.append("<Folder><name>%s</name>" % track_name)
-            for session_start in sessions[track_name]:
-                output.append(
-                    "<Placemark><Style><LineStyle><color>7f00ff00</color><width>3</width></LineStyle></Style><LineString><coordinates>\n")
-                for timestamp in sessions[track_name][session_start]:
-                    lat, lon, alt = sessions[track_name][session_start][timestamp]
-                    output.append("%s,%s \n" % (lon, lat))
-                output.append("</coordinates></LineString>")
-
-                output.append("<name>Session %s - %s</name></Placemark>\n" % (
-                    time.strftime(time_format, time.gmtime(session_start)),
-                    time.strftime(time_format, time.gmtime(timestamp)),
-                ))
-            output.append("</Folder>")
-        output.append("</Folder>")
-        return "".join(output)
+        timeout = 600
+        yield "<Folder><name>Tracks</name>"
+        for track_name in list(self.tracks):
+            track = self.tracks[track_name]
+            yield "<Folder><name>%s</name>" % track_name
+            timestamps = sorted(int(timestamp) for timestamp in list(track))
+            points = []
+            session_start = 0
+            previous_timestamp = 0
+            for timestamp in timestamps:
+                if timestamp < filter_time:
+                    continue
+                if timestamp - previous_timestamp > timeout:
+                    if len(points) > 0:
+                        yield kml_session(points, session_start, previous_timestamp)
+                    points = []
+                    session_start = timestamp
+                lat, lon, alt = track[str(timestamp)]
+                points.append("%s,%s \n" % (lon, lat))
+                previous_timestamp = timestamp
+            if len(points) > 0:
+                yield kml_session(points, session_start, previous_timestamp)
+            yield "</Folder>"
+        yield "</Folder>"
+
+
+def kml_session(points, session_start, session_end):
+    time_format = "%a %b %d %H:%M:%S %Y"
+    return "<Placemark><Style><LineStyle><color>7f00ff00</color><width>3</width></LineStyle></Style>" \
+           "<LineString><coordinates>\n%s</coordinates></LineString><name>Session %s - %s</name></Placemark>\n" % (
+               "".join(points),
+               time.strftime(time_format, time.gmtime(session_start)),
+               time.strftime(time_format, time.gmtime(session_end)))
@@ -78,7 +78,8 @@ class FilterTab:
             label.set_property("xalign", 0)
             limiter_grid.attach(label, x, y, 1, 1)
 
-            for text, value in (('Disable', 'none'), ('Only current session', 'current'), ('All Networks', 'all')):
+            for text, value in (('Disable', 'none'), ('Only current session', 'current'),
+                                ('Last N minutes', 'recent'), ('All Networks', 'all')):
                 x += 1
                 if y == 1:
                     label = Gtk.Label(label=text)
@@ -101,6 +102,18 @@ class FilterTab:
             y += 1
         y = 0
 
+        hbox = Gtk.Box()
+        label = Gtk.Label(label="N minutes: ")
+        hbox.pack_start(label, False, False, 0)
+        field = Gtk.SpinButton()
+        field.set_numeric(True)
+        field.set_increments(1, 10)
+        field.set_range(1, 99999)
+        field.set_value(self.config["filter_recent"]["minutes"])
+        field.connect("value-changed", self.on_recent_minutes)
+        hbox.pack_start(field, False, False, 0)
+        limiter_grid.attach(hbox, 0, 4, 5, 1)
+
     def add_regex_filters(self, main_x, main_y):
         frame = Gtk.Frame()
         frame.set_label("Regular expression")
@@ -137,6 +150,10 @@ class FilterTab:
         self.config["filter_networks"][key] = value
         self.apply()
 
+    def on_recent_minutes(self, widget):
+        self.config["filter_recent"]["minutes"] = widget.get_value_as_int()
+        self.apply()
+
     def on_regex_changed(self, widget, key):
         text = widget.get_text()
         if text == self.config["filter_regexpr"][key]:
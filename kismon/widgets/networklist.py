@@ -4,8 +4,15 @@ from gi.repository import GObject
 from gi.repository import GLib
 
 import kismon.utils as utils
+from kismon.store import CHANGE_ALL, CHANGE_TYPE, CHANGE_SSID, CHANGE_CHANNEL, CHANGE_CRYPT, CHANGE_FIRSTTIME, \
+    CHANGE_LASTTIME, CHANGE_POSITION, CHANGE_SIGNAL, CHANGE_SERVERS
 from kismon.windows.editnet import EditNetWindow
 
+# columns of the list store which show the changed fields
+change_columns = ((CHANGE_TYPE, (1,)), (CHANGE_SSID, (2,)), (CHANGE_CHANNEL, (3,)), (CHANGE_CRYPT, (4,)),
+                  (CHANGE_FIRSTTIME, (5,)), (CHANGE_LASTTIME, (6,)), (CHANGE_POSITION, (7, 8)),
+                  (CHANGE_SIGNAL, (9, 12)), (CHANGE_SERVERS, (11,)))
+
 class NetworkList:
     def __init__(self, networks, locate_network_on_map, on_signal_graph, config):
         self.network_lines = {}
@@ -20,6 +27,9 @@ class NetworkList:
             self.value_cache[key] = {}
 
         self.networks.notify_add_list["network_list"] = self.add_network
+        self.networks.notify_add_fields["network_list"] = CHANGE_ALL
+        self.networks.notify_add_batch_list["network_list"] = self.add_networks
+        self.changed_columns = {}
         self.networks.notify_remove_list["network_list"] = self.remove_network
         self.networks.disable_refresh_functions.append(self.pause)
         self.networks.resume_refresh_functions.append(self.resume)
@@ -154,9 +164,7 @@ class NetworkList:
         # After the dialog exits, grab the user inputs
         if response == Gtk.ResponseType.OK:
             result = dialog.get_result()
-            network = self.networks.get_network(self.network_selected)
-            network['comment'] = result['comment']
-            network['codename'] = result['codename']
+            self.networks.edit_network(self.network_selected, result)
             self.add_network(self.network_selected)
         
         dialog.destroy()
@@ -295,8 +303,35 @@ class NetworkList:
         else:
             return value
 
-    def add_network(self, mac):
-        network = self.networks.get_network(mac)
+    def get_changed_columns(self, changes):
+        try:
+            return self.changed_columns[changes]
+        except KeyError:
+            pass
+        columns = []
+        for change, change_cols in change_columns:
+            if changes & change:
+                columns.extend(change_cols)
+        self.changed_columns[changes] = columns
+        return columns
+
+    def add_network(self, mac, changes=CHANGE_ALL):
+        if self.set_network_line(mac, self.networks.get_network(mac), changes):
+            self.stick_to_top()
+
+    def add_networks(self, macs, networks, changes):
+        """Batch version of add_network, the arguments are lists with one item per network
+        """
+        added = False
+        for num, mac in enumerate(macs):
+            if self.set_network_line(mac, networks[num], changes[num]):
+                added = True
+        if added:
+            self.stick_to_top()
+
+    def set_network_line(self, mac, network, changes):
+        """Add or update the row of a network, returns True if a row was added
+        """
 
         """ The Gtk.ListStore will convert every Python-type value to its
         GObject equivalent. Most of the prepare_network_* functions cache
@@ -305,34 +340,34 @@ class NetworkList:
         an zero size string, so we replace it where possible.
         """
 
-        if "signal_dbm" not in network or len(network["signal_dbm"]) != 3:
+        if network.signal_last is None:
             signal = 0
         else:
-            signal = network["signal_dbm"]["last"]
+            signal = network.signal_last
         signal, signal_strength = self.prepare_network_signal(signal)
 
-        if network['comment'] == '':
+        if network.comment == '':
             comment = None
         else:
-            comment = network['comment']
+            comment = network.comment
 
-        if network['codename'] == '':
+        if network.codename == '':
             codename = None
         else:
-            codename = network['codename']
+            codename = network.codename
 
         line = [mac,
-                self.prepare_network_type(network["type"]),
-                self.prepare_network_ssid(network["ssid"]),
-                self.prepare_network_channel(network["channel"]),
-                self.prepare_network_crypt(network["crypt"]),
-                self.prepare_network_time(network["firsttime"]),
-                self.prepare_network_time(network["lasttime"]),
-                self.prepare_network_coordinate(network["lat"]),
-                self.prepare_network_coordinate(network["lon"]),
+                self.prepare_network_type(network.type),
+                self.prepare_network_ssid(network.ssid),
+                self.prepare_network_channel(network.channel),
+                self.prepare_network_crypt(network.crypt),
+                self.prepare_network_time(network.firsttime),
+                self.prepare_network_time(network.lasttime),
+                self.prepare_network_coordinate(network.lat),
+                self.prepare_network_coordinate(network.lon),
                 signal,
                 comment,
-                self.prepare_network_servers(network["servers"]),
+                self.prepare_network_servers(network.servers),
                 signal_strength,
                 codename
                 ]
@@ -344,21 +379,27 @@ class NetworkList:
 
         if mac in self.network_iter:
             network_iter = self.network_iter[mac]
-            num = 0
-            for value in line:
-                if old_line is not None and old_line.pop(0) == value:
-                    num += 1
+            if old_line is None or changes == CHANGE_ALL:
+                columns = range(len(line))
+            else:
+                columns = self.get_changed_columns(changes)
+            for num in columns:
+                value = line[num]
+                if old_line is not None and old_line[num] == value:
                     continue
                 self.store.set_value(network_iter, num, value)
-                num += 1
-        else:
-            self.network_iter[mac] = self.store.append(line)
+            return False
 
-            # stick to the top of the table after adding a new row
-            adj = self.scrolled_window.get_vadjustment()
-            self.scroll_value = int(adj.get_value())
-            if self.scroll_value == 0:
-                GLib.idle_add(self.treeview.scroll_to_point, -1, 0)
+        self.network_iter[mac] = self.store.append(line)
+        return True
+
+    def stick_to_top(self):
+        """Stay at the top of the table after adding new rows
+        """
+        adj = self.scrolled_window.get_vadjustment()
+        self.scroll_value = int(adj.get_value())
+        if self.scroll_value == 0:
+            GLib.idle_add(self.treeview.scroll_to_point, -1, 0)
 
     def remove_network(self, mac):
         try:
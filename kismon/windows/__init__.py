@@ -1,6 +1,7 @@
 from .channel import ChannelWindow
 from .config import ConfigWindow
 from .datasources import DatasourcesWindow
+from .export import ExportWindow
 from .fileimport import FileImportWindow
 from .signal import SignalWindow
 from .map import MapWindow
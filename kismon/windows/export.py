@@ -0,0 +1,94 @@
+"""
+Copyright (c) 2010, Patrick Salecker
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    * Redistributions of source code must retain the above copyright notice,
+      this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright notice,
+      this list of conditions and the following disclaimer in
+      the documentation and/or other materials provided with the distribution.
+    * Neither the name of the author nor the names of its
+      contributors may be used to endorse or promote products derived
+      from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from gi.repository import Gtk
+from gi.repository import GLib
+
+
+class ExportWindow:
+    """Progress of the running exports, each one can be cancelled
+    """
+    def __init__(self, parent):
+        self.jobs = {}
+        self.gtkwin = Gtk.Window()
+        self.gtkwin.set_title("Kismon: Exports")
+        self.gtkwin.set_position(Gtk.WindowPosition.CENTER)
+        self.gtkwin.set_default_size(500, 30)
+        self.gtkwin.set_border_width(5)
+        self.gtkwin.set_transient_for(parent)
+        self.gtkwin.connect("destroy", self.on_destroy)
+
+        self.job_list = Gtk.VBox()
+        self.gtkwin.add(self.job_list)
+        self.gtkwin.show_all()
+        self.timeout = GLib.timeout_add(250, self.update)
+
+    def add_job(self, job):
+        table = Gtk.Table(n_columns=2)
+        label = Gtk.Label(label="%s: %s" % (job.name, job.filename))
+        label.set_property("xalign", 0)
+        table.attach(label, 0, 2, 0, 1, yoptions=Gtk.AttachOptions.SHRINK)
+
+        progress_bar = Gtk.ProgressBar()
+        progress_bar.set_show_text(True)
+        table.attach(progress_bar, 0, 1, 1, 2, yoptions=Gtk.AttachOptions.SHRINK)
+
+        button = Gtk.Button.new_with_label("Cancel")
+        button.connect("clicked", self.on_cancel, job)
+        table.attach(button, 1, 2, 1, 2, yoptions=Gtk.AttachOptions.SHRINK,
+                     xoptions=Gtk.AttachOptions.SHRINK, xpadding=5)
+
+        self.job_list.pack_start(table, expand=False, fill=False, padding=2)
+        table.show_all()
+        self.jobs[job] = (table, progress_bar, button)
+        self.update_job(job)
+
+    def update_job(self, job):
+        table, progress_bar, button = self.jobs[job]
+        if job.is_running():
+            progress_bar.set_text("%s%%, %s/%s networks, %.1fMB" % (
+                round(job.fraction() * 100, 1), job.done, job.total, job.written / 1024 / 1024))
+        else:
+            progress_bar.set_text("%s, %s networks, %.1fMB in %.1fsec" % (
+                job.state, job.done, job.written / 1024 / 1024, job.duration))
+            button.set_sensitive(False)
+        progress_bar.set_fraction(job.fraction())
+
+    def update(self):
+        for job in self.jobs:
+            self.update_job(job)
+        return True
+
+    def on_cancel(self, widget, job):
+        job.cancel()
+        widget.set_sensitive(False)
+
+    def on_destroy(self, window):
+        GLib.source_remove(self.timeout)
+        self.jobs = {}
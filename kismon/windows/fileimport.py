@@ -1,17 +1,18 @@
 import os
-import sys
 
 from gi.repository import Gtk
 from gi.repository import GLib
 from gi.repository import GObject
 
+from kismon.importer import COMPRESSED_EXTENSIONS, EXTENSIONS, FILETYPES, guess_filetype
+
 
 class FileImportWindow:
     def __init__(self, networks, networks_queue_progress):
         self.networks = networks
         self.networks_queue_progress = networks_queue_progress
         self.files = {}
-        self.parser_queue = ()
+        self.pipeline = None
         self.gtkwin = Gtk.Window()
         self.gtkwin.set_position(Gtk.WindowPosition.CENTER)
         self.gtkwin.set_default_size(700, 300)
@@ -56,9 +57,10 @@ class FileImportWindow:
         if add_type == "file":
             filter = Gtk.FileFilter()
             filter.set_name("All supported files")
-            filter.add_pattern("*.netxml")
-            filter.add_pattern("*.csv")
-            filter.add_pattern("*.json")
+            for extension in EXTENSIONS:
+                filter.add_pattern("*" + extension)
+                for compressed_extension in COMPRESSED_EXTENSIONS:
+                    filter.add_pattern("*" + extension + compressed_extension)
             dialog.add_filter(filter)
 
             filter = Gtk.FileFilter()
@@ -97,18 +99,10 @@ class FileImportWindow:
 
         combobox = Gtk.ComboBoxText()
         combobox.connect("changed", self.on_filetype_changed, filename)
-        combobox.append_text("netxml")
-        combobox.append_text("csv")
-        combobox.append_text("networks")
-        combobox.append_text("unknown")
-        if filename.endswith(".netxml"):
-            combobox.set_active(0)
-        elif filename.endswith(".csv"):
-            combobox.set_active(1)
-        elif filename.endswith(".json"):
-            combobox.set_active(2)
-        else:
-            combobox.set_active(3)
+        filetypes = FILETYPES + ("unknown",)
+        for filetype in filetypes:
+            combobox.append_text(filetype)
+        combobox.set_active(filetypes.index(guess_filetype(filename)))
         table.attach(combobox, 0, 1, 0, 1, yoptions=Gtk.AttachOptions.SHRINK, xoptions=Gtk.AttachOptions.SHRINK)
 
         label = Gtk.Label(label=filename)
@@ -180,47 +174,43 @@ class FileImportWindow:
 
         main_box.pack_end(button_box, expand=False, fill=True, padding=0)
         self.gtkwin.show_all()
-        self.parser_queue = list(self.files.keys())
-        if len(self.parser_queue) == 0:
+        files = [(filename, self.files[filename]["filetype"]) for filename in self.files]
+        for filename, filetype in files:
+            self.files[filename]["row"] = self.file_list_treestore.append([filename, filetype, 0, 0, "queued"])
+        if len(files) == 0:
             self.close_button.set_sensitive(True)
         else:
             self.networks.block_queue_start = True
-            GLib.idle_add(self.parse_file)
+            self.pipeline = self.networks.import_files(files)
+            GLib.timeout_add(10, self.parse_file)
 
     def parse_file(self):
-        filename = self.parser_queue.pop()
-        filetype = self.files[filename]["filetype"]
-        print("Reading %s" % filename)
-        num_new = 0 - len(self.networks.networks)
-        if filetype != "unknown":
-            try:
-                num_networks = self.networks.import_networks(filetype, filename)
-                status = "done"
-            except:
-                status = "failed"
-                num_networks = 0
-                print("%s: %s" % (filename, sys.exc_info()[1]))
-        else:
-            num_networks = 0
-            status = "skiped"
-
-        num_new = num_new + len(self.networks.networks)
-
-        self.file_list_treestore.append([filename, filetype, num_networks, num_new, status])
-
-        num_files = len(self.files)
-        pos = num_files - len(self.parser_queue)
-
+        """Merge the parsed networks for a time slice and show the progress of the files
+        """
+        if self.pipeline is None:
+            return False
+        running = self.pipeline.step()
+        for import_file in self.pipeline.files:
+            row = self.files[import_file.filename]["row"]
+            self.file_list_treestore.set(row, 2, import_file.networks, 3, import_file.new, 4, import_file.progress())
+            if import_file.error is not None and "error" not in self.files[import_file.filename]:
+                self.files[import_file.filename]["error"] = import_file.error
+                print("%s: %s" % (import_file.filename, import_file.error))
+
+        num_files = len(self.pipeline.files)
+        pos = self.pipeline.files_done()
         self.progress_bar.set_text("%s of %s Files" % (pos, num_files))
         self.progress_bar.set_fraction(1.0 / num_files * pos)
 
-        print("Parsing done")
-        if len(self.parser_queue) == 0:
+        if not running:
+            self.pipeline = None
             self.close_button.set_sensitive(True)
-        else:
-            return True
+        return running
 
     def on_close(self, widget):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
         self.gtkwin.destroy()
         self.networks.block_queue_start = False
         self.networks.disable_refresh()
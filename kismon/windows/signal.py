@@ -246,7 +246,23 @@ class SignalWindow:
 
         return color
 
-    def add_value(self, source_data, packets, signal, timestamp, server_id):
+    def load_history(self, history, sources):
+        """Show the recorded values, history: (server_id, uuid) -> [(timestamp, signal, packets)]
+        """
+        values = []
+        for (server_id, source_uuid), entries in history.items():
+            try:
+                source_data = sources[server_id][source_uuid]
+            except KeyError:
+                continue
+            for timestamp, signal, packets in entries:
+                values.append((int(timestamp), server_id, source_data, signal, packets))
+        values.sort(key=lambda value: value[0])
+        for timestamp, server_id, source_data, signal, packets in values:
+            self.add_value(source_data, packets, signal, timestamp, server_id, draw=False)
+        self.graph.queue_draw()
+
+    def add_value(self, source_data, packets, signal, timestamp, server_id, draw=True):
         uuid = "%i-%s" % (server_id, source_data["uuid"])
         if uuid not in self.sources:
             self.sources[uuid] = source_data
@@ -268,5 +284,11 @@ class SignalWindow:
 
         if timestamp not in self.history:
             self.history[timestamp] = {}
+            if len(self.history) > self.time_range * 2:
+                # only the visible time range is kept
+                start_sec = timestamp - self.time_range
+                for sec in [sec for sec in self.history if sec < start_sec]:
+                    del self.history[sec]
         self.history[timestamp][uuid] = (signal, source["pps"])
-        self.graph.queue_draw()
+        if draw:
+            self.graph.queue_draw()